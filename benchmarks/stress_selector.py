@@ -0,0 +1,333 @@
+"""
+Selector stress test: synthetic libraries of placeholder MP3 files are
+loaded into the song selector logic without a window, and every list
+operation is timed at each library size to show how its cost grows.
+Fails when an operation grows faster than --max-exponent.
+
+    python benchmarks/stress_selector.py --sizes 1000 10000 100000
+"""
+import argparse
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tkinter as tk
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import combine_audio as ca
+
+STRESS_LIBRARY_SIZES = (1000, 10000, 100000)
+STRESS_MAX_EXPONENT = 1.5  # an operation growing faster than this fails the run
+STRESS_MOVES = 200  # calls timed per move action
+STRESS_ARTISTS = ["Daft Punk", "Björk", "Sigur Rós", "Mötley Crüe", "Beyoncé", "Andrius Mamontovas",
+                  "Jurga", "Foje", "The Chemical Brothers", "Massive Attack", "Boards of Canada",
+                  "Röyksopp", "Aphex Twin", "DJ Shadow", "Moderat", "Bonobo", "Kraftwerk", "M83",
+                  "Fatboy Slim", "Nina Simone", "Žalvarinis", "Radiohead", "Portishead", "Air"]
+STRESS_WORDS = ["Night", "Summer", "Love", "Dreams", "City", "Lights", "Rain", "Gold", "Heart", "Fire",
+                "Ocean", "Echo", "Midnight", "Sun", "Road", "Home", "Electric", "Paradise", "Shadow",
+                "Vasara", "Naktis", "Šviesa", "Forever", "Wild", "Blue", "Silence", "Stars", "Dance"]
+STRESS_VERSIONS = ["Radio Edit", "Extended Mix", "Remastered 2011", "Live", "Acoustic", "Club Mix",
+                   "feat. MC Lyte", "Original Mix"]
+# ModernSongSelector methods that hold the selection logic (no Tk window needed)
+SELECTOR_METHODS = ["init_state", "load_songs", "scan_songs", "poll_loaded_songs", "add_loaded_songs",
+                    "finish_loading", "update_loaded_label", "filter_songs", "add_selected_songs",
+                    "remove_selected_songs", "move_up", "move_down", "move_to_top", "move_to_bottom",
+                    "shuffle_playlist", "update_info_label", "clean_filename", "restore_selected_songs"]
+
+def synthetic_song_names(count, seed=1):
+    """Unique, realistic looking MP3 file names (numbering, underscores, versions, accents)"""
+    rng = random.Random(seed)
+    names = []
+    taken = set()
+    while len(names) < count:
+        artist = rng.choice(STRESS_ARTISTS)
+        title = " ".join(rng.sample(STRESS_WORDS, rng.randint(1, 3)))
+        if rng.random() < 0.25:
+            title += f" ({rng.choice(STRESS_VERSIONS)})"
+        number = len(names) % 400 + 1
+        style = rng.randrange(5)
+        if style == 0:
+            name = f"{number:02d}. {artist} - {title}.mp3"
+        elif style == 1:
+            name = f"{artist} - {title}.mp3"
+        elif style == 2:
+            name = f"{number:03d}_{artist.replace(' ', '_')}-{title.replace(' ', '_')}.mp3"
+        elif style == 3:
+            name = f"{artist} feat. {rng.choice(STRESS_ARTISTS)} - {title}.MP3"
+        else:
+            name = f"{number}-{title}.mp3"
+        if name in taken:
+            stem, extension = os.path.splitext(name)
+            name = f"{stem} ({len(names)}){extension}"
+        taken.add(name)
+        names.append(name)
+    return names
+
+def create_synthetic_library(folder, count, seed=1):
+    """Creates count empty placeholder MP3 files (plus some cover art and playlists); returns the song names"""
+    names = synthetic_song_names(count, seed)
+    os.makedirs(folder, exist_ok=True)
+    extras = [f"cover_{i}.jpg" for i in range(count // 200)] + [f"playlist_{i}.m3u" for i in range(count // 500)]
+    for name in names + extras:
+        open(os.path.join(folder, name), "wb").close()
+    return names
+
+class HeadlessListbox:
+    """Listbox stand-in with the calls the song selector makes"""
+    def __init__(self):
+        self.items = []
+        self.selection = set()
+
+    def insert(self, index, *items):
+        if index == tk.END:
+            self.items.extend(items)
+        else:
+            self.items[index:index] = items
+
+    def delete(self, first, last=None):
+        if last == tk.END:
+            del self.items[first:]
+        else:
+            del self.items[first:(first if last is None else last) + 1]
+
+    def get(self, first, last=None):
+        if last == tk.END:
+            return tuple(self.items[first:])
+        return self.items[first]
+
+    def size(self):
+        return len(self.items)
+
+    def curselection(self):
+        return tuple(sorted(self.selection))
+
+    def selection_clear(self, first, last=None):
+        self.selection.clear()
+
+    def selection_set(self, index):
+        self.selection.add(index)
+
+    def see(self, index):
+        pass
+
+    def config(self, **options):
+        pass
+
+class HeadlessLabel:
+    def __init__(self):
+        self.text = ""
+
+    def config(self, text=None, **options):
+        if text is not None:
+            self.text = text
+
+class HeadlessVar:
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+class HeadlessSongSelector:
+    """
+    Song selector without a window: the widgets are plain Python stand-ins
+    and after() callbacks are run by run_pending() instead of the Tk loop.
+    The selection logic is the real one, borrowed from ModernSongSelector
+    method by method, so no half-initialised Toplevel is ever created and
+    a Tk call the stand-ins do not cover fails loudly.
+    """
+    LOAD_BATCH_SIZE = ca.ModernSongSelector.LOAD_BATCH_SIZE
+    LOAD_POLL_MS = ca.ModernSongSelector.LOAD_POLL_MS
+    LOAD_TICK_SECONDS = ca.ModernSongSelector.LOAD_TICK_SECONDS
+
+    def __init__(self, input_folder, current_selected_songs=None):
+        self.init_state(input_folder, lambda songs: None, current_selected_songs)
+        self.songs_listbox = HeadlessListbox()
+        self.playlist_listbox = HeadlessListbox()
+        self.songs_label = HeadlessLabel()
+        self.info_label = HeadlessLabel()
+        self.search_var = HeadlessVar("")
+        self.smart_order = HeadlessVar(False)
+        self.scheduled = []
+        self.callback_seconds = []
+
+    def after(self, ms, callback, *args):
+        self.scheduled.append((time.perf_counter() + ms / 1000, callback, args))
+
+    def run_pending(self):
+        """Runs the scheduled callbacks when they are due until none are left"""
+        while self.scheduled:
+            self.scheduled.sort(key=lambda item: item[0])
+            due, callback, args = self.scheduled.pop(0)
+            if due > time.perf_counter():
+                time.sleep(due - time.perf_counter())
+            started = time.perf_counter()
+            callback(*args)
+            self.callback_seconds.append(time.perf_counter() - started)
+
+    def clear_playlist(self):
+        """Empties the playlist between timed operations"""
+        self.selected_songs = []
+        self.selected_set = set()
+        self.playlist_listbox.delete(0, tk.END)
+
+    def winfo_exists(self):
+        return True
+
+    def update(self):
+        pass
+
+    def destroy(self):
+        pass
+
+for name in SELECTOR_METHODS:
+    setattr(HeadlessSongSelector, name, getattr(ca.ModernSongSelector, name))
+
+def timed(function, *args):
+    """Seconds one call takes"""
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+def stress_selector_once(folder, names, rng):
+    """
+    Runs every selector operation once on a loaded library. The playlist
+    holds 1% of the library (at least 10 songs). Returns {operation:
+    seconds}, per call for the move actions.
+    """
+    playlist_size = max(10, len(names) // 100)
+    previous = rng.sample(names, playlist_size)
+    selector = HeadlessSongSelector(folder, previous)
+    results = {}
+
+    # Įkėlimas su tikrais laukimais tarp Tk ciklo kvietimų
+    started = time.perf_counter()
+    selector.load_songs()
+    selector.run_pending()
+    results["load"] = time.perf_counter() - started
+    results["load_longest_tick"] = max(selector.callback_seconds)
+    if len(selector.all_songs) != len(names) or selector.selected_songs != previous:
+        raise RuntimeError("Loading did not list every song or restore the previous selection")
+
+    selector.clear_playlist()
+    selector.pending_restore = set(previous)
+    results["restore"] = timed(selector.restore_selected_songs, selector.all_songs)
+    if selector.selected_songs != previous:
+        raise RuntimeError("Restoring changed the order of the previous selection")
+
+    queries = [rng.choice(STRESS_ARTISTS).lower(), rng.choice(STRESS_WORDS).lower(), "no such song"]
+    filter_seconds = []
+    for query in queries:
+        selector.search_var.set(query)
+        filter_seconds.append(timed(selector.filter_songs))
+    results["filter"] = sum(filter_seconds) / len(filter_seconds)
+    selector.search_var.set("")
+    results["filter_clear"] = timed(selector.filter_songs)
+
+    selector.clear_playlist()
+    selector.songs_listbox.selection = set(rng.sample(range(len(selector.visible_songs)), playlist_size))
+    results["add"] = timed(selector.add_selected_songs)
+    if len(selector.selected_songs) != playlist_size:
+        raise RuntimeError("Adding did not add every selected song")
+
+    for action in ("move_up", "move_down", "move_to_top", "move_to_bottom"):
+        seconds = 0.0
+        for _ in range(STRESS_MOVES):
+            selector.playlist_listbox.selection = {rng.randrange(playlist_size)}
+            seconds += timed(getattr(selector, action))
+        results[action] = seconds / STRESS_MOVES
+
+    before = sorted(selector.selected_songs)
+    results["shuffle"] = timed(selector.shuffle_playlist)
+    if sorted(selector.selected_songs) != before or selector.playlist_listbox.size() != playlist_size:
+        raise RuntimeError("Shuffling lost songs")
+
+    selector.playlist_listbox.selection = set(rng.sample(range(playlist_size), playlist_size // 2))
+    results["remove"] = timed(selector.remove_selected_songs)
+    if len(selector.selected_songs) != playlist_size - playlist_size // 2:
+        raise RuntimeError("Removing did not remove every selected song")
+    return results
+
+def stress_selector(sizes=STRESS_LIBRARY_SIZES, repeats=3, seed=1, folder=None, progress_callback=None):
+    """
+    Times the selector operations on synthetic libraries of the given sizes
+    (created in folder, or a temporary folder that is removed afterwards).
+    Returns {size: {operation: median seconds}}.
+    """
+    base_folder = folder or tempfile.mkdtemp(prefix="selector_stress_")
+    rng = random.Random(seed)
+    results = {}
+    try:
+        for size in sizes:
+            library = os.path.join(base_folder, f"library_{size}")
+            if progress_callback:
+                progress_callback(len(results), len(sizes), f"Creating a library of {size} songs")
+            shutil.rmtree(library, ignore_errors=True)
+            names = create_synthetic_library(library, size, seed)
+            runs = []
+            for i in range(repeats):
+                if progress_callback:
+                    progress_callback(len(results), len(sizes), f"{size} songs: run {i + 1} of {repeats}")
+                runs.append(stress_selector_once(library, names, rng))
+            results[size] = {operation: sorted(run[operation] for run in runs)[len(runs) // 2]
+                             for operation in runs[0]}
+            if folder is None:
+                shutil.rmtree(library, ignore_errors=True)
+    finally:
+        if folder is None:
+            shutil.rmtree(base_folder, ignore_errors=True)
+    return results
+
+def scaling_exponent(sizes, seconds):
+    """Least squares slope of log(time) over log(size): 1 means linear, 2 quadratic"""
+    points = [(math.log(size), math.log(max(value, 1e-9))) for size, value in zip(sizes, seconds)]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return None
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+def main(argv=None):
+    """Times the song selector operations on synthetic libraries and reports how they scale"""
+    parser = argparse.ArgumentParser(description="Time the song selector on large synthetic libraries")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(STRESS_LIBRARY_SIZES),
+                        help="library sizes to test (placeholder MP3 files)")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per size (the median is reported)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--folder", help="create the libraries here and keep them (default: a temporary folder)")
+    parser.add_argument("--max-exponent", type=float, default=STRESS_MAX_EXPONENT,
+                        help=f"fail if an operation grows faster than size to this power "
+                             f"(default: {STRESS_MAX_EXPONENT})")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(args.sizes)
+    results = stress_selector(sizes, args.repeats, args.seed, args.folder, progress_callback=ca.print_progress)
+    operations = list(results[sizes[0]])
+    print(f"{'operation':<20}" + "".join(f"{f'{size} songs':>16}" for size in sizes) + f"{'scaling':>10}")
+    too_slow = []
+    for operation in operations:
+        seconds = [results[size][operation] for size in sizes]
+        exponent = scaling_exponent(sizes, seconds)
+        row = f"{operation:<20}" + "".join(f"{value * 1000:>13.3f} ms" for value in seconds)
+        if exponent is not None:
+            row += f"{f'n^{exponent:.2f}':>10}"
+            if exponent > args.max_exponent:
+                too_slow.append(operation)
+                row += "  too slow"
+        print(row)
+    if too_slow:
+        print(f"FAILED: {', '.join(too_slow)} grow faster than n^{args.max_exponent}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
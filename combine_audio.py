@@ -8,9 +8,51 @@ from tkinter import filedialog, ttk, messagebox, Text, Scrollbar, Listbox
 from pathlib import Path
 from pydub import AudioSegment
 from pydub import silence as pydub_silence
+from pydub import playback as pydub_playback
+from pydub import utils as pydub_utils
 import io
 import math
 import re
+import json
+import time
+import subprocess
+import threading
+import shutil
+import sys
+import argparse
+import queue
+import socket
+import socketserver
+import struct
+import tempfile
+import multiprocessing
+import hashlib
+import hmac
+import secrets
+import asyncio
+import urllib.request
+import urllib.error
+import collections
+import http.server
+import glob
+import array
+import wave
+import zipfile
+import bisect
+import contextlib
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import simpleaudio
+except ImportError:  # optional, starts playback faster than ffplay
+    simpleaudio = None
 
 class StarryBackground(tk.Canvas):
     def __init__(self, master, *args, **kwargs):
@@ -113,17 +155,15 @@ class CustomEntry(tk.Frame):
         self.entry.pack(fill='both', expand=True)
 
 class ModernSongSelector(tk.Toplevel):
+    LOAD_BATCH_SIZE = 500  # songs per batch from the background scanner
+    LOAD_POLL_MS = 20
+    LOAD_TICK_SECONDS = 0.03  # longest time one poll may spend inserting songs
+
     def __init__(self, parent, input_folder, selected_callback, current_selected_songs=None):
         super().__init__(parent)
         self.title("Song Selection")
         self.parent = parent
-        self.input_folder = input_folder
-        self.selected_callback = selected_callback
-        
-        # Variables
-        self.all_songs = []  # all mp3 files in folder
-        self.selected_songs = []  # selected songs
-        self.previously_selected_songs = current_selected_songs or []  # store previously selected songs
+        self.init_state(input_folder, selected_callback, current_selected_songs)
         
         # Set window state to maximized
         self.state('zoomed')
@@ -135,13 +175,36 @@ class ModernSongSelector(tk.Toplevel):
         
         # Create UI
         self.create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self.cancel)
         
-        # Load songs
+        # Load songs in the background (previous selections are restored as they arrive)
         self.load_songs()
         
-        # Restore previously selected songs if any
-        if self.previously_selected_songs:
-            self.restore_selected_songs()
+    def init_state(self, input_folder, selected_callback, current_selected_songs=None):
+        """Pasirinkimo būsena atskirai nuo valdiklių (apkrovos testas ją naudoja be lango)"""
+        self.input_folder = input_folder
+        self.selected_callback = selected_callback
+        
+        # Variables
+        self.all_songs = []  # mp3 files loaded so far
+        self.visible_songs = []  # songs shown in the list (search results), in list order
+        self.songs_total = None  # number of mp3 files, once the scanner has listed the folder
+        self.loading = False
+        self.selected_songs = []  # selected songs
+        self.selected_set = set()  # the same songs, for membership checks
+        self.previously_selected_songs = current_selected_songs or []  # store previously selected songs
+        # Ankstesni pasirinkimai atkuriami, kai jų dainos įkeliamos
+        self.restore_order = {filename: i for i, filename in enumerate(self.previously_selected_songs)}
+        self.pending_restore = set(self.previously_selected_songs)
+        
+        # Waveform shown for the last clicked song (computed in a background thread if not cached)
+        self.waveform_song = None
+        self.waveform_pyramid = None
+        self.waveform_results = queue.Queue()
+        self.waveform_poll = None  # after() handle of the only poll loop
+        
+        # Snippet player, created on first use
+        self.player = None
         
     def create_widgets(self):
         # Main container
@@ -186,12 +249,12 @@ class ModernSongSelector(tk.Toplevel):
         left_frame = tk.Frame(list_frame, bg='#121212')
         left_frame.pack(side='left', fill='both', expand=True, padx=(0, 10))
         
-        songs_label = tk.Label(left_frame, 
+        self.songs_label = tk.Label(left_frame, 
                             text="Available Songs", 
                             font=('Segoe UI', 14, 'bold'), 
                             fg='white', 
                             bg='#121212')
-        songs_label.pack(anchor='w', pady=(0, 5))
+        self.songs_label.pack(anchor='w', pady=(0, 5))
         
         songs_frame = tk.Frame(left_frame, bg='#1e1e1e', bd=0)
         songs_frame.pack(fill='both', expand=True)
@@ -221,6 +284,13 @@ class ModernSongSelector(tk.Toplevel):
         remove_btn = CustomButton(mid_frame, text="←", command=self.remove_selected_songs, width=50, height=40)
         remove_btn.pack(pady=5)
         
+        # Snippet audition (double-click a song to hear its intro)
+        listen_btn = CustomButton(mid_frame, text="▶", command=self.audition_song, width=50, height=40)
+        listen_btn.pack(pady=(25, 5))
+        
+        stop_btn = CustomButton(mid_frame, text="■", command=self.stop_audition, width=50, height=40)
+        stop_btn.pack(pady=5)
+        
         # Right side - selected songs with control buttons
         right_frame = tk.Frame(list_frame, bg='#121212')
         right_frame.pack(side='left', fill='both', expand=True, padx=(10, 0))
@@ -273,6 +343,36 @@ class ModernSongSelector(tk.Toplevel):
         shuffle_btn = CustomButton(order_frame, text="🔀 Shuffle", command=self.shuffle_playlist, width=120, height=40)
         shuffle_btn.pack(pady=5)
         
+        # Smart order mode for the shuffle button (tempo, key and energy)
+        self.smart_order = tk.BooleanVar(value=False)
+        smart_order_check = tk.Checkbutton(order_frame,
+                                         text="Auto-order",
+                                         variable=self.smart_order,
+                                         font=('Segoe UI', 11),
+                                         fg='white',
+                                         bg='#121212',
+                                         selectcolor='#2a2a2a',
+                                         activeforeground='white',
+                                         activebackground='#121212')
+        smart_order_check.pack(pady=5)
+        
+        # Transition preview buttons
+        preview_btn = CustomButton(order_frame, text="▶ Transition", command=self.preview_selected_transition, width=120, height=40)
+        preview_btn.pack(pady=5)
+        
+        preview_all_btn = CustomButton(order_frame, text="▶▶ All", command=self.preview_all_selected_transitions, width=120, height=40)
+        preview_all_btn.pack(pady=5)
+        
+        # Waveform of the selected song
+        self.waveform_canvas = tk.Canvas(main_frame, bg='#1e1e1e', height=80, highlightthickness=0)
+        self.waveform_canvas.pack(fill='x', pady=(10, 0))
+        self.waveform_canvas.bind("<Configure>", lambda event: self.redraw_waveform())
+        
+        self.songs_listbox.bind("<<ListboxSelect>>", self.on_available_song_select)
+        self.playlist_listbox.bind("<<ListboxSelect>>", self.on_playlist_song_select)
+        self.songs_listbox.bind("<Double-Button-1>", lambda event: self.audition_song("intro"))
+        self.playlist_listbox.bind("<Double-Button-1>", lambda event: self.audition_song("intro"))
+        
         # Bottom buttons
         bottom_frame = tk.Frame(main_frame, bg='#121212')
         bottom_frame.pack(fill='x', pady=(20, 0))
@@ -300,7 +400,7 @@ class ModernSongSelector(tk.Toplevel):
         self.info_label.pack(pady=(10, 0))
     
     def load_songs(self):
-        """Užkrauna visas MP3 dainas iš pasirinkto aplanko"""
+        """Pradeda MP3 dainų įkėlimą fone; langas rodomas iš karto"""
         if not self.input_folder or not os.path.exists(self.input_folder):
             messagebox.showerror("Klaida", "Prašome pasirinkti įvesties aplanką!")
             self.destroy()
@@ -308,28 +408,92 @@ class ModernSongSelector(tk.Toplevel):
             
         # Išvalyti sąrašus
         self.all_songs = []
+        self.visible_songs = []
+        self.songs_total = None
         self.songs_listbox.delete(0, tk.END)
         
-        # Gauti sąrašą MP3 failų
-        mp3_files = [f for f in os.listdir(self.input_folder) if f.lower().endswith('.mp3')]
-        
-        # Sukurti dainos objektus
-        for mp3_file in mp3_files:
-            display_name = self.clean_filename(mp3_file)
-            self.all_songs.append({"filename": mp3_file, "display": display_name})
-            self.songs_listbox.insert(tk.END, display_name)
+        # Aplanką skaito ir pavadinimus paruošia foninė gija, Tk gija tik įterpia paketus
+        self.loading = True
+        batches = queue.Queue()
+        threading.Thread(target=self.scan_songs, args=(self.input_folder, batches), daemon=True).start()
+        self.update_loaded_label()
+        self.after(self.LOAD_POLL_MS, self.poll_loaded_songs, batches)
+    
+    def scan_songs(self, input_folder, batches):
+        """Foninė gija: siunčia dainų skaičių, tada dainas paketais (None - pabaiga)"""
+        try:
+            mp3_files = [f for f in os.listdir(input_folder) if f.lower().endswith('.mp3')]
+        except OSError as e:
+            batches.put(e)
+            return
+        batches.put(len(mp3_files))
+        for start in range(0, len(mp3_files), self.LOAD_BATCH_SIZE):
+            batches.put([{"filename": mp3_file, "display": self.clean_filename(mp3_file)}
+                         for mp3_file in mp3_files[start:start + self.LOAD_BATCH_SIZE]])
+        batches.put(None)
+    
+    def poll_loaded_songs(self, batches):
+        """Įterpia paruoštus paketus, bet neilgiau nei LOAD_TICK_SECONDS per kartą"""
+        if not self.winfo_exists():
+            return
+        deadline = time.time() + self.LOAD_TICK_SECONDS
+        try:
+            while True:
+                batch = batches.get_nowait()
+                if batch is None:
+                    self.finish_loading()
+                    return
+                if isinstance(batch, Exception):
+                    self.loading = False
+                    messagebox.showerror("Error", f"Could not list songs: {batch}")
+                    return
+                if isinstance(batch, int):
+                    self.songs_total = batch
+                else:
+                    self.add_loaded_songs(batch)
+                if time.time() >= deadline:
+                    break
+        except queue.Empty:
+            pass
+        self.update_loaded_label()
+        self.after(self.LOAD_POLL_MS, self.poll_loaded_songs, batches)
+    
+    def add_loaded_songs(self, songs):
+        """Prideda įkeltą paketą; paieška taikoma ir naujoms dainoms"""
+        self.all_songs.extend(songs)
+        search_text = self.search_var.get().lower()
+        shown = [song for song in songs if search_text in song["display"].lower()] if search_text else songs
+        if shown:
+            self.visible_songs.extend(shown)
+            self.songs_listbox.insert(tk.END, *[song["display"] for song in shown])
+        if self.pending_restore:
+            self.restore_selected_songs(songs)
+    
+    def finish_loading(self):
+        self.loading = False
+        # Dainos, kurių aplanke nebėra, neatkuriamos
+        self.pending_restore.clear()
+        self.update_loaded_label()
+    
+    def update_loaded_label(self):
+        """Rodo, kiek dainų jau įkelta"""
+        if self.loading:
+            total = "?" if self.songs_total is None else self.songs_total
+            self.songs_label.config(text=f"Available Songs ({len(self.all_songs)} of {total} loaded)")
+        else:
+            self.songs_label.config(text=f"Available Songs ({len(self.all_songs)})")
     
     def filter_songs(self, *args):
-        """Filtruoja dainas pagal paieškos tekstą"""
+        """Filtruoja jau įkeltas dainas pagal paieškos tekstą"""
         search_text = self.search_var.get().lower()
         
         # Išvalyti sąrašą
         self.songs_listbox.delete(0, tk.END)
         
         # Pridėti filtruotas dainas
-        for song in self.all_songs:
-            if search_text in song["display"].lower():
-                self.songs_listbox.insert(tk.END, song["display"])
+        self.visible_songs = [song for song in self.all_songs if search_text in song["display"].lower()]
+        if self.visible_songs:
+            self.songs_listbox.insert(tk.END, *[song["display"] for song in self.visible_songs])
     
     def add_selected_songs(self):
         """Prideda pasirinktas dainas į grojaraštį"""
@@ -340,14 +504,11 @@ class ModernSongSelector(tk.Toplevel):
             
         # Eiti per visus pasirinktus indeksus
         for index in selected_indices:
-            display_name = self.songs_listbox.get(index)
-            
-            # Rasti atitinkamą failą
-            for song in self.all_songs:
-                if song["display"] == display_name and song["filename"] not in self.selected_songs:
-                    self.selected_songs.append(song["filename"])
-                    self.playlist_listbox.insert(tk.END, display_name)
-                    break
+            song = self.visible_songs[index]
+            if song["filename"] not in self.selected_set:
+                self.selected_songs.append(song["filename"])
+                self.selected_set.add(song["filename"])
+                self.playlist_listbox.insert(tk.END, song["display"])
         
         # Atnaujinti informacijos etiketę
         self.update_info_label()
@@ -363,6 +524,7 @@ class ModernSongSelector(tk.Toplevel):
         for index in sorted(selected_indices, reverse=True):
             filename = self.selected_songs[index]
             self.selected_songs.pop(index)
+            self.selected_set.discard(filename)
             self.playlist_listbox.delete(index)
         
         # Atnaujinti informacijos etiketę
@@ -486,7 +648,12 @@ class ModernSongSelector(tk.Toplevel):
                                [self.playlist_listbox.get(i) for i in range(self.playlist_listbox.size())]))
         
         # Sumaišyti tvarką
-        random.shuffle(current_order)
+        if self.smart_order.get():
+            display_names = dict(current_order)
+            ordered_files = self.auto_order_files(self.selected_songs)
+            current_order = [(filename, display_names[filename]) for filename in ordered_files]
+        else:
+            random.shuffle(current_order)
         
         # Atnaujinti sąrašus
         self.selected_songs = [item[0] for item in current_order]
@@ -495,6 +662,153 @@ class ModernSongSelector(tk.Toplevel):
         for item in current_order:
             self.playlist_listbox.insert(tk.END, item[1])
     
+    def auto_order_files(self, files):
+        """Surikiuoja dainas pagal tempą, tonaciją ir energiją"""
+        def show_progress(done, total, filename):
+            self.info_label.config(text=f"Analysing songs: {done}/{total}")
+            self.update()
+        
+        try:
+            return auto_order_songs(self.input_folder, files, progress_callback=show_progress)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not analyse songs: {str(e)}")
+            return list(files)
+        finally:
+            self.update_info_label()
+    
+    def preview_selected_transition(self):
+        """Perklauso perėjimą tarp pažymėtos ir sekančios dainos"""
+        selected = self.playlist_listbox.curselection()
+        
+        if not selected or selected[0] >= len(self.selected_songs) - 1:
+            messagebox.showinfo("Preview", "Select a song that has another song after it.")
+            return
+            
+        idx = selected[0]
+        self.info_label.config(text="Rendering transition preview...")
+        self.update()
+        
+        try:
+            preview = preview_transition(self.input_folder, self.selected_songs[idx], self.selected_songs[idx + 1])
+            play_audio(preview)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not preview transition: {str(e)}")
+        finally:
+            self.update_info_label()
+    
+    def preview_all_selected_transitions(self):
+        """Sugeneruoja visų grojaraščio perėjimų peržiūras"""
+        if len(self.selected_songs) < 2:
+            return
+        
+        def show_progress(done, total):
+            self.info_label.config(text=f"Rendering transitions: {done}/{total}")
+            self.update()
+        
+        # Išvalyti senas peržiūras
+        output_folder = os.path.join(self.input_folder, CACHE_DIR_NAME, "previews")
+        if os.path.exists(output_folder):
+            for old_file in os.listdir(output_folder):
+                if old_file.startswith("Transition_"):
+                    os.remove(os.path.join(output_folder, old_file))
+        
+        self.info_label.config(text="Rendering transitions...")
+        self.update()
+        
+        try:
+            previews = preview_all_transitions(self.input_folder, self.selected_songs,
+                                               output_folder=output_folder,
+                                               progress_callback=show_progress)
+            saved = sum(preview is not None for preview in previews)
+            messagebox.showinfo("Preview", f"{saved} transition previews saved to:\n{output_folder}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not preview transitions: {str(e)}")
+        finally:
+            self.update_info_label()
+    
+    def on_available_song_select(self, event=None):
+        """Rodo paspaustos dainos bangos formą"""
+        selected = self.songs_listbox.curselection()
+        if not selected:
+            return
+        self.show_waveform(self.visible_songs[selected[-1]]["filename"])
+    
+    def on_playlist_song_select(self, event=None):
+        """Rodo pažymėtos grojaraščio dainos bangos formą"""
+        selected = self.playlist_listbox.curselection()
+        if selected:
+            self.show_waveform(self.selected_songs[selected[0]])
+    
+    def show_waveform(self, filename):
+        """Parodo dainos bangos formą iš talpyklos arba paskaičiuoja ją fone"""
+        self.waveform_song = filename
+        self.stop_waveform_poll()
+        # Ištrauka dekoduojama iš anksto, kad ▶ grotų iškart
+        self.get_player().prefetch(filename)
+        self.waveform_pyramid = load_track_peaks(self.input_folder, filename)
+        self.redraw_waveform()
+        
+        if self.waveform_pyramid is None:
+            def compute():
+                try:
+                    pyramid = load_track_peaks(self.input_folder, filename, compute=True)
+                except Exception as e:
+                    print(f"Waveform error ({filename}): {e}")
+                    pyramid = None
+                self.waveform_results.put((filename, pyramid))
+            
+            threading.Thread(target=compute, daemon=True).start()
+            self.waveform_poll = self.after(50, self.poll_waveform)
+    
+    def poll_waveform(self):
+        """Laukia dabartinės dainos bangos formos; kitų dainų rezultatai išmetami"""
+        self.waveform_poll = None
+        try:
+            while True:
+                filename, pyramid = self.waveform_results.get_nowait()
+                if filename == self.waveform_song:
+                    # Net nepavykęs skaičiavimas (None) baigia laukimą
+                    self.waveform_pyramid = pyramid
+                    self.redraw_waveform()
+                    return
+        except queue.Empty:
+            self.waveform_poll = self.after(50, self.poll_waveform)
+    
+    def stop_waveform_poll(self):
+        if self.waveform_poll is not None:
+            self.after_cancel(self.waveform_poll)
+            self.waveform_poll = None
+    
+    def redraw_waveform(self):
+        draw_waveform(self.waveform_canvas, self.waveform_pyramid)
+    
+    def get_player(self):
+        if self.player is None:
+            self.player = SnippetPlayer(self.input_folder)
+        return self.player
+    
+    def audition_song(self, position="middle"):
+        """Groja paskutinės paspaustos dainos ištrauką (vidurį arba pradžią)"""
+        filename = self.waveform_song
+        if not filename:
+            self.info_label.config(text="Click a song to listen to it")
+            return
+        self.info_label.config(text=f"Playing: {self.clean_filename(filename)}")
+        started = self.get_player().play(filename, position)
+        self.after(20, self.poll_audition, started, filename)
+    
+    def poll_audition(self, started, filename):
+        """Laukia, kol ištrauka pradės groti, nestabdydamas Tk ciklo"""
+        if not started.done():
+            self.after(20, self.poll_audition, started, filename)
+        elif started.exception() is not None:
+            self.info_label.config(text=f"Could not play {self.clean_filename(filename)}: {started.exception()}")
+    
+    def stop_audition(self):
+        if self.player is not None:
+            self.player.stop()
+        self.update_info_label()
+    
     def update_info_label(self):
         """Atnaujina informacijos etiketę"""
         count = len(self.selected_songs)
@@ -502,16 +816,28 @@ class ModernSongSelector(tk.Toplevel):
     
     def confirm_selection(self):
         """Patvirtina pasirinktų dainų tvarką"""
+        if self.pending_restore:
+            # Dar neįkeltos ankstesnės dainos neturi dingti, jei patvirtinama anksčiau
+            self.restore_selected_songs([{"filename": filename, "display": self.clean_filename(filename)}
+                                         for filename in self.previously_selected_songs
+                                         if filename in self.pending_restore
+                                         and os.path.isfile(os.path.join(self.input_folder, filename))])
         if not self.selected_songs:
             messagebox.showwarning("Warning", "You haven't selected any songs!")
             return
                 
         # Perduoti pasirinktų dainų sąrašą
         self.selected_callback(self.selected_songs)
-        self.destroy()
+        self.close()
     
     def cancel(self):
         """Atšaukia dainų pasirinkimą"""
+        self.close()
+    
+    def close(self):
+        self.stop_waveform_poll()
+        if self.player is not None:
+            self.player.close()
         self.destroy()
     
     def clean_filename(self, filename):
@@ -530,21 +856,45 @@ class ModernSongSelector(tk.Toplevel):
         
         return name.strip()
 
-    def restore_selected_songs(self):
-        """Atkuria anksčiau pasirinktas dainas iš saugomo sąrašo"""
-        # Pridėti anksčiau pasirinktas dainas į naują sąrašą
-        for filename in self.previously_selected_songs:
-            # Rasti atitinkamą display_name pagal filename
-            display_name = None
-            for song in self.all_songs:
-                if song["filename"] == filename:
-                    display_name = song["display"]
-                    break
-            
-            # Jei radome display_name, pridėti į pasirinktųjų sąrašą
-            if display_name:
-                self.selected_songs.append(filename)
-                self.playlist_listbox.insert(tk.END, display_name)
+    def restore_selected_songs(self, songs):
+        """Atkuria anksčiau pasirinktas dainas, esančias tik ką įkeltame pakete"""
+        restored = []
+        for song in songs:
+            filename = song["filename"]
+            if filename not in self.pending_restore:
+                continue
+            self.pending_restore.discard(filename)
+            if filename not in self.selected_set:
+                restored.append((self.restore_order[filename], filename, song["display"]))
+        if not restored:
+            return
+        restored.sort()
+        
+        # Kiekviena daina įterpiama prieš pirmą grojaraščio dainą, kuri anksčiau buvo toliau sąraše;
+        # visas paketas sulejamas vienu praėjimu, o sąrašas perstatomas vieną kartą
+        displays = self.playlist_listbox.get(0, tk.END) if self.selected_songs else ()
+        merged_songs = []
+        merged_displays = []
+        following = 0
+        for filename, display in zip(self.selected_songs, displays):
+            order = self.restore_order.get(filename, -1)
+            while following < len(restored) and restored[following][0] < order:
+                merged_songs.append(restored[following][1])
+                merged_displays.append(restored[following][2])
+                following += 1
+            merged_songs.append(filename)
+            merged_displays.append(display)
+        appended = restored[following:]
+        merged_songs += [filename for _, filename, _ in appended]
+        merged_displays += [display for _, _, display in appended]
+        
+        if following:
+            self.playlist_listbox.delete(0, tk.END)
+            self.playlist_listbox.insert(tk.END, *merged_displays)
+        else:
+            self.playlist_listbox.insert(tk.END, *[display for _, _, display in appended])
+        self.selected_songs = merged_songs
+        self.selected_set.update(filename for _, filename, _ in restored)
         
         # Atnaujinti informacijos etiketę
         self.update_info_label()
@@ -563,11 +913,17 @@ class AudioCombinerGUI:
         self.output_folder = tk.StringVar()
         self.output_filename = tk.StringVar(value="combined_output.mp3")
         self.num_files = tk.StringVar(value="20")
+        self.extra_formats = tk.StringVar(value="")
+        self.service_url = tk.StringVar(value="")
+        self.service_token = tk.StringVar(value=os.environ.get(WORKER_TOKEN_ENV, ""))
         self.status = tk.StringVar(value="Ready")
         
         # Song selection
         self.selected_songs = []
         self.use_selected_songs = tk.BooleanVar(value=False)
+        self.auto_order = tk.BooleanVar(value=False)
+        self.beat_align = tk.BooleanVar(value=False)
+        self.use_limiter = tk.BooleanVar(value=False)
         
         # Tracklist variables
         self.tracklist = []
@@ -577,6 +933,12 @@ class AudioCombinerGUI:
         self.export_counter_file = "export_counter.txt"
         self.export_counter = self.load_export_counter()
         
+        # Set by the Cancel button, checked between songs
+        self.cancel_requested = False
+        
+        # (service url, job id) of a mix rendered by the render service
+        self.service_job = None
+        
         # Create starry background
         self.background = StarryBackground(self.root)
         self.background.place(relwidth=1, relheight=1)
@@ -664,7 +1026,7 @@ class AudioCombinerGUI:
         
         # Number of songs with nice styling
         num_files_frame = tk.Frame(inputs_frame, bg='#000000')
-        num_files_frame.pack(fill='x', pady=(0, 40))
+        num_files_frame.pack(fill='x', pady=(0, 25))
         
         num_files_label = tk.Label(num_files_frame,
                                  text="Number of Songs:",
@@ -688,6 +1050,92 @@ class AudioCombinerGUI:
                                  bd=10)
         num_files_entry.pack(side='left')
         
+        # Extra output formats, encoded from the same render pass
+        formats_frame = tk.Frame(inputs_frame, bg='#000000')
+        formats_frame.pack(fill='x', pady=(0, 25))
+        
+        formats_label = tk.Label(formats_frame,
+                               text="Extra Formats:",
+                               font=('Segoe UI', 14),
+                               fg='white',
+                               bg='#000000')
+        formats_label.pack(side='left', padx=(0, 10))
+        
+        formats_entry = tk.Entry(formats_frame,
+                               textvariable=self.extra_formats,
+                               font=('Segoe UI', 14),
+                               width=30,
+                               bg='#2a2a2a',
+                               fg='white',
+                               insertbackground='white',
+                               relief='flat',
+                               highlightthickness=1,
+                               highlightbackground='#1e90ff',
+                               highlightcolor='#1e90ff',
+                               bd=10)
+        formats_entry.pack(side='left')
+        
+        formats_hint = tk.Label(formats_frame,
+                              text="e.g. mp3:128k, opus:96k, flac",
+                              font=('Segoe UI', 11),
+                              fg='#888888',
+                              bg='#000000')
+        formats_hint.pack(side='left', padx=(10, 0))
+        
+        # Optional render service (blank = render on this computer)
+        service_frame = tk.Frame(inputs_frame, bg='#000000')
+        service_frame.pack(fill='x', pady=(0, 40))
+        
+        service_label = tk.Label(service_frame,
+                               text="Render Service:",
+                               font=('Segoe UI', 14),
+                               fg='white',
+                               bg='#000000')
+        service_label.pack(side='left', padx=(0, 10))
+        
+        service_entry = tk.Entry(service_frame,
+                               textvariable=self.service_url,
+                               font=('Segoe UI', 14),
+                               width=30,
+                               bg='#2a2a2a',
+                               fg='white',
+                               insertbackground='white',
+                               relief='flat',
+                               highlightthickness=1,
+                               highlightbackground='#1e90ff',
+                               highlightcolor='#1e90ff',
+                               bd=10)
+        service_entry.pack(side='left')
+        
+        service_hint = tk.Label(service_frame,
+                              text="e.g. http://127.0.0.1:8765 (blank = this computer)",
+                              font=('Segoe UI', 11),
+                              fg='#888888',
+                              bg='#000000')
+        service_hint.pack(side='left', padx=(10, 0))
+        
+        token_label = tk.Label(service_frame,
+                             text="Token:",
+                             font=('Segoe UI', 14),
+                             fg='white',
+                             bg='#000000')
+        token_label.pack(side='left', padx=(20, 10))
+        
+        token_entry = tk.Entry(service_frame,
+                             textvariable=self.service_token,
+                             show='*',
+                             font=('Segoe UI', 14),
+                             width=16,
+                             bg='#2a2a2a',
+                             fg='white',
+                             insertbackground='white',
+                             relief='flat',
+                             highlightthickness=1,
+                             highlightbackground='#1e90ff',
+                             highlightcolor='#1e90ff',
+                             bd=10)
+        token_entry.pack(side='left')
+        
         # Modern progress bar
         progress_frame = tk.Frame(main_frame, bg='#000000')
         progress_frame.pack(fill='x', pady=(20, 10))
@@ -748,6 +1196,42 @@ class AudioCombinerGUI:
                                         activebackground='#000000')
         self.use_selected_check.pack()
         
+        # Checkbox for smart ordering of randomly selected songs
+        auto_order_check = tk.Checkbutton(songs_selection_frame,
+                                        text="Auto-order Random Songs",
+                                        variable=self.auto_order,
+                                        font=('Segoe UI', 14),
+                                        fg='white',
+                                        bg='#000000',
+                                        selectcolor='#2a2a2a',
+                                        activeforeground='white',
+                                        activebackground='#000000')
+        auto_order_check.pack()
+        
+        # Checkbox for crossfades lined up with the beats of both songs
+        beat_align_check = tk.Checkbutton(songs_selection_frame,
+                                        text="Beat-aligned Crossfades",
+                                        variable=self.beat_align,
+                                        font=('Segoe UI', 14),
+                                        fg='white',
+                                        bg='#000000',
+                                        selectcolor='#2a2a2a',
+                                        activeforeground='white',
+                                        activebackground='#000000')
+        beat_align_check.pack()
+        
+        # Checkbox for the master bus limiter (no clipping in the export)
+        limiter_check = tk.Checkbutton(songs_selection_frame,
+                                     text="Master Limiter",
+                                     variable=self.use_limiter,
+                                     font=('Segoe UI', 14),
+                                     fg='white',
+                                     bg='#000000',
+                                     selectcolor='#2a2a2a',
+                                     activeforeground='white',
+                                     activebackground='#000000')
+        limiter_check.pack()
+        
         # Selection button
         select_songs_btn = CustomButton(songs_selection_frame,
                                        text="Select Songs",
@@ -776,6 +1260,14 @@ class AudioCombinerGUI:
                                  height=60)
         process_btn.pack(side='left')
         
+        # Cancel button (the render can be resumed later)
+        cancel_btn = CustomButton(bottom_frame,
+                                text="Cancel",
+                                command=self.cancel_processing,
+                                width=150,
+                                height=60)
+        cancel_btn.pack(side='left', padx=20)
+        
         # Custom song button (bottom right)
         custom_song_btn = CustomButton(bottom_frame,
                                      text="Add Custom Song",
@@ -784,6 +1276,14 @@ class AudioCombinerGUI:
                                      height=60)
         custom_song_btn.pack(side='right', padx=20)
         
+        # Bulk import button (bottom right)
+        import_btn = CustomButton(bottom_frame,
+                                text="Import Folder",
+                                command=self.import_folder,
+                                width=200,
+                                height=60)
+        import_btn.pack(side='right')
+        
     def open_song_selection(self):
         """Opens song selection window"""
         input_folder = self.input_folder.get()
@@ -818,26 +1318,88 @@ class AudioCombinerGUI:
         )
         
         if custom_file:
-            # Extract just the filename, not the full path
-            file_name = os.path.basename(custom_file)
-            
-            # Copy file to input folder if needed
             input_folder = self.input_folder.get()
-            if input_folder:
-                # Check if we should copy the file
-                if os.path.dirname(custom_file) != input_folder:
-                    try:
-                        import shutil
-                        shutil.copy2(custom_file, os.path.join(input_folder, file_name))
-                        messagebox.showinfo("Success", f"File '{file_name}' copied to input folder")
-                    except Exception as e:
-                        messagebox.showerror("Error", f"Could not copy file: {str(e)}")
+            if not input_folder or not os.path.isdir(input_folder):
+                messagebox.showerror("Error", "Please select input folder!")
+                return
             
-            # Add to selected songs
-            if file_name not in self.selected_songs:
-                self.selected_songs.append(file_name)
-                self.selected_count_label.config(text=f"Selected songs: {len(self.selected_songs)}")
-                self.use_selected_songs.set(True)
+            # Importuoti be perrašymo: ta pati daina nekopijuojama antrą kartą
+            self.start_import([custom_file], select=True)
+    
+    def import_folder(self):
+        """Imports a whole folder of songs into the input folder"""
+        input_folder = self.input_folder.get()
+        if not input_folder or not os.path.isdir(input_folder):
+            messagebox.showerror("Error", "Please select input folder!")
+            return
+        
+        source = filedialog.askdirectory(title="Select Folder to Import")
+        if source:
+            self.start_import([source])
+    
+    def start_import(self, sources, select=False):
+        """Copies, deduplicates and analyses songs in a background thread"""
+        input_folder = self.input_folder.get()
+        events = queue.Queue()
+        
+        def report(done, total, text):
+            events.put(("progress", done, total, text))
+        
+        def work():
+            try:
+                result = import_songs(input_folder, sources, progress_callback=report)
+                events.put(("imported", result))
+                errors = analyze_library_files(input_folder, list(result["imported"].values()),
+                                               progress_callback=report)
+                events.put(("analysed", errors))
+            except Exception as e:
+                events.put(("error", str(e)))
+        
+        self.status.set("Importing songs...")
+        threading.Thread(target=work, daemon=True).start()
+        self.root.after(100, self.poll_import, events, select)
+    
+    def poll_import(self, events, select):
+        """Atnaujina importavimo būseną iš foninės gijos"""
+        try:
+            while True:
+                event = events.get_nowait()
+                if event[0] == "progress":
+                    _, done, total, text = event
+                    self.progress['maximum'] = max(total, 1)
+                    self.progress['value'] = done
+                    self.status.set(text)
+                elif event[0] == "imported":
+                    result = event[1]
+                    if result["unmatched"]:
+                        messagebox.showwarning("Import", "No MP3 files found in:\n" +
+                                               "\n".join(result["unmatched"][:20]))
+                    if result["invalid"]:
+                        messagebox.showerror("Error", "Not a valid MP3 file:\n" +
+                                             "\n".join(os.path.basename(path) for path in result["invalid"][:20]))
+                    if select:
+                        # Dainos, kurios jau buvo aplanke, pažymimos jų esamu pavadinimu
+                        names = list(result["imported"].values()) + list(result["duplicates"].values())
+                        for file_name in names:
+                            if file_name not in self.selected_songs:
+                                self.selected_songs.append(file_name)
+                        if names:
+                            self.selected_count_label.config(text=f"Selected songs: {len(self.selected_songs)}")
+                            self.use_selected_songs.set(True)
+                    self.status.set(f"Imported {len(result['imported'])} songs "
+                                    f"({len(result['duplicates'])} already in the library), analysing...")
+                elif event[0] == "analysed":
+                    self.progress['value'] = 0
+                    self.status.set("Import finished")
+                    return
+                elif event[0] == "error":
+                    self.progress['value'] = 0
+                    messagebox.showerror("Error", f"Could not import songs: {event[1]}")
+                    self.status.set("Error occurred!")
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(100, self.poll_import, events, select)
     
     def process_audio(self):
         try:
@@ -851,6 +1413,22 @@ class AudioCombinerGUI:
             if not input_folder or not output_folder:
                 messagebox.showerror("Error", "Please select input and output folders!")
                 return
+            
+            # Jei nurodyta, eksportuoti per bendrą render servisą
+            service_url = self.service_url.get().strip()
+            
+            # Pasiūlyti pratęsti nebaigtą eksportą
+            work_dir = os.path.join(output_folder, RENDER_STATE_DIR)
+            render = MixRender.load(work_dir) if not service_url else None
+            if render is not None:
+                done = render.state["next_track"]
+                total = len(render.job["files"])
+                if messagebox.askyesno("Resume",
+                                       f"An unfinished mix ({done} of {total} songs rendered) was found "
+                                       f"in the output folder.\n\nResume it?"):
+                    self.run_render(render)
+                    return
+                render.discard()
                 
             if not os.path.exists(input_folder):
                 messagebox.showerror("Error", "Input folder does not exist!")
@@ -867,7 +1445,7 @@ class AudioCombinerGUI:
             if self.use_selected_songs.get() and self.selected_songs:
                 # Naudoti pasirinktas dainas
                 selected_files = self.selected_songs
-                num_files = len(selected_files)
+                service_spec = {"songs": list(selected_files)}
             else:
                 # Validate number of files for random selection
                 try:
@@ -885,119 +1463,160 @@ class AudioCombinerGUI:
                         f"Using all available files.")
                     num_files = len(mp3_files)
                 
+                # Servisas pats atsitiktinai parenka ir surikiuoja dainas
+                service_spec = {"num_files": num_files, "auto_order": self.auto_order.get()}
+                
                 # Atsitiktinai pasirinkti failus
                 selected_files = random.sample(mp3_files, num_files)
-            
-            # Update status
-            self.status.set("Processing...")
-            self.root.update()
-            
-            # Sukurti tracklist'o kintamuosius
-            self.tracklist = []
-            current_position_ms = 0
-            
-            # Inicializuoti bendrą audio
-            combined_segment = None
-            
-            # Atnaujinti pažangos juostą
-            self.progress['maximum'] = len(selected_files)
-            self.progress['value'] = 0
-            
-            # Apdoroti kiekvieną failą
-            for i, file in enumerate(selected_files):
-                file_path = os.path.join(input_folder, file)
-                self.status.set(f"Processing: {file}")
-                self.progress['value'] = i + 1
-                self.root.update()
-                
-                # Gauti dainos pavadinimą (be .mp3 plėtinio)
-                song_name = os.path.splitext(file)[0]
-                
-                # Pašalinti numeraciją iš dainos pavadinimo (pvz., "15. ", "42. ", ir t.t.)
-                song_name = self.remove_numbering(song_name)
                 
-                # Įkelti garso failą naudojant pydub tiesiogiai
-                audio_segment = AudioSegment.from_file(file_path, format="mp3")
-                
-                # Pašalinti tylą naudojant pydub
-                self.status.set(f"Removing silence: {file}")
-                self.root.update()
-                
-                # Pašalinti tylą iš pradžios ir pabaigos
-                audio_segment = trim_silence_with_pydub(audio_segment)
-                
-                # Skaičiuoti tracklist'o laiko žymas
-                minutes = current_position_ms // 60000
-                seconds = (current_position_ms % 60000) // 1000
-                timestamp = f"{minutes:02d}:{seconds:02d}"
-                
-                # Pridėti dainos informaciją į tracklist'ą
-                tracklist_entry = f"{timestamp} {song_name} (Hyper Demon Remix)"
-                self.tracklist.append(tracklist_entry)
-                
-                # Pridėti į bendrą audio su persidengimais
-                if combined_segment is None:
-                    combined_segment = audio_segment
-                else:
-                    # Taikyti 1 sekundės persidengimą jungiant segmentus
-                    combined_segment = combined_segment.append(audio_segment, crossfade=1000)
-                    # Atnaujinti laiko poziciją atsižvelgiant į persidengimą
-                    current_position_ms += len(audio_segment) - 1000
-                
-                # Jei tai pirmas failas, tiesiog pridedam ilgį
-                if i == 0:
-                    current_position_ms = len(audio_segment)
-            
-            # Užtikrinti, kad išvesties aplankas egzistuoja
-            os.makedirs(output_folder, exist_ok=True)
-            
-            # Sukonstruoti pilną išvesties kelią
-            output_file = os.path.join(output_folder, output_filename)
-            
-            # Sukurti tracklist tekstą
-            tracklist_text = "\n".join(self.tracklist)
-            
-            # Visada išsaugoti tracklist į failą
-            tracklist_file = os.path.join(output_folder, tracklist_filename)
-            with open(tracklist_file, "w", encoding="utf-8") as f:
-                f.write(tracklist_text)
-            
-            # Eksportuoti į MP3 su 320kbps ir 44100 Hz sample rate
-            self.status.set("Exporting to MP3...")
-            self.root.update()
-            combined_segment = combined_segment.set_frame_rate(44100)  # Nustatyti sample rate į 44100 Hz
-            combined_segment.export(output_file, format="mp3", bitrate="320k", parameters=["-ar", "44100"])
-            
-            # Padidinti ir išsaugoti eksportavimo skaitliuką
-            self.export_counter += 1
-            self.save_export_counter()
-            
-            self.status.set("Processing complete!")
+                # Surikiuoti pagal tempą, tonaciją ir energiją
+                if self.auto_order.get() and not service_url:
+                    def show_progress(done, total, filename):
+                        self.status.set(f"Analysing songs: {done}/{total}")
+                        self.root.update()
+                    
+                    self.status.set("Analysing songs...")
+                    self.root.update()
+                    selected_files = auto_order_songs(input_folder, selected_files,
+                                                      progress_callback=show_progress)
             
-            # Rodyti sėkmės pranešimą su tracklist informacija
-            success_message = (f"Successfully combined {num_files} songs with 1s crossfades!\n\n"
-                              f"MP3 file saved to: {output_file}\n"
-                              f"Tracklist saved to: {tracklist_file}")
+            if service_url:
+                # Servisas rašo į savo išvesties aplanką
+                service_spec.update(input_folder=os.path.abspath(input_folder),
+                                    formats=self.extra_formats.get().split(","),
+                                    beat_align=self.beat_align.get(),
+                                    limiter=self.use_limiter.get())
+                self.submit_service_job(service_url, service_spec)
+                return
             
-            messagebox.showinfo("Success", success_message)
+            # Sukurti naują eksportą su patikros taškais
+            render = MixRender.create(work_dir, input_folder, selected_files,
+                                      os.path.join(output_folder, output_filename),
+                                      tracklist_file=os.path.join(output_folder, tracklist_filename),
+                                      extra_formats=self.extra_formats.get().split(","),
+                                      beat_align=self.beat_align.get(),
+                                      limiter=limiter_settings() if self.use_limiter.get() else None)
+            self.run_render(render)
             
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred: {str(e)}")
             self.status.set("Error occurred!")
         finally:
             self.progress['value'] = 0
+    
+    def run_render(self, render):
+        """Runs (or resumes) a checkpointed render and reports the result"""
+        self.cancel_requested = False
+        
+        def show_progress(done, total, text):
+            if self.cancel_requested:
+                raise RenderCancelled()
+            self.status.set(text)
+            self.progress['maximum'] = total
+            self.progress['value'] = done
+            self.root.update()
+        
+        # Update status
+        self.status.set("Processing...")
+        self.root.update()
+        
+        try:
+            self.tracklist = render.run(progress_callback=show_progress)
+        except RenderCancelled:
+            self.status.set("Cancelled - press Process to resume")
+            return
+        except Exception as e:
+            messagebox.showerror("Error", f"An error occurred: {str(e)}\n\n"
+                                          f"Press Process to resume from the last finished song.")
+            self.status.set("Error occurred!")
+            return
+        
+        # Padidinti ir išsaugoti eksportavimo skaitliuką
+        self.export_counter += 1
+        self.save_export_counter()
+        
+        self.status.set("Processing complete!")
+        
+        # Rodyti sėkmės pranešimą su tracklist informacija
+        saved_files = "\n".join(target["file"] for target in render.job["outputs"])
+        crossfade_ms = render.job["crossfade_ms"]
+        if not crossfade_ms:
+            crossfades = "without crossfades"
+        else:
+            crossfades = (f"with {crossfade_ms / 1000:g}s "
+                          f"{'beat-aligned ' if render.job.get('beat_align') else ''}crossfades")
+        success_message = (f"Successfully combined {len(render.job['files'])} songs {crossfades}!\n\n"
+                          f"Files saved:\n{saved_files}\n"
+                          f"Tracklist saved to: {render.job['tracklist_file']}")
+        
+        messagebox.showinfo("Success", success_message)
+        
+        # Parodyti viso mikso bangos formą
+        pyramid = PeakPyramid.load(mix_peaks_path(render.job["output_file"]))
+        if pyramid is not None:
+            WaveformWindow(self.root, pyramid,
+                           title=os.path.basename(render.job["output_file"]),
+                           markers=render.state.get("track_marks"))
+    
+    def submit_service_job(self, service_url, spec):
+        """Sends the mix to the render service and follows its progress"""
+        job = service_request(service_url, "POST", "/jobs", spec, self.service_token.get().strip())
+        self.service_job = (service_url, job["id"])
+        self.status.set("Queued on render service...")
+        self.root.after(500, self.poll_service_job)
+    
+    def poll_service_job(self):
+        """Atnaujina serviso darbo būseną, kol jis pasibaigia"""
+        if self.service_job is None:
+            return
+        service_url, job_id = self.service_job
+        
+        try:
+            job = service_request(service_url, "GET", f"/jobs/{job_id}", token=self.service_token.get().strip())
+        except Exception as e:
+            self.service_job = None
+            self.progress['value'] = 0
+            messagebox.showerror("Error", f"Lost connection to render service: {str(e)}")
+            self.status.set("Error occurred!")
+            return
+        
+        progress = job["progress"]
+        self.status.set(progress["text"])
+        self.progress['maximum'] = max(progress["total"], 1)
+        self.progress['value'] = progress["done"]
+        
+        if job["status"] in ("queued", "running"):
+            self.root.after(500, self.poll_service_job)
+            return
+        
+        self.service_job = None
+        self.progress['value'] = 0
+        if job["status"] == "done":
+            self.status.set("Processing complete!")
+            saved_files = "\n".join(job["outputs"])
+            messagebox.showinfo("Success", f"Render service finished the mix!\n\nFiles saved:\n{saved_files}")
+        elif job["status"] == "cancelled":
+            self.status.set("Cancelled")
+        else:
+            messagebox.showerror("Error", f"An error occurred: {job['error']}")
+            self.status.set("Error occurred!")
+    
+    def cancel_processing(self):
+        """Stops the running render after the current song"""
+        self.cancel_requested = True
+        if self.service_job is not None:
+            service_url, job_id = self.service_job
+            try:
+                service_request(service_url, "DELETE", f"/jobs/{job_id}", token=self.service_token.get().strip())
+            except Exception as e:
+                messagebox.showerror("Error", f"Could not cancel the job: {str(e)}")
 
     def remove_numbering(self, song_name):
         """
         Pašalina numeraciją iš dainos pavadinimo.
         Pvz., "15. Dainos pavadinimas" => "Dainos pavadinimas"
         """
-        # Pašalina bet kokį skaičių su tašku ir tarpu 
-        # (pvz., "15. ", "123. ", ir t.t.)
-        cleaned_name = re.sub(r'^\d+\.\s+', '', song_name)
-        # Pašalina bet kokį skaičių pradžioje (pvz., "15 ", "123 ", ir t.t.)
-        cleaned_name = re.sub(r'^\d+\s+', '', cleaned_name)
-        return cleaned_name
+        return remove_numbering(song_name)
 
     def browse_input(self):
         folder = filedialog.askdirectory()
@@ -1011,21 +1630,29 @@ class AudioCombinerGUI:
             
     def load_export_counter(self):
         """Įkelti eksportavimo skaitliuką iš failo arba pradėti nuo 1"""
-        try:
-            if os.path.exists(self.export_counter_file):
-                with open(self.export_counter_file, "r") as f:
-                    return int(f.read().strip())
-            return 1
-        except:
-            return 1
+        return read_export_counter(self.export_counter_file)
     
     def save_export_counter(self):
         """Išsaugoti eksportavimo skaitliuką į failą"""
-        try:
-            with open(self.export_counter_file, "w") as f:
-                f.write(str(self.export_counter))
-        except:
-            pass
+        write_export_counter(self.export_counter_file, self.export_counter)
+
+def find_trim_points(audio_segment, silence_threshold=-40, min_silence_len=100):
+    """
+    Randa garso pradžią ir pabaigą be tylos milisekundėmis.
+    Jei nerasta jokių ne tylių segmentų, grąžina visą garso ilgį.
+    """
+    # Aptikti ne tylos dalis
+    non_silent_ranges = pydub_silence.detect_nonsilent(
+        audio_segment,
+        min_silence_len=min_silence_len,
+        silence_thresh=silence_threshold
+    )
+    
+    if not non_silent_ranges:
+        return 0, len(audio_segment)
+    
+    # Nuo pirmo iki paskutinio ne tylaus segmento
+    return non_silent_ranges[0][0], non_silent_ranges[-1][1]
 
 def trim_silence_with_pydub(audio_segment, silence_threshold=-40, min_silence_len=100):
     """
@@ -1038,20 +1665,8 @@ def trim_silence_with_pydub(audio_segment, silence_threshold=-40, min_silence_le
         min_silence_len: minimali tylos trukmė milisekundėmis
     """
     try:
-        # Aptikti ne tylos dalis
-        non_silent_ranges = pydub_silence.detect_nonsilent(
-            audio_segment,
-            min_silence_len=min_silence_len,
-            silence_thresh=silence_threshold
-        )
-        
-        # Jei nerasta jokių ne tylių segmentų, grąžinti nepakeistą garso segmentą
-        if not non_silent_ranges:
-            return audio_segment
-        
         # Apkarpyti garso failą - palikti tik dalį nuo pirmo iki paskutinio ne tylaus segmento
-        start_trim = non_silent_ranges[0][0]
-        end_trim = non_silent_ranges[-1][1]
+        start_trim, end_trim = find_trim_points(audio_segment, silence_threshold, min_silence_len)
         
         return audio_segment[start_trim:end_trim]
     
@@ -1060,7 +1675,4058 @@ def trim_silence_with_pydub(audio_segment, silence_threshold=-40, min_silence_le
         # Jei įvyko klaida, grąžinti originalų audio
         return audio_segment
 
+# Runtime metrics: counters, gauges and latency histograms of the render
+# path in one registry per process. They are exported in the Prometheus text
+# format (a file or GET /metrics) and as periodic JSON log lines.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+METRICS_INTERVAL_SECONDS = 10
+
+def metric_label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+class MetricsRegistry:
+    """
+    Thread-safe metrics store. Every metric is declared once with its type
+    ("counter", "gauge" or "histogram") and help text and keeps one value per
+    label set. A gauge may be set to a function, which is called whenever
+    the metrics are collected.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def declare(self, name, metric_type, help_text, buckets=METRICS_LATENCY_BUCKETS):
+        with self.lock:
+            self.metrics.setdefault(name, {"type": metric_type, "help": help_text,
+                                           "buckets": tuple(buckets), "values": {}})
+
+    def inc(self, name, value=1, **labels):
+        """Adds to a counter (or to a gauge; a negative value lowers it)"""
+        key = metric_label_key(labels)
+        with self.lock:
+            values = self.metrics[name]["values"]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Sets a gauge to a number or to a function returning one"""
+        with self.lock:
+            self.metrics[name]["values"][metric_label_key(labels)] = value
+
+    def remove(self, name, **labels):
+        """Drops one label set (e.g. the gauge of a finished render)"""
+        with self.lock:
+            self.metrics[name]["values"].pop(metric_label_key(labels), None)
+
+    def observe(self, name, value, **labels):
+        """Records one observation in a histogram"""
+        key = metric_label_key(labels)
+        with self.lock:
+            metric = self.metrics[name]
+            histogram = metric["values"].get(key)
+            if histogram is None:
+                histogram = {"counts": [0] * len(metric["buckets"]), "sum": 0.0, "count": 0}
+                metric["values"][key] = histogram
+            position = bisect.bisect_left(metric["buckets"], value)
+            if position < len(metric["buckets"]):
+                histogram["counts"][position] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observes the time spent in the with block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def collect(self):
+        """
+        Returns {name: {"type", "help", "buckets", "values"}} where values is
+        a list of (labels dict, value). Gauge functions are evaluated (and
+        skipped if they fail or return None); histograms are copied.
+        """
+        with self.lock:
+            metrics = {}
+            for name, metric in self.metrics.items():
+                values = [(key, dict(value, counts=list(value["counts"])) if isinstance(value, dict) else value)
+                          for key, value in metric["values"].items()]
+                metrics[name] = dict(metric, values=values)
+        # Funkcijos kviečiamos be užrakto, nes jos gali laukti kitų užraktų
+        for metric in metrics.values():
+            values = []
+            for key, value in metric["values"]:
+                if callable(value):
+                    try:
+                        value = value()
+                    except Exception:
+                        value = None
+                if value is not None:
+                    values.append((dict(key), value))
+            metric["values"] = values
+        return metrics
+
+    def total(self, name):
+        """Sum of a counter or gauge over all label sets"""
+        return sum(value for _, value in self.collect()[name]["values"])
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            for labels, value in metric["values"]:
+                if metric["type"] != "histogram":
+                    lines.append(f"{name}{prometheus_labels(labels)} {prometheus_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"], value["counts"]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{prometheus_labels(labels, bound)} {cumulative}")
+                lines.append(f"{name}_bucket{prometheus_labels(labels, '+Inf')} {value['count']}")
+                lines.append(f"{name}_sum{prometheus_labels(labels)} {prometheus_number(value['sum'])}")
+                lines.append(f"{name}_count{prometheus_labels(labels)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Current values as JSON data. Labelled values are keyed by
+        "label=value,..."; histograms give count, sum and the p50/p95 bucket
+        bounds (None when above the largest bucket).
+        """
+        result = {}
+        for name, metric in sorted(self.collect().items()):
+            values = {}
+            for labels, value in metric["values"]:
+                if metric["type"] == "histogram":
+                    value = {"count": value["count"], "sum": round(value["sum"], 6),
+                             "p50": histogram_quantile(metric["buckets"], value, 0.5),
+                             "p95": histogram_quantile(metric["buckets"], value, 0.95)}
+                values[",".join(f"{label}={labels[label]}" for label in sorted(labels))] = value
+            result[name] = values[""] if list(values) == [""] else values
+        return result
+
+def prometheus_labels(labels, le=None):
+    """Formats labels as {name="value",...} with the values escaped; a histogram bucket's le goes last"""
+    items = sorted(labels.items()) + ([("le", le)] if le is not None else [])
+    if not items:
+        return ""
+    pairs = []
+    for name, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def prometheus_number(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def histogram_quantile(buckets, histogram, quantile):
+    """Upper bound of the bucket holding the quantile, or None if it is above every bucket"""
+    if not histogram["count"]:
+        return None
+    cumulative = 0
+    for bound, count in zip(buckets, histogram["counts"]):
+        cumulative += count
+        if cumulative >= quantile * histogram["count"]:
+            return bound
+    return None
+
+def resident_memory_bytes():
+    """Current resident memory of this process (the peak where /proc is missing)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+METRICS = MetricsRegistry()
+METRICS.declare("combiner_tracks_rendered_total", "counter", "Tracks added to mixes and radio streams")
+METRICS.declare("combiner_audio_seconds_rendered_total", "counter", "Seconds of mix audio assembled")
+METRICS.declare("combiner_renders_total", "counter", "Finished mix renders by result")
+METRICS.declare("combiner_renders_active", "gauge", "Mix renders in progress")
+METRICS.declare("combiner_cache_requests_total", "counter", "Cache lookups by cache and result (hit or miss)")
+METRICS.declare("combiner_queue_depth", "gauge", "Work items waiting in a queue")
+METRICS.declare("combiner_encoder_backlog_blocks", "gauge", "PCM blocks queued for the encoders of a render")
+METRICS.declare("combiner_mp3_chunks_pending", "gauge", "MP3 chunks being encoded or waiting to be joined")
+METRICS.declare("combiner_stage_seconds", "histogram", "Time spent per render stage")
+METRICS.declare("process_resident_memory_bytes", "gauge", "Resident memory of this process in bytes")
+METRICS.set("process_resident_memory_bytes", resident_memory_bytes)
+
+def write_prometheus_file(path, registry=METRICS):
+    """Atomically replaces path with the current metrics (e.g. for node_exporter's textfile collector)"""
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        f.write(registry.prometheus_text())
+    os.replace(temp_file, path)
+
+class MetricsReporter:
+    """
+    Background thread that exports the metrics every interval: the
+    Prometheus file is rewritten and one JSON line with the current values
+    and the throughput since the previous line (tracks and audio seconds
+    per wall second) is appended to json_log ("-" for stderr).
+    """
+    def __init__(self, prometheus_file=None, json_log=None, interval=METRICS_INTERVAL_SECONDS, registry=METRICS):
+        self.prometheus_file = prometheus_file
+        self.json_log = json_log
+        self.interval = interval
+        self.registry = registry
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last = None
+
+    def throughput_counters(self):
+        return (time.monotonic(), self.registry.total("combiner_tracks_rendered_total"),
+                self.registry.total("combiner_audio_seconds_rendered_total"))
+
+    def start(self):
+        self.last = self.throughput_counters()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        """Stops the thread and writes the final values"""
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.report()
+
+    def report(self):
+        try:
+            if self.prometheus_file:
+                write_prometheus_file(self.prometheus_file, self.registry)
+            if self.json_log:
+                self.write_json_line()
+        except OSError as e:
+            print(f"Could not write metrics: {e}", file=sys.stderr)
+
+    def write_json_line(self):
+        now, tracks, audio_seconds = self.throughput_counters()
+        last_time, last_tracks, last_audio_seconds = self.last or (now, tracks, audio_seconds)
+        elapsed = max(now - last_time, 1e-9)
+        self.last = (now, tracks, audio_seconds)
+        line = json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                           "tracks_per_second": round((tracks - last_tracks) / elapsed, 4),
+                           "audio_seconds_per_second": round((audio_seconds - last_audio_seconds) / elapsed, 3),
+                           "metrics": self.registry.snapshot()})
+        if self.json_log == "-":
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(self.json_log, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+# Folder (inside the input folder) for cached per-track data
+CACHE_DIR_NAME = ".mix_cache"
+
+# Length of the excerpt used for tempo/key/energy analysis
+ANALYSIS_EXCERPT_SECONDS = 30
+
+PITCH_CLASSES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+# Krumhansl-Schmuckler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+def file_signature(file_path):
+    """Returns [size, mtime] of a file, or None if it does not exist"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return [stat.st_size, int(stat.st_mtime)]
+
+class LibraryIndex:
+    """
+    Per-folder JSON index of cached track data (analysis results etc.).
+    Entries are invalidated when the file size or modification time changes.
+    """
+    shared_instances = {}
+    shared_lock = threading.Lock()
+
+    def __init__(self, input_folder):
+        self.input_folder = input_folder
+        self.cache_dir = os.path.join(input_folder, CACHE_DIR_NAME)
+        self.index_file = os.path.join(self.cache_dir, "library.json")
+        self.entries = {}
+        self.dirty = False
+        self.lock = threading.RLock()
+        self.load()
+
+    @classmethod
+    def shared(cls, input_folder):
+        """Returns one index per folder for the whole process (used by concurrent renders)"""
+        key = os.path.abspath(input_folder)
+        with cls.shared_lock:
+            if key not in cls.shared_instances:
+                cls.shared_instances[key] = cls(input_folder)
+            return cls.shared_instances[key]
+
+    def load(self):
+        """Loads the index from disk, starting empty if it is missing or broken"""
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        """Writes the index to disk if anything changed"""
+        with self.lock:
+            if not self.dirty:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_file = f"{self.index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            os.replace(temp_file, self.index_file)
+            self.dirty = False
+
+    def file_signature(self, filename):
+        """Returns [size, mtime] of a file, or None if it does not exist"""
+        return file_signature(os.path.join(self.input_folder, filename))
+
+    def get(self, filename, key):
+        """Returns a cached value, or None if it is missing or out of date"""
+        entry = self.entries.get(filename)
+        if not entry or key not in entry or entry.get("signature") != self.file_signature(filename):
+            return None
+        return entry[key]
+
+    def lookup(self, filename, key):
+        """
+        get() that is counted in the cache metrics. Used where a miss means
+        computing the value, so every song is counted once per use.
+        """
+        value = self.get(filename, key)
+        METRICS.inc("combiner_cache_requests_total", cache=f"library_{key}",
+                    result="miss" if value is None else "hit")
+        return value
+
+    def set(self, filename, key, value):
+        """Stores a value for a file, dropping stale values of a changed file"""
+        signature = self.file_signature(filename)
+        with self.lock:
+            entry = self.entries.get(filename)
+            if entry is None or entry.get("signature") != signature:
+                entry = {"signature": signature}
+                self.entries[filename] = entry
+            entry[key] = value
+            self.dirty = True
+
+def estimate_key(chroma):
+    """
+    Estimates the musical key from a mean chroma vector.
+    Returns (tonic pitch class 0-11, "major" or "minor").
+    """
+    best = (-2.0, 0, "major")
+    for tonic in range(12):
+        for mode, profile in (("major", MAJOR_PROFILE), ("minor", MINOR_PROFILE)):
+            score = np.corrcoef(chroma, np.roll(profile, tonic))[0, 1]
+            if score > best[0]:
+                best = (score, tonic, mode)
+    return best[1], best[2]
+
+def camelot_number(tonic, mode):
+    """Returns the Camelot wheel number (1-12) of a key"""
+    if mode == "minor":
+        # Minorinė tonacija turi tą patį numerį kaip ir paralelinė mažoroji
+        tonic = (tonic + 3) % 12
+    return (7 * tonic + 7) % 12 + 1
+
+def analyze_track(file_path, excerpt_seconds=ANALYSIS_EXCERPT_SECONDS):
+    """Analyses a short excerpt from the middle of a track (tempo, key, energy)"""
+    try:
+        duration = sf.info(file_path).duration
+    except Exception:
+        duration = None
+
+    # Imti ištrauką iš dainos vidurio, kur dažniausiai skamba visi instrumentai
+    offset = max(0.0, duration / 2 - excerpt_seconds / 2) if duration else 0.0
+    y, sr = librosa.load(file_path, sr=22050, mono=True, offset=offset, duration=excerpt_seconds)
+    if y.size == 0:
+        raise ValueError("empty audio excerpt")
+
+    tempo = float(np.atleast_1d(librosa.feature.tempo(y=y, sr=sr))[0])
+    chroma = librosa.feature.chroma_stft(y=y, sr=sr).mean(axis=1)
+    tonic, mode = estimate_key(chroma)
+    rms = librosa.feature.rms(y=y)[0]
+    energy = float(20 * np.log10(np.mean(rms) + 1e-9))
+
+    return {
+        "tempo": round(tempo, 2),
+        "key": f"{PITCH_CLASSES[tonic]} {mode}",
+        "camelot": camelot_number(tonic, mode),
+        "minor": mode == "minor",
+        "energy": round(energy, 2),
+    }
+
+def analyze_tracks(input_folder, files, index=None, max_workers=None, progress_callback=None, executor=None):
+    """
+    Returns {filename: analysis} for the given files. Cached results are
+    reused, the rest are analysed in a process pool (a new one, or the
+    given executor) and added to the cache. Files that cannot be analysed
+    are left out of the result.
+    """
+    if index is None:
+        index = LibraryIndex.shared(input_folder)
+
+    results = {}
+    pending = []
+    for filename in files:
+        cached = index.lookup(filename, "analysis")
+        if cached:
+            results[filename] = cached
+        else:
+            pending.append(filename)
+
+    if not pending:
+        return results
+
+    pool = executor or ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        futures = {pool.submit(analyze_track, os.path.join(input_folder, filename)): filename
+                   for filename in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            try:
+                results[filename] = future.result()
+                index.set(filename, "analysis", results[filename])
+            except Exception as e:
+                print(f"Analysis error ({filename}): {e}")
+            if progress_callback:
+                progress_callback(done, len(pending), filename)
+    finally:
+        if executor is None:
+            pool.shutdown()
+
+    index.save()
+    return results
+
+def transition_costs(analyses):
+    """
+    Builds a matrix of transition costs between tracks. Lower is smoother:
+    close tempo (half/double time counts as close), neighbouring keys on
+    the Camelot wheel and similar energy.
+    """
+    tempo = np.array([max(a["tempo"], 1.0) for a in analyses])
+    camelot = np.array([a["camelot"] for a in analyses])
+    minor = np.array([a["minor"] for a in analyses])
+    energy = np.array([a["energy"] for a in analyses])
+
+    # Tempo skirtumas oktavomis, kai pusė ar dvigubas tempas laikomi artimais
+    tempo_diff = np.abs(np.log2(tempo[:, None] / tempo[None, :]))
+    tempo_diff = np.minimum(tempo_diff, np.abs(tempo_diff - 1))
+
+    # Atstumas Camelot rate
+    wheel_diff = np.abs(camelot[:, None] - camelot[None, :])
+    key_cost = np.minimum(wheel_diff, 12 - wheel_diff) + 0.5 * (minor[:, None] != minor[None, :])
+
+    energy_cost = np.abs(energy[:, None] - energy[None, :]) / 3.0
+
+    # ~6% tempo difference costs as much as one step on the Camelot wheel
+    return tempo_diff / 0.06 + key_cost + energy_cost
+
+def two_opt(route, costs, time_limit=0.5):
+    """
+    Improves an open path with 2-opt segment reversals until no reversal
+    helps or the time limit runs out.
+    """
+    n = len(route)
+    # Pridėti fiktyvų tašką su nuliniais kaštais, kad atviras kelias taptų ciklu
+    extended = np.zeros((n + 1, n + 1))
+    extended[:n, :n] = costs
+    tour = np.array([n] + list(route))
+    size = n + 1
+
+    deadline = time.perf_counter() + time_limit
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, size - 1):
+            j = np.arange(i + 1, size)
+            a, b = tour[i - 1], tour[i]
+            c, d = tour[j], tour[(j + 1) % size]
+            delta = extended[a, c] + extended[b, d] - extended[a, b] - extended[c, d]
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                end = j[best]
+                tour[i:end + 1] = tour[i:end + 1][::-1].copy()
+                improved = True
+
+    return [int(node) for node in tour[1:]]
+
+def order_tracks(files, analyses):
+    """
+    Orders tracks for smooth transitions by tempo, key and energy.
+    Uses a nearest-neighbour path from the calmest track refined by 2-opt.
+    Tracks without analysis are kept at the end in their original order.
+    """
+    analysed = [f for f in files if analyses.get(f)]
+    rest = [f for f in files if not analyses.get(f)]
+    if len(analysed) < 3:
+        return analysed + rest
+
+    costs = transition_costs([analyses[f] for f in analysed])
+    energy = [analyses[f]["energy"] for f in analysed]
+
+    # Artimiausio kaimyno kelias nuo ramiausios dainos
+    current = int(np.argmin(energy))
+    route = [current]
+    visited = np.zeros(len(analysed), dtype=bool)
+    visited[current] = True
+    for _ in range(len(analysed) - 1):
+        row = np.where(visited, np.inf, costs[current])
+        current = int(np.argmin(row))
+        route.append(current)
+        visited[current] = True
+
+    route = two_opt(route, costs)
+    return [analysed[i] for i in route] + rest
+
+def auto_order_songs(input_folder, files, progress_callback=None, index=None, executor=None):
+    """Analyses (or loads cached analysis of) the files and returns them in smart order"""
+    analyses = analyze_tracks(input_folder, files, index=index, progress_callback=progress_callback,
+                              executor=executor)
+    return order_tracks(list(files), analyses)
+
+# Default overlap between consecutive tracks
+DEFAULT_CROSSFADE_MS = 1000
+
+# Format of all decoded and mixed audio
+MIX_FRAME_RATE = 44100
+MIX_CHANNELS = 2
+MIX_SAMPLE_WIDTH = 2
+
+# Audio kept on each side of the crossfade in transition previews
+PREVIEW_CONTEXT_MS = 3000
+
+def decode_audio(file_path, start_ms=None, duration_ms=None):
+    """
+    Decodes a file (or part of it) to 44.1 kHz 16-bit stereo PCM.
+    Seeking is done on the input side, so ffmpeg only decodes the frames
+    that are actually needed instead of everything before start_ms.
+    """
+    command = [AudioSegment.converter, "-v", "error"]
+    if start_ms:
+        command += ["-ss", f"{start_ms / 1000:.3f}"]
+    command += ["-i", file_path, "-vn"]
+    if duration_ms is not None:
+        command += ["-t", f"{duration_ms / 1000:.3f}"]
+    command += ["-f", "s16le", "-acodec", "pcm_s16le",
+                "-ar", str(MIX_FRAME_RATE), "-ac", str(MIX_CHANNELS), "-"]
+
+    with METRICS.timer("combiner_stage_seconds", stage="decode"):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Could not decode {os.path.basename(file_path)}: "
+                           f"{result.stderr.decode(errors='ignore').strip()}")
+
+    return AudioSegment(data=result.stdout,
+                        sample_width=MIX_SAMPLE_WIDTH,
+                        frame_rate=MIX_FRAME_RATE,
+                        channels=MIX_CHANNELS)
+
+def compute_trim_points(file_path):
+    """Decodes a whole file and returns [start_ms, end_ms] of its non-silent part"""
+    audio_segment = decode_audio(file_path)
+    cache_track_peaks(os.path.dirname(file_path), os.path.basename(file_path), audio_segment)
+    start_trim, end_trim = find_trim_points(audio_segment)
+    return [start_trim, end_trim]
+
+def ensure_trim_points(input_folder, files, index, max_workers=None):
+    """
+    Returns {filename: [start_ms, end_ms]}, computing missing trim points
+    in a process pool and storing them in the library index. Songs that
+    cannot be decoded are logged and left out of the result.
+    """
+    trims = {}
+    pending = []
+    for filename in files:
+        cached = index.lookup(filename, "trim")
+        if cached:
+            trims[filename] = cached
+        elif filename not in pending:
+            pending.append(filename)
+
+    def store(filename, compute):
+        try:
+            trims[filename] = compute()
+        except Exception as e:
+            print(f"Could not find trim points ({filename}): {e}")
+            return
+        index.set(filename, "trim", trims[filename])
+
+    # Išsaugoti ir tada, kai kažkas nepavyksta, kad apskaičiuoti taškai neprapultų
+    try:
+        if len(pending) == 1:
+            store(pending[0], lambda: compute_trim_points(os.path.join(input_folder, pending[0])))
+        elif pending:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = {pool.submit(compute_trim_points, os.path.join(input_folder, filename)): filename
+                           for filename in pending}
+                for future in as_completed(futures):
+                    store(futures[future], future.result)
+    finally:
+        if pending:
+            index.save()
+    return trims
+
+# Beat-aligned crossfades: beats are only detected in short windows at the
+# start and end of each trimmed track, never in the whole song
+BEAT_WINDOW_MS = 8000
+BEAT_MATCH_TOLERANCE_MS = 40
+
+# Beat-aligned crossfades may be up to this many times the base crossfade
+BEAT_MAX_CROSSFADE_FACTOR = 2
+
+def detect_beats(audio_segment):
+    """Beat times (ms) in a short piece of mix audio"""
+    samples = np.frombuffer(audio_segment.raw_data, dtype=np.int16).reshape(-1, MIX_CHANNELS)
+    if len(samples) < MIX_FRAME_RATE:
+        return []
+    # Ritmui užtenka mono ir 22,05 kHz
+    mono = samples.mean(axis=1, dtype=np.float32) / 32768.0
+    mono = mono[:len(mono) // 2 * 2].reshape(-1, 2).mean(axis=1)
+    _, beats = librosa.beat.beat_track(y=mono, sr=MIX_FRAME_RATE // 2, units='time')
+    return [int(round(t * 1000)) for t in beats]
+
+def beat_grid_from_windows(intro, outro):
+    """
+    Beat grid of a track from its first and last window: "intro" beats in
+    ms from the start, "outro" beats in ms before the end
+    """
+    outro_ms = len(outro)
+    return {"intro": detect_beats(intro),
+            "outro": sorted(outro_ms - t for t in detect_beats(outro))}
+
+def track_beat_grid(input_folder, filename, trim, index, audio_segment=None):
+    """
+    Returns the cached beat grid of a track trimmed to trim. audio_segment
+    is the trimmed track if it is already decoded; otherwise only the two
+    edge windows are decoded.
+    """
+    cached = index.lookup(filename, "beats")
+    if cached and cached.get("trim") == list(trim):
+        return cached
+
+    window_ms = min(BEAT_WINDOW_MS, trim[1] - trim[0])
+    if audio_segment is not None:
+        intro = audio_segment[:window_ms]
+        outro = audio_segment[len(audio_segment) - window_ms:]
+    else:
+        file_path = os.path.join(input_folder, filename)
+        intro = decode_audio(file_path, trim[0], window_ms)
+        outro = decode_audio(file_path, trim[1] - window_ms, window_ms)
+
+    grid = beat_grid_from_windows(intro, outro)
+    grid["trim"] = list(trim)
+    index.set(filename, "beats", grid)
+    return grid
+
+def beat_aligned_crossfade(outro_beats, intro_beats, crossfade_ms, max_crossfade_ms):
+    """
+    Crossfade length (ms) that lays the beats of the incoming intro on the
+    beats of the outgoing outro, as close to crossfade_ms as possible.
+    A beat d ms before the end of the outgoing track meets a beat b ms
+    into the incoming one when the crossfade is d + b ms long. Falls back
+    to crossfade_ms if no such length fits.
+    """
+    best = None
+    for d in outro_beats:
+        for b in intro_beats:
+            length = d + b
+            if length < crossfade_ms // 2 or length > max_crossfade_ms:
+                continue
+            # Kiek dūžių sutampa per visą perėjimą
+            incoming = [t for t in intro_beats if t <= length]
+            matched = sum(1 for t in outro_beats if t <= length
+                          and any(abs(length - t - u) <= BEAT_MATCH_TOLERANCE_MS for u in incoming))
+            score = (matched, -abs(length - crossfade_ms))
+            if best is None or score > best[0]:
+                best = (score, length)
+    return best[1] if best else crossfade_ms
+
+class BeatAligner:
+    """Chooses the crossfade length of each join while tracks are appended in order"""
+    def __init__(self, input_folder, index, crossfade_ms=DEFAULT_CROSSFADE_MS, max_crossfade_ms=None):
+        self.input_folder = input_folder
+        self.index = index
+        self.crossfade_ms = crossfade_ms
+        self.max_crossfade_ms = max_crossfade_ms or crossfade_ms * BEAT_MAX_CROSSFADE_FACTOR
+        self.previous = None  # beat grid of the previous track
+
+    def crossfade_for(self, filename, trim, audio_segment=None, previous_file=None):
+        """
+        Crossfade (ms) from the previous track into this one, or None for
+        the first track. previous_file is only needed when continuing a
+        mix whose previous track was not appended through this aligner.
+        """
+        grid = track_beat_grid(self.input_folder, filename, trim, self.index, audio_segment)
+        previous = self.previous
+        if previous is None and previous_file is not None:
+            previous_trim = self.index.lookup(previous_file, "trim") or \
+                compute_trim_points(os.path.join(self.input_folder, previous_file))
+            previous = track_beat_grid(self.input_folder, previous_file, previous_trim, self.index)
+        self.previous = grid
+        if previous is None:
+            return None
+        return beat_aligned_crossfade(previous["outro"], grid["intro"], self.crossfade_ms, self.max_crossfade_ms)
+
+def render_transition(input_folder, file_a, trim_a, file_b, trim_b,
+                      crossfade_ms=DEFAULT_CROSSFADE_MS, context_ms=PREVIEW_CONTEXT_MS):
+    """
+    Renders one join: the trimmed tail of track A crossfaded into the
+    trimmed head of track B, with context_ms of audio on each side.
+    Only these two short windows are decoded.
+    """
+    tail_ms = min(crossfade_ms + context_ms, trim_a[1] - trim_a[0])
+    head_ms = min(crossfade_ms + context_ms, trim_b[1] - trim_b[0])
+
+    tail = decode_audio(os.path.join(input_folder, file_a), trim_a[1] - tail_ms, tail_ms)
+    head = decode_audio(os.path.join(input_folder, file_b), trim_b[0], head_ms)
+
+    return tail.append(head, crossfade=min(crossfade_ms, len(tail), len(head)))
+
+def preview_transition(input_folder, file_a, file_b, crossfade_ms=DEFAULT_CROSSFADE_MS,
+                       context_ms=PREVIEW_CONTEXT_MS, index=None):
+    """Renders the transition between two tracks for auditioning"""
+    if index is None:
+        index = LibraryIndex.shared(input_folder)
+    trims = ensure_trim_points(input_folder, [file_a, file_b], index)
+    for file in (file_a, file_b):
+        if file not in trims:
+            raise ValueError(f"Could not decode {file}")
+    return render_transition(input_folder, file_a, trims[file_a], file_b, trims[file_b],
+                             crossfade_ms, context_ms)
+
+def preview_all_transitions(input_folder, files, output_folder=None, crossfade_ms=DEFAULT_CROSSFADE_MS,
+                            context_ms=PREVIEW_CONTEXT_MS, max_workers=None, progress_callback=None):
+    """
+    Renders every join of a playlist in parallel. Returns the list of
+    previews (None for joins with a song that could not be decoded) and,
+    if output_folder is given, exports them there as Transition_NN.mp3
+    files.
+    """
+    index = LibraryIndex.shared(input_folder)
+    trims = ensure_trim_points(input_folder, files, index, max_workers)
+
+    joins = list(zip(files, files[1:]))
+    previews = [None] * len(joins)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(render_transition, input_folder, file_a, trims[file_a],
+                               file_b, trims[file_b], crossfade_ms, context_ms): i
+                   for i, (file_a, file_b) in enumerate(joins) if file_a in trims and file_b in trims}
+        for done, future in enumerate(as_completed(futures), 1):
+            previews[futures[future]] = future.result()
+            if progress_callback:
+                progress_callback(done, len(futures))
+
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+        for i, preview in enumerate(previews, 1):
+            if preview is None:
+                continue
+            preview.export(os.path.join(output_folder, f"Transition_{i:02d}.mp3"),
+                           format="mp3", bitrate="320k")
+
+    return previews
+
+def play_audio(audio_segment):
+    """Plays audio in a background thread so the Tk loop keeps running"""
+    thread = threading.Thread(target=pydub_playback.play, args=(audio_segment,), daemon=True)
+    thread.start()
+    return thread
+
+# Snippet audition in the song selector
+AUDITION_MS = 8000
+AUDITION_CACHE_SIZE = 32  # decoded snippets kept in memory
+
+def audition_start_ms(input_folder, filename, position="middle", index=None):
+    """
+    Where a snippet of a song starts: at the cached trim start ("intro")
+    or centred in the song ("middle"). Without cached trim points the
+    length comes from the file header.
+    """
+    trim = (index or LibraryIndex.shared(input_folder)).get(filename, "trim")
+    if trim is None:
+        try:
+            trim = [0, int(sf.info(os.path.join(input_folder, filename)).duration * 1000)]
+        except Exception:
+            trim = [0, None]
+    if position == "intro" or not trim[1]:
+        return trim[0]
+    return max(trim[0], (trim[0] + trim[1]) // 2 - AUDITION_MS // 2)
+
+def wav_bytes(audio_segment):
+    """Raw PCM of a segment wrapped in a WAV header"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(audio_segment.channels)
+        f.setsampwidth(audio_segment.sample_width)
+        f.setframerate(audio_segment.frame_rate)
+        f.writeframes(audio_segment.raw_data)
+    return buffer.getvalue()
+
+class SnippetPlayer:
+    """
+    Plays short snippets of library songs. A snippet is decoded with an
+    input-side seek in a worker thread (only a few seconds of the MP3 are
+    read) and kept in a small LRU cache, so prefetch() on selection makes
+    the following play() start almost at once. Only one snippet plays at
+    a time; play() and stop() never block the caller. Uses simpleaudio
+    when installed, otherwise ffplay, both of which can be stopped.
+    """
+    def __init__(self, input_folder, index=None, duration_ms=AUDITION_MS):
+        self.input_folder = input_folder
+        self.index = index or LibraryIndex.shared(input_folder)
+        self.duration_ms = duration_ms
+        self.cache = collections.OrderedDict()
+        self.loading = {}
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=2)
+        self.playback = None
+        self.request = 0  # naujesnis play() atšaukia dar nepradėtą senesnį
+
+    def decode(self, key):
+        filename, position = key
+        try:
+            start_ms = audition_start_ms(self.input_folder, filename, position, self.index)
+            snippet = decode_audio(os.path.join(self.input_folder, filename), start_ms, self.duration_ms)
+            with self.lock:
+                self.cache[key] = snippet
+                while len(self.cache) > AUDITION_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+            return snippet
+        finally:
+            # Nepavykęs dekodavimas neturi likti „kraunamas“, kitaip jo niekada nebandytume iš naujo
+            with self.lock:
+                self.loading.pop(key, None)
+
+    def prefetch(self, filename, position="middle"):
+        """Starts decoding a snippet in the background; returns its future"""
+        key = (filename, position)
+        with self.lock:
+            if key in self.cache:
+                METRICS.inc("combiner_cache_requests_total", cache="snippet", result="hit")
+                self.cache.move_to_end(key)
+                future = Future()
+                future.set_result(self.cache[key])
+                return future
+            METRICS.inc("combiner_cache_requests_total", cache="snippet", result="miss")
+            if key not in self.loading:
+                self.loading[key] = self.pool.submit(self.decode, key)
+            return self.loading[key]
+
+    def play(self, filename, position="middle"):
+        """
+        Stops the current snippet and plays this one as soon as it is
+        decoded. Returns a future that is done once playback has started
+        (or failed).
+        """
+        self.stop()
+        with self.lock:
+            self.request += 1
+            request = self.request
+        started = Future()
+
+        def start(loaded):
+            try:
+                snippet = loaded.result()
+                with self.lock:
+                    if request == self.request:
+                        self.playback = self.start_playback(snippet)
+                started.set_result(None)
+            except Exception as e:
+                started.set_exception(e)
+
+        self.prefetch(filename, position).add_done_callback(start)
+        return started
+
+    def start_playback(self, snippet):
+        if simpleaudio is not None:
+            return simpleaudio.play_buffer(snippet.raw_data, snippet.channels,
+                                           snippet.sample_width, snippet.frame_rate)
+        ffplay = pydub_utils.which("ffplay")
+        if ffplay is None:
+            play_audio(snippet)  # pydub'o grotuvo sustabdyti negalima
+            return None
+        process = subprocess.Popen([ffplay, "-nodisp", "-autoexit", "-loglevel", "quiet",
+                                    "-probesize", "32", "-analyzeduration", "0", "-i", "-"],
+                                   stdin=subprocess.PIPE)
+
+        def feed():
+            try:
+                process.stdin.write(wav_bytes(snippet))
+                process.stdin.close()
+            except OSError:
+                pass  # sustabdytas anksčiau, nei gavo visą ištrauką
+
+        threading.Thread(target=feed, daemon=True).start()
+        return process
+
+    def stop(self):
+        """Stops the snippet that is playing (and any that is about to start)"""
+        with self.lock:
+            self.request += 1
+            playback, self.playback = self.playback, None
+        if playback is None:
+            return
+        if isinstance(playback, subprocess.Popen):
+            if playback.poll() is None:
+                playback.kill()
+        else:
+            playback.stop()
+
+    def close(self):
+        self.stop()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+# Bulk import of songs into the library folder
+FICLONE = 0x40049409  # Linux ioctl that clones a file's data blocks (reflink)
+IMPORT_HASH_BLOCK = 1024 * 1024
+
+def expand_import_sources(sources):
+    """
+    MP3 files from a mix of file paths, directories (searched recursively)
+    and glob patterns; "~" is expanded in all of them. Returns (files,
+    sources that matched no MP3 file).
+    """
+    files = []
+    unmatched = []
+    for source in sources:
+        found = len(files)
+        path = os.path.expanduser(source)
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = sorted(d for d in dirs if d != CACHE_DIR_NAME)
+                files += [os.path.join(root, name) for name in sorted(names) if name.lower().endswith('.mp3')]
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            files += sorted(match for match in glob.glob(path, recursive=True)
+                            if os.path.isfile(match) and match.lower().endswith('.mp3'))
+        if len(files) == found:
+            unmatched.append(source)
+
+    unique = []
+    seen = set()
+    for file in files:
+        real_path = os.path.realpath(file)
+        if real_path not in seen:
+            seen.add(real_path)
+            unique.append(file)
+    return unique, unmatched
+
+def has_mp3_header(file_path):
+    """Quick validity check: an MP3 frame header right after the optional ID3v2 tag"""
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(10)
+            offset = 0
+            if len(head) == 10 and head[:3] == b"ID3":
+                size = (head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14 | (head[8] & 0x7f) << 7 | head[9] & 0x7f
+                offset = 10 + size + (10 if head[5] & 0x10 else 0)
+            f.seek(offset)
+            data = f.read(4096)
+    except OSError:
+        return False
+
+    for i in range(len(data) - 2):
+        if data[i] != 0xFF or data[i + 1] & 0xE0 != 0xE0:
+            continue
+        # Versija, sluoksnis, bitų sparta ir dažnis turi būti leistini
+        version = (data[i + 1] >> 3) & 3
+        layer = (data[i + 1] >> 1) & 3
+        bitrate = data[i + 2] >> 4
+        sample_rate = (data[i + 2] >> 2) & 3
+        if version != 1 and layer != 0 and bitrate not in (0, 15) and sample_rate != 3:
+            return True
+    return False
+
+def file_content_hash(file_path):
+    """SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(IMPORT_HASH_BLOCK)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+def clone_file(source, destination, allow_hardlink=True):
+    """
+    Creates destination with the contents of source as cheaply as possible:
+    a reflink (copy-on-write clone), a hard link on the same filesystem,
+    or a normal copy. Returns the method used.
+    """
+    if fcntl is not None:
+        with open(source, "rb") as src, open(destination, "xb") as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                cloned = True
+            except OSError:
+                cloned = False
+        if cloned:
+            shutil.copystat(source, destination)
+            return "reflink"
+        os.remove(destination)
+
+    if allow_hardlink:
+        try:
+            os.link(source, destination)
+            return "hardlink"
+        except OSError:
+            pass
+    shutil.copy2(source, destination)
+    return "copy"
+
+def unique_library_name(input_folder, filename, taken):
+    """filename, or "name (2).mp3" etc. if that name is already used in the folder"""
+    base, extension = os.path.splitext(filename)
+    candidate = filename
+    number = 2
+    while candidate.lower() in taken or os.path.exists(os.path.join(input_folder, candidate)):
+        candidate = f"{base} ({number}){extension}"
+        number += 1
+    taken.add(candidate.lower())
+    return candidate
+
+def import_songs(input_folder, sources, allow_hardlink=True, max_workers=None, progress_callback=None):
+    """
+    Imports MP3 files (paths, directories or glob patterns) into the library
+    folder in parallel. Files without a valid MP3 header are rejected and
+    songs whose content is already in the library (or earlier in the batch)
+    are skipped; only files of the same size are ever hashed to find them.
+    Existing songs are never overwritten. Returns a dict with "imported" and
+    "duplicates" ({source: name in the library}), "invalid", "failed" and
+    "unmatched" (sources that matched no MP3 file).
+    progress_callback(done, total, text) is called as files are processed.
+    """
+    index = LibraryIndex.shared(input_folder)
+    result = {"imported": {}, "duplicates": {}, "invalid": [], "failed": {}}
+    sources, result["unmatched"] = expand_import_sources(sources)
+    library = [f for f in os.listdir(input_folder) if f.lower().endswith('.mp3')]
+
+    def report(done, text):
+        if progress_callback:
+            progress_callback(done, len(sources), text)
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(32, (os.cpu_count() or 1) * 4)) as pool:
+        # Antraštės patikrinimas ir dydžiai lygiagrečiai
+        report(0, "Checking files...")
+        checks = list(pool.map(lambda path: (has_mp3_header(path), file_signature(path)), sources))
+        candidates = []
+        for path, (valid, signature) in zip(sources, checks):
+            if valid and signature is not None:
+                candidates.append((path, signature[0]))
+            else:
+                result["invalid"].append(path)
+
+        # Dublikatai gali būti tik tarp vienodo dydžio failų
+        library_sizes = {}
+        for name in library:
+            signature = index.file_signature(name)
+            if signature is not None:
+                library_sizes.setdefault(signature[0], []).append(name)
+        incoming_sizes = collections.Counter(size for _, size in candidates)
+        to_hash = [path for path, size in candidates if size in library_sizes or incoming_sizes[size] > 1]
+        library_to_hash = sorted({name for _, size in candidates if size in library_sizes
+                                  for name in library_sizes[size] if index.get(name, "content_hash") is None})
+
+        report(0, f"Comparing {len(to_hash)} files with the library...")
+        hashes = dict(zip(to_hash, pool.map(file_content_hash, to_hash)))
+        for name, content_hash in zip(library_to_hash,
+                                      pool.map(file_content_hash,
+                                               [os.path.join(input_folder, name) for name in library_to_hash])):
+            index.set(name, "content_hash", content_hash)
+        known = {}
+        for size in incoming_sizes:
+            for name in library_sizes.get(size, []):
+                if index.get(name, "content_hash"):
+                    known[index.get(name, "content_hash")] = name
+
+        # Pavadinimai parenkami iš anksto, kad lygiagretūs kopijavimai nesusidurtų
+        taken = set()
+        planned = []
+        for path, size in candidates:
+            content_hash = hashes.get(path)
+            if content_hash is not None and content_hash in known:
+                result["duplicates"][path] = known[content_hash]
+                continue
+            name = unique_library_name(input_folder, os.path.basename(path), taken)
+            if content_hash is not None:
+                known[content_hash] = name
+            planned.append((path, name, content_hash))
+
+        futures = {pool.submit(clone_file, path, os.path.join(input_folder, name), allow_hardlink):
+                   (path, name, content_hash) for path, name, content_hash in planned}
+        for done, future in enumerate(as_completed(futures), 1):
+            path, name, content_hash = futures[future]
+            try:
+                future.result()
+                result["imported"][path] = name
+                if content_hash is not None:
+                    index.set(name, "content_hash", content_hash)
+            except OSError as e:
+                result["failed"][path] = str(e)
+            report(len(sources) - len(planned) + done, f"Imported: {name}")
+
+    index.save()
+    return result
+
+def analyze_imported_track(file_path):
+    """Trim points and loudness (dBFS of the trimmed song) of a track; caches its waveform too"""
+    audio_segment = decode_audio(file_path)
+    cache_track_peaks(os.path.dirname(file_path), os.path.basename(file_path), audio_segment)
+    trim = list(find_trim_points(audio_segment))
+    loudness = audio_segment[trim[0]:trim[1]].dBFS
+    return {"trim": trim, "loudness": round(loudness, 2) if math.isfinite(loudness) else None}
+
+def analyze_library_files(input_folder, files, max_workers=None, progress_callback=None):
+    """
+    Computes trim points and loudness of songs that do not have them yet in
+    a process pool and stores them in the library index. Returns
+    {filename: error} for songs that could not be decoded.
+    """
+    index = LibraryIndex.shared(input_folder)
+    pending = [f for f in files if index.get(f, "trim") is None or index.get(f, "loudness") is None]
+    errors = {}
+    if not pending:
+        return errors
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {pool.submit(analyze_imported_track, os.path.join(input_folder, filename)): filename
+                   for filename in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            filename = futures[future]
+            try:
+                analysis = future.result()
+                index.set(filename, "trim", analysis["trim"])
+                index.set(filename, "loudness", analysis["loudness"])
+            except Exception as e:
+                errors[filename] = str(e)
+            if progress_callback:
+                progress_callback(done, len(pending), f"Analysed: {filename}")
+            # Išsaugoti retkarčiais, kad nutraukus nepradingtų visas darbas
+            if done % 100 == 0:
+                index.save()
+    index.save()
+    return errors
+
+# Frames per bucket at the finest waveform level (~12 ms)
+WAVEFORM_BASE_BUCKET = 512
+
+# Coarser levels are added until a level has fewer buckets than this
+WAVEFORM_MIN_BUCKETS = 256
+
+class PeakPyramid:
+    """
+    Multi-resolution waveform overview: min/max peaks and RMS per bucket.
+    Level 0 has WAVEFORM_BASE_BUCKET frames per bucket and every next
+    level halves the resolution. Values are stored as int8 (peaks) and
+    uint8 (RMS), so a 3-hour mix needs only a few MB at the finest level.
+    """
+    def __init__(self, frames, mins, maxs, rms):
+        self.frames = frames
+        self.mins = mins
+        self.maxs = maxs
+        self.rms = rms
+
+    @staticmethod
+    def reduce_levels(mins, maxs, squares):
+        """Builds all levels from float arrays of the finest level"""
+        levels = [(mins, maxs, squares)]
+        while len(mins) > WAVEFORM_MIN_BUCKETS:
+            if len(mins) % 2:
+                mins, maxs, squares = (np.append(mins, mins[-1]), np.append(maxs, maxs[-1]),
+                                       np.append(squares, squares[-1]))
+            mins = np.minimum(mins[0::2], mins[1::2])
+            maxs = np.maximum(maxs[0::2], maxs[1::2])
+            squares = (squares[0::2] + squares[1::2]) / 2
+            levels.append((mins, maxs, squares))
+        return levels
+
+    @classmethod
+    def from_levels(cls, frames, levels):
+        """Quantises float levels (values in -1..1, mean squares) for storage"""
+        mins = [np.clip(np.floor(level[0] * 127), -128, 127).astype(np.int8) for level in levels]
+        maxs = [np.clip(np.ceil(level[1] * 127), -128, 127).astype(np.int8) for level in levels]
+        rms = [np.clip(np.sqrt(level[2]) * 255, 0, 255).astype(np.uint8) for level in levels]
+        return cls(frames, mins, maxs, rms)
+
+    @classmethod
+    def from_pcm(cls, data):
+        """Builds the pyramid from raw mix PCM (16-bit stereo)"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        frames = len(samples) // MIX_CHANNELS
+        if frames == 0:
+            return cls(0, [np.zeros(0, np.int8)], [np.zeros(0, np.int8)], [np.zeros(0, np.uint8)])
+
+        # Sujungti kanalus ir sulyginti iki pilnų kibirėlių
+        padded = -(-frames // WAVEFORM_BASE_BUCKET) * WAVEFORM_BASE_BUCKET
+        buckets = np.zeros(padded * MIX_CHANNELS, dtype=np.float32)
+        buckets[:frames * MIX_CHANNELS] = samples[:frames * MIX_CHANNELS] / 32768.0
+        buckets = buckets.reshape(-1, WAVEFORM_BASE_BUCKET * MIX_CHANNELS)
+
+        levels = cls.reduce_levels(buckets.min(axis=1), buckets.max(axis=1), (buckets ** 2).mean(axis=1))
+        return cls.from_levels(frames, levels)
+
+    @classmethod
+    def stitch(cls, pieces, total_frames):
+        """
+        Builds a mix overview from track pyramids. pieces is a list of
+        (pyramid, first frame used, last frame used, start frame in the mix);
+        overlapping crossfades are combined bucket by bucket.
+        """
+        size = -(-total_frames // WAVEFORM_BASE_BUCKET)
+        mins = np.zeros(size, dtype=np.float32)
+        maxs = np.zeros(size, dtype=np.float32)
+        squares = np.zeros(size, dtype=np.float32)
+        counts = np.zeros(size, dtype=np.float32)
+
+        for pyramid, first_frame, last_frame, mix_start in pieces:
+            first = first_frame // WAVEFORM_BASE_BUCKET
+            last = min(-(-last_frame // WAVEFORM_BASE_BUCKET), len(pyramid.mins[0]))
+            if last <= first:
+                continue
+            buckets = np.arange(first, last)
+            columns = (mix_start + buckets * WAVEFORM_BASE_BUCKET - first_frame) // WAVEFORM_BASE_BUCKET
+            keep = (columns >= 0) & (columns < size)
+            buckets, columns = buckets[keep], columns[keep]
+            np.minimum.at(mins, columns, pyramid.mins[0][buckets] / 127.0)
+            np.maximum.at(maxs, columns, pyramid.maxs[0][buckets] / 127.0)
+            np.add.at(squares, columns, (pyramid.rms[0][buckets] / 255.0) ** 2)
+            np.add.at(counts, columns, 1)
+
+        squares /= np.maximum(counts, 1)
+        return cls.from_levels(total_frames, cls.reduce_levels(mins, maxs, squares))
+
+    def overview(self, width, start_frame=0, end_frame=None):
+        """
+        Returns (mins, maxs, rms) float arrays of the given width for a
+        frame range, using the coarsest level that still has enough detail.
+        """
+        end_frame = self.frames if end_frame is None else end_frame
+        span = max(end_frame - start_frame, 1)
+        level = 0
+        while (level + 1 < len(self.mins)
+               and WAVEFORM_BASE_BUCKET * 2 ** (level + 1) <= span / max(width, 1)):
+            level += 1
+
+        bucket_frames = WAVEFORM_BASE_BUCKET * 2 ** level
+        first = start_frame // bucket_frames
+        last = max(min(-(-end_frame // bucket_frames), len(self.mins[level])), first)
+        columns = ((np.arange(first, last) * bucket_frames - start_frame) * width // span).clip(0, width - 1)
+
+        mins = np.zeros(width, dtype=np.float32)
+        maxs = np.zeros(width, dtype=np.float32)
+        rms = np.zeros(width, dtype=np.float32)
+        np.minimum.at(mins, columns, self.mins[level][first:last] / 127.0)
+        np.maximum.at(maxs, columns, self.maxs[level][first:last] / 127.0)
+        np.maximum.at(rms, columns, self.rms[level][first:last] / 255.0)
+        return mins, maxs, rms
+
+    def save(self, path):
+        arrays = {"frames": np.array([self.frames], dtype=np.int64)}
+        for level, (mins, maxs, rms) in enumerate(zip(self.mins, self.maxs, self.rms)):
+            arrays[f"min_{level}"] = mins
+            arrays[f"max_{level}"] = maxs
+            arrays[f"rms_{level}"] = rms
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved pyramid, or returns None if it is missing or broken"""
+        try:
+            with np.load(path) as arrays:
+                levels = len([key for key in arrays.files if key.startswith("min_")])
+                return cls(int(arrays["frames"][0]),
+                           [arrays[f"min_{level}"] for level in range(levels)],
+                           [arrays[f"max_{level}"] for level in range(levels)],
+                           [arrays[f"rms_{level}"] for level in range(levels)])
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Sugadintas ar nebaigtas įrašyti failas laikomas tiesiog nesančiu talpykloje
+            return None
+
+def track_peaks_path(input_folder, filename):
+    """
+    Cache path of a track's peak pyramid. The file size and mtime are part
+    of the name, so a changed file never matches an old pyramid, and
+    render workers can write pyramids without touching the library index.
+    """
+    signature = file_signature(os.path.join(input_folder, filename)) or [0, 0]
+    name_hash = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(input_folder, CACHE_DIR_NAME, "peaks",
+                        f"{name_hash}_{signature[0]}_{signature[1]}.npz")
+
+def cache_track_peaks(input_folder, filename, audio_segment):
+    """Stores the peak pyramid of a freshly decoded (untrimmed) track, unless it is cached already"""
+    path = track_peaks_path(input_folder, filename)
+    if os.path.exists(path):
+        return
+    try:
+        PeakPyramid.from_pcm(audio_segment.raw_data).save(path)
+    except OSError as e:
+        print(f"Could not cache waveform ({filename}): {e}")
+
+def load_track_peaks(input_folder, filename, compute=False):
+    """
+    Returns the cached peak pyramid of a track. With compute=True a missing
+    pyramid is built by decoding the track (the trim points are cached too).
+    """
+    path = track_peaks_path(input_folder, filename)
+    pyramid = PeakPyramid.load(path)
+    if pyramid is None and compute:
+        audio_segment = decode_audio(os.path.join(input_folder, filename))
+        pyramid = PeakPyramid.from_pcm(audio_segment.raw_data)
+        pyramid.save(path)
+        index = LibraryIndex.shared(input_folder)
+        if index.get(filename, "trim") is None:
+            index.set(filename, "trim", list(find_trim_points(audio_segment)))
+            index.save()
+    return pyramid
+
+def build_mix_peaks(input_folder, files, track_starts, total_frames, index=None):
+    """
+    Stitches the cached track pyramids into an overview of the whole mix
+    using the track start offsets from the assembler and the trim points.
+    Tracks without a cached pyramid are left blank.
+    """
+    if index is None:
+        index = LibraryIndex.shared(input_folder)
+    pieces = []
+    for filename, mix_start in zip(files, track_starts):
+        pyramid = load_track_peaks(input_folder, filename)
+        trim = index.get(filename, "trim")
+        if pyramid is None or trim is None:
+            continue
+        pieces.append((pyramid, trim[0] * MIX_FRAME_RATE // 1000, trim[1] * MIX_FRAME_RATE // 1000, mix_start))
+    return PeakPyramid.stitch(pieces, total_frames)
+
+def mix_peaks_path(output_file):
+    """Path of the saved waveform overview next to an exported mix"""
+    return os.path.splitext(output_file)[0] + ".peaks.npz"
+
+def save_mix_peaks(input_folder, files, track_starts, total_frames, output_file, index=None):
+    """Builds and saves the overview of an exported mix; a failure does not affect the export"""
+    try:
+        build_mix_peaks(input_folder, files, track_starts, total_frames, index).save(mix_peaks_path(output_file))
+    except Exception as e:
+        print(f"Could not save mix waveform: {e}")
+
+def draw_waveform(canvas, pyramid, markers=None, color='#1e90ff', rms_color='#87cefa'):
+    """Draws a pyramid on a Tk canvas; markers are frame positions drawn as lines"""
+    canvas.delete("waveform")
+    width = max(canvas.winfo_width(), 1)
+    height = max(canvas.winfo_height(), 1)
+    if pyramid is None or pyramid.frames == 0:
+        return
+
+    mins, maxs, rms = pyramid.overview(width)
+    middle = height / 2
+    for x in range(width):
+        canvas.create_line(x, middle - maxs[x] * middle, x, middle - mins[x] * middle + 1,
+                           fill=color, tags="waveform")
+        if rms[x] > 0:
+            canvas.create_line(x, middle - rms[x] * middle, x, middle + rms[x] * middle + 1,
+                               fill=rms_color, tags="waveform")
+
+    for frame in markers or []:
+        x = int(frame * width // max(pyramid.frames, 1))
+        canvas.create_line(x, 0, x, height, fill='#ff8c00', tags="waveform")
+
+class WaveformWindow(tk.Toplevel):
+    """Shows the waveform overview of an exported mix with track markers"""
+    def __init__(self, parent, pyramid, title="Mix Waveform", markers=None):
+        super().__init__(parent)
+        self.title(title)
+        self.configure(bg='#121212')
+        self.geometry("1200x260")
+        self.pyramid = pyramid
+        self.markers = markers or []
+
+        self.canvas = tk.Canvas(self, bg='#1e1e1e', highlightthickness=0)
+        self.canvas.pack(fill='both', expand=True, padx=10, pady=10)
+        self.canvas.bind("<Configure>", lambda event: draw_waveform(self.canvas, self.pyramid, self.markers))
+
+# Folder (inside the output folder) holding the checkpoint of an unfinished render
+RENDER_STATE_DIR = ".mix_render"
+
+MIX_FRAME_WIDTH = MIX_CHANNELS * MIX_SAMPLE_WIDTH
+
+def remove_numbering(song_name):
+    """
+    Pašalina numeraciją iš dainos pavadinimo.
+    Pvz., "15. Dainos pavadinimas" => "Dainos pavadinimas"
+    """
+    # Pašalina bet kokį skaičių su tašku ir tarpu
+    # (pvz., "15. ", "123. ", ir t.t.)
+    cleaned_name = re.sub(r'^\d+\.\s+', '', song_name)
+    # Pašalina bet kokį skaičių pradžioje (pvz., "15 ", "123 ", ir t.t.)
+    cleaned_name = re.sub(r'^\d+\s+', '', cleaned_name)
+    return cleaned_name
+
+def format_song_title(filename):
+    """Dainos pavadinimas tracklist'ui, pvz. "Dainos pavadinimas (Hyper Demon Remix)\""""
+    song_name = remove_numbering(os.path.splitext(filename)[0])
+    return f"{song_name} (Hyper Demon Remix)"
+
+def format_tracklist_entry(position_ms, filename):
+    """Suformuoja tracklist'o eilutę, pvz. "03:15 Dainos pavadinimas (Hyper Demon Remix)\""""
+    minutes = position_ms // 60000
+    seconds = (position_ms % 60000) // 1000
+    return f"{minutes:02d}:{seconds:02d} {format_song_title(filename)}"
+
+def read_export_counter(counter_file):
+    """Įkelti eksportavimo skaitliuką iš failo arba pradėti nuo 1"""
+    try:
+        if os.path.exists(counter_file):
+            with open(counter_file, "r") as f:
+                return int(f.read().strip())
+        return 1
+    except:
+        return 1
+
+def write_export_counter(counter_file, value):
+    """Išsaugoti eksportavimo skaitliuką į failą"""
+    try:
+        with open(counter_file, "w") as f:
+            f.write(str(value))
+    except:
+        pass
+
+def frames_to_ms(frames, rounded=False):
+    """Converts a frame count of mix PCM to milliseconds"""
+    if rounded:
+        return int(round(frames * 1000 / MIX_FRAME_RATE))
+    return int(frames * 1000 // MIX_FRAME_RATE)
+
+def pcm_to_segment(data):
+    """Wraps raw mix PCM in an AudioSegment"""
+    return AudioSegment(data=data,
+                        sample_width=MIX_SAMPLE_WIDTH,
+                        frame_rate=MIX_FRAME_RATE,
+                        channels=MIX_CHANNELS)
+
+class RenderCancelled(Exception):
+    """Raised to stop a render; its checkpoint is kept so it can be resumed"""
+
+def render_result(error):
+    """Result label of a render that stopped with error"""
+    return "cancelled" if isinstance(error, (RenderCancelled, KeyboardInterrupt)) else "failed"
+
+class MixAssembler:
+    """
+    Streaming crossfade assembler. Tracks are appended one at a time and
+    all audio that can no longer change is written to the sinks right away,
+    so only the last crossfade window stays in memory. Joins may use their
+    own crossfade length up to max_crossfade_ms, which is what is held back.
+    """
+    BLOCK_SIZE = 1024 * 1024
+
+    def __init__(self, sinks, crossfade_ms=DEFAULT_CROSSFADE_MS, max_crossfade_ms=None):
+        self.sinks = list(sinks)
+        self.crossfade_ms = crossfade_ms
+        self.max_crossfade_ms = max(crossfade_ms, max_crossfade_ms or 0)
+        self.tail = None  # last crossfade window, not yet written
+        self.frames_written = 0
+        self.track_marks = []  # frame where each track takes over in the mix
+        self.track_starts = []  # frame where each track starts (beginning of its crossfade)
+
+    def position_frames(self):
+        """Length of everything appended so far in frames"""
+        return self.frames_written + (int(self.tail.frame_count()) if self.tail is not None else 0)
+
+    def position_ms(self):
+        """Length of everything appended so far in milliseconds"""
+        return frames_to_ms(self.position_frames())
+
+    def keep_frames(self):
+        """Frames held back for the next crossfade"""
+        return int(self.max_crossfade_ms * MIX_FRAME_RATE // 1000)
+
+    def crossfade_into(self, audio_segment, length_ms, crossfade_ms=None):
+        """
+        Crossfades the held tail into the start of the next piece.
+        Returns the mixed audio and the frame where the piece starts.
+        """
+        if self.tail is None:
+            return audio_segment, self.frames_written
+        if crossfade_ms is None:
+            crossfade_ms = self.crossfade_ms
+        crossfade = min(crossfade_ms, self.max_crossfade_ms, len(self.tail), length_ms)
+        start = self.position_frames() - int(self.tail[-crossfade:].frame_count()) if crossfade else self.position_frames()
+        return self.tail.append(audio_segment, crossfade=crossfade), start
+
+    def hold_tail(self, mixed):
+        """Writes mixed audio except the last window, which waits for the next piece"""
+        total_frames = int(mixed.frame_count())
+        keep_frames = min(self.keep_frames(), total_frames)
+        self.write(mixed.get_sample_slice(0, total_frames - keep_frames).raw_data)
+        self.tail = mixed.get_sample_slice(total_frames - keep_frames, total_frames)
+
+    def add_track(self, audio_segment, crossfade_ms=None):
+        """
+        Appends a track and returns the position where it takes over (ms).
+        crossfade_ms overrides the crossfade of this join.
+        """
+        mark = self.position_frames()
+        mixed, start = self.crossfade_into(audio_segment, len(audio_segment), crossfade_ms)
+        self.track_marks.append(mark)
+        self.track_starts.append(start)
+
+        # Paskutinis langas laukia kito takelio, visa kita jau galutinė
+        self.hold_tail(mixed)
+        return frames_to_ms(mark)
+
+    def add_pcm_file(self, pcm_file, total_frames, crossfade_ms=None, first_length_ms=None):
+        """
+        Appends a long pre-rendered piece of mix PCM (e.g. a segment from a
+        render worker) without loading it into memory. The result is the
+        same as add_track() with the whole piece. first_length_ms is the
+        length of the piece's first track, which limits the crossfade like
+        add_track() with that track would. Returns the frame where the piece
+        starts in the mix.
+        """
+        head_frames = min(total_frames, 2 * self.keep_frames() + MIX_FRAME_RATE)
+        head = pcm_to_segment(pcm_file.read(head_frames * MIX_FRAME_WIDTH))
+
+        mark = self.position_frames()
+        length_ms = frames_to_ms(total_frames, rounded=True)
+        if first_length_ms is not None:
+            length_ms = min(length_ms, first_length_ms)
+        mixed, start = self.crossfade_into(head, length_ms, crossfade_ms)
+        self.track_marks.append(mark)
+        self.track_starts.append(start)
+        if head_frames == total_frames:
+            self.hold_tail(mixed)
+            return start
+        self.tail = None
+
+        # Rašyti viską, išskyrus paskutinį langą kitam perėjimui
+        keep_bytes = self.keep_frames() * MIX_FRAME_WIDTH
+        pending = mixed.raw_data
+        while True:
+            block = pcm_file.read(self.BLOCK_SIZE)
+            if not block:
+                break
+            pending += block
+            if len(pending) > keep_bytes:
+                self.write(pending[:len(pending) - keep_bytes])
+                pending = pending[len(pending) - keep_bytes:]
+        self.tail = pcm_to_segment(pending)
+        return start
+
+    def write(self, data):
+        """Passes finished PCM to every sink"""
+        if not data:
+            return
+        for sink in self.sinks:
+            sink.write(data)
+        self.frames_written += len(data) // MIX_FRAME_WIDTH
+        METRICS.inc("combiner_audio_seconds_rendered_total", len(data) / (MIX_FRAME_WIDTH * MIX_FRAME_RATE))
+
+    def finish(self):
+        """Writes out the remaining tail"""
+        if self.tail is not None:
+            self.write(self.tail.raw_data)
+            self.tail = None
+
+    def get_state(self):
+        """Returns (state dict, tail PCM bytes) for checkpointing"""
+        state = {"frames_written": self.frames_written,
+                 "track_marks": list(self.track_marks),
+                 "track_starts": list(self.track_starts)}
+        return state, self.tail.raw_data if self.tail is not None else None
+
+    def restore_state(self, state, tail_data):
+        """Continues from a state returned by get_state()"""
+        self.frames_written = state["frames_written"]
+        self.track_marks = list(state["track_marks"])
+        # Senesni patikros taškai pradžių nesaugojo; žymės nuo jų skiriasi tik perėjimo ilgiu
+        self.track_starts = list(state.get("track_starts", state["track_marks"]))
+        self.tail = pcm_to_segment(tail_data) if tail_data is not None else None
+
+# Master bus: final gain and a lookahead peak limiter applied to the mix
+# PCM on its way to the encoders
+LIMITER_CEILING_DB = -1.0
+LIMITER_LOOKAHEAD_MS = 5
+LIMITER_RELEASE_DB_PER_SECOND = 30
+LIMITER_BLOCK_FRAMES = 65536
+
+def sliding_min(values, width):
+    """Minimum of every window of width consecutive values, in linear time (van Herk/Gil-Werman)"""
+    count = len(values) - width + 1
+    blocks = np.full(-(-len(values) // width) * width, np.inf, dtype=values.dtype)
+    blocks[:len(values)] = values
+    blocks = blocks.reshape(-1, width)
+    # Kiekvienas langas apima vieno bloko galą ir kito pradžią
+    prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.minimum(suffix[:count], prefix[width - 1:width - 1 + count])
+
+def limiter_settings(ceiling_db=LIMITER_CEILING_DB, gain_db=0.0):
+    """Master bus settings as stored in render jobs and cache keys"""
+    return {"ceiling_db": float(ceiling_db), "gain_db": float(gain_db)}
+
+class MasterLimiter:
+    """
+    Sink wrapper that applies gain_db and a lookahead peak limiter to the
+    mix PCM before passing it on. The gain each frame needs is known one
+    lookahead in advance: it takes the minimum over the lookahead window,
+    recovers at a fixed dB rate and is averaged over the lookahead, so the
+    reduction is fully in place when a peak arrives and the output never
+    goes above ceiling_db. The output lags by the lookahead until close()
+    flushes it, so the mix keeps its length and timing. Everything works
+    on blocks, so memory does not grow with the mix.
+    """
+    def __init__(self, sink, ceiling_db=LIMITER_CEILING_DB, gain_db=0.0,
+                 lookahead_ms=LIMITER_LOOKAHEAD_MS, release_db_per_second=LIMITER_RELEASE_DB_PER_SECOND):
+        self.sink = sink
+        self.ceiling = 32767 * 10 ** (ceiling_db / 20)
+        self.limit = max(1, int(self.ceiling))  # apvalinimas neturi peržengti ribos
+        self.gain = 10 ** (gain_db / 20)
+        self.lookahead = max(1, int(MIX_FRAME_RATE * lookahead_ms / 1000))
+        self.release_db = release_db_per_second / MIX_FRAME_RATE
+        # Ankstesnio bloko uodegos, reikalingos langams per bloko ribą
+        self.delayed = np.zeros((self.lookahead, MIX_CHANNELS), dtype=np.float32)
+        self.required = np.ones(self.lookahead, dtype=np.float32)
+        self.smoothed = np.ones(self.lookahead - 1, dtype=np.float64)
+        self.gain_db = 0.0
+        self.skip = self.lookahead  # delay line starts empty
+        self.max_reduction_db = 0.0
+
+    def process(self, samples):
+        """Limits a block of float frames and writes the block delayed by the lookahead"""
+        count = len(samples)
+        samples = samples * np.float32(self.gain)
+        peaks = np.abs(samples).max(axis=1)
+        required = np.minimum(1.0, self.ceiling / np.maximum(peaks, 1.0)).astype(np.float32)
+        required = np.concatenate([self.required, required])
+        self.required = required[-self.lookahead:]
+        target_db = 20 * np.log10(sliding_min(required, self.lookahead + 1).astype(np.float64))
+
+        # Atsistatymas pastoviu greičiu dB skalėje: min(tikslas[j] + greitis * (k - j))
+        ramp = self.release_db * np.arange(count)
+        gain_db = ramp + np.minimum(self.gain_db + self.release_db,
+                                    np.minimum.accumulate(target_db - ramp))
+        self.gain_db = gain_db[-1]
+        self.max_reduction_db = min(self.max_reduction_db, float(gain_db.min()))
+
+        gain = np.concatenate([self.smoothed, 10 ** (gain_db / 20)])
+        if self.lookahead > 1:
+            self.smoothed = gain[-(self.lookahead - 1):]
+        sums = np.concatenate([[0.0], np.cumsum(gain)])
+        gain = (sums[self.lookahead:] - sums[:-self.lookahead]) / self.lookahead
+
+        delayed = np.concatenate([self.delayed, samples])
+        self.delayed = delayed[count:]
+        output = delayed[:count] * gain[:, None].astype(np.float32)
+        if self.skip:
+            output = output[self.skip:]
+            self.skip = max(0, self.skip - count)
+        if len(output):
+            self.sink.write(np.clip(np.rint(output), -self.limit, self.limit).astype("<i2").tobytes())
+
+    def write(self, data):
+        samples = np.frombuffer(data, dtype="<i2").reshape(-1, MIX_CHANNELS)
+        for start in range(0, len(samples), LIMITER_BLOCK_FRAMES):
+            self.process(samples[start:start + LIMITER_BLOCK_FRAMES].astype(np.float32))
+
+    def close(self):
+        """Flushes the lookahead and closes the sink"""
+        self.process(np.zeros((self.lookahead, MIX_CHANNELS), dtype=np.float32))
+        self.sink.close()
+
+    def abort(self):
+        self.sink.abort()
+
+# Output formats: ffmpeg arguments, sample rate and default bitrate
+OUTPUT_FORMATS = {
+    "mp3": {"extension": ".mp3", "args": ["-f", "mp3"], "frame_rate": 44100, "bitrate": "320k"},
+    "opus": {"extension": ".opus", "args": ["-f", "opus", "-c:a", "libopus"], "frame_rate": 48000, "bitrate": "96k"},
+    "flac": {"extension": ".flac", "args": ["-f", "flac"], "frame_rate": 44100, "bitrate": None},
+}
+
+def parse_output_targets(specs, output_file):
+    """
+    Turns specs like "mp3:128k", "opus" or "flac" into output targets
+    named after output_file. The first target is output_file itself
+    (320 kbps MP3); the others get the format and bitrate in their name.
+    """
+    base = os.path.splitext(output_file)[0]
+    targets = [{"file": output_file, "format": "mp3", "bitrate": OUTPUT_FORMATS["mp3"]["bitrate"]}]
+    for spec in specs or []:
+        spec = spec.strip().lower()
+        if not spec:
+            continue
+        format_name, _, bitrate = spec.partition(":")
+        if format_name not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {format_name}")
+        output_format = OUTPUT_FORMATS[format_name]
+        bitrate = bitrate or output_format["bitrate"]
+        suffix = f"_{bitrate}" if bitrate and format_name == "mp3" else ""
+        target = {"file": base + suffix + output_format["extension"],
+                  "format": format_name, "bitrate": bitrate}
+        if all(existing["file"] != target["file"] for existing in targets):
+            targets.append(target)
+    return targets
+
+class AudioEncoder:
+    """
+    ffmpeg encoder fed with raw mix PCM through a pipe. With output_file
+    "pipe:1" and stdout=subprocess.PIPE the encoded stream can be read
+    from process.stdout instead of a file.
+    """
+    def __init__(self, output_file, format="mp3", bitrate="320k", stdout=None):
+        output_format = OUTPUT_FORMATS[format]
+        command = [AudioSegment.converter, "-v", "error", "-y",
+                   "-f", "s16le", "-ar", str(MIX_FRAME_RATE), "-ac", str(MIX_CHANNELS), "-i", "-"]
+        command += output_format["args"]
+        if bitrate:
+            command += ["-b:a", bitrate]
+        command += ["-ar", str(output_format["frame_rate"]), output_file]
+        self.output_file = output_file
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=stdout, stderr=subprocess.PIPE)
+
+    def write(self, data):
+        self.process.stdin.write(data)
+
+    def close(self):
+        """Flushes the encoder and waits for the file to be finished"""
+        _, errors = self.process.communicate()
+        if self.process.returncode != 0:
+            raise RuntimeError(f"Encoding {os.path.basename(self.output_file)} failed: "
+                               f"{errors.decode(errors='ignore').strip()}")
+
+    def abort(self):
+        """Stops the encoder, leaving whatever was written so far"""
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+class EncoderTee:
+    """
+    Feeds one PCM stream to several encoders running in parallel. Every
+    encoder has a bounded queue drained by its own thread, so a slow
+    encoder makes write() wait instead of piling up unbounded data.
+    """
+    BLOCK_SIZE = 256 * 1024
+
+    def __init__(self, encoders, max_pending_blocks=16):
+        self.encoders = list(encoders)
+        self.queues = [queue.Queue(maxsize=max_pending_blocks) for _ in self.encoders]
+        self.errors = []
+        self.threads = []
+        self.metric_labels = {"output": re.sub(r"\.part$", "", os.path.basename(self.encoders[0].output_file))
+                              if self.encoders else ""}
+        METRICS.set("combiner_encoder_backlog_blocks", self.backlog, **self.metric_labels)
+        for encoder, pending in zip(self.encoders, self.queues):
+            thread = threading.Thread(target=self.feed, args=(encoder, pending), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def feed(self, encoder, pending):
+        """Encoder thread: writes queued blocks until the end marker"""
+        failed = False
+        while True:
+            data = pending.get()
+            if data is None:
+                break
+            if failed:
+                continue
+            try:
+                encoder.write(data)
+            except Exception as e:
+                # Toliau tik išvalyti eilę, kad rašantysis neužstrigtų
+                self.errors.append(e)
+                failed = True
+
+    def write(self, data):
+        if self.errors:
+            raise RuntimeError(f"Encoder failed: {self.errors[0]}")
+        view = memoryview(data)
+        for start in range(0, len(view), self.BLOCK_SIZE):
+            block = bytes(view[start:start + self.BLOCK_SIZE])
+            for pending in self.queues:
+                pending.put(block)
+
+    def backlog(self):
+        """Blocks waiting in the encoder queues"""
+        return sum(pending.qsize() for pending in self.queues)
+
+    def stop_feeding(self):
+        for pending in self.queues:
+            pending.put(None)
+        for thread in self.threads:
+            thread.join()
+        METRICS.remove("combiner_encoder_backlog_blocks", **self.metric_labels)
+
+    def close(self):
+        """Waits for all encoders to finish their files"""
+        self.stop_feeding()
+        for encoder in self.encoders:
+            encoder.close()
+        if self.errors:
+            raise RuntimeError(f"Encoder failed: {self.errors[0]}")
+
+    def abort(self):
+        for encoder in self.encoders:
+            encoder.abort()
+        self.stop_feeding()
+
+# Parallel MP3 encoding: long mixes are cut into chunks that overlap by a
+# few frames, every chunk is encoded by its own LAME process and the chunks
+# are joined again at MP3 frame boundaries. LAME's bit reservoir stays on,
+# so a join has to happen at a frame whose reservoir data fits into the
+# free space at the end of the previous chunk.
+MP3_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0]  # MPEG-1 Layer III, kbps
+MP3_SAMPLE_RATES = [44100, 48000, 32000, 0]
+MP3_FRAME_SAMPLES = 1152
+LAME_ENCODER_DELAY = 576
+LAME_VERSION = b"LAME3.100"
+MP3_CHUNK_FRAMES = 3000  # apie 78 s vienam kodavimo procesui
+MP3_CHUNK_OVERLAP_FRAMES = 24  # frames encoded past each side of a chunk
+MP3_SPLICE_WARMUP_FRAMES = 12  # kol koduotuvas „įsivažiuoja“, jo kadrų nenaudojame
+MP3_SPLICE_TAIL_FRAMES = 4
+
+def crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+CRC16_TABLE = crc16_table()
+CRC16_TABLE_ARRAY = np.array(CRC16_TABLE, dtype=np.uint16)
+
+def gf2_apply(matrix, value):
+    result = 0
+    for bit, column in enumerate(matrix):
+        if value >> bit & 1:
+            result ^= column
+    return result
+
+def crc16_zero_matrix(byte_count):
+    """Linear map that advances a CRC-16/ARC over byte_count zero bytes"""
+    result = [1 << bit for bit in range(16)]
+    power = [CRC16_TABLE[1 << bit] if bit < 8 else 1 << (bit - 8) for bit in range(16)]
+    while byte_count:
+        if byte_count & 1:
+            result = [gf2_apply(power, column) for column in result]
+        power = [gf2_apply(power, column) for column in power]
+        byte_count >>= 1
+    return result
+
+def crc16_arc(data, crc=0):
+    """
+    CRC-16/ARC (the checksum of the LAME tag) of data, continuing from crc.
+    Long inputs are split into blocks whose CRCs are computed side by side
+    with numpy and then combined.
+    """
+    if len(data) < 65536:
+        for byte in bytes(data):
+            crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+        return crc
+    block_count = 2048
+    block_size = -(-len(data) // block_count)
+    # Nuliai pradžioje nekeičia CRC, kai pradinė reikšmė 0
+    blocks = np.zeros(block_count * block_size, dtype=np.uint8)
+    blocks[len(blocks) - len(data):] = np.frombuffer(data, dtype=np.uint8)
+    columns = np.ascontiguousarray(blocks.reshape(block_count, block_size).T)
+    state = np.zeros(block_count, dtype=np.uint16)
+    for column in columns:
+        state = (state >> 8) ^ CRC16_TABLE_ARRAY[(state ^ column) & 0xFF]
+    shift = crc16_zero_matrix(block_size)
+    combined = 0
+    for block_crc in state.tolist():
+        combined = gf2_apply(shift, combined) ^ block_crc
+    return gf2_apply(crc16_zero_matrix(len(data)), crc) ^ combined
+
+class Mp3Frame:
+    """Position and side info of one MPEG-1 Layer III frame"""
+    __slots__ = ("offset", "size", "data_offset", "main_data_begin", "main_data_size",
+                 "first_block_types", "last_block_types")
+
+    @property
+    def data_size(self):
+        """Bytes after the side info, i.e. this frame's share of the reservoir stream"""
+        return self.offset + self.size - self.data_offset
+
+def mp3_side_info_size(header):
+    """Bytes of side info after an MPEG-1 Layer III frame header (and its CRC)"""
+    return 17 if header[3] >> 6 == 3 else 32
+
+def parse_mp3_frames(data):
+    """Splits raw MPEG-1 Layer III data (no tags) into frames"""
+    frames = []
+    offset = 0
+    while offset + 4 <= len(data):
+        header = data[offset:offset + 4]
+        bitrate = MP3_BITRATES[header[2] >> 4]
+        sample_rate = MP3_SAMPLE_RATES[(header[2] >> 2) & 3]
+        if header[0] != 0xFF or header[1] & 0xFE != 0xFA or not bitrate or not sample_rate:
+            raise ValueError(f"No MPEG-1 Layer III frame at byte {offset}")
+        channels = 1 if header[3] >> 6 == 3 else 2
+        side_size = mp3_side_info_size(header)
+        frame = Mp3Frame()
+        frame.offset = offset
+        frame.size = 144000 * bitrate // sample_rate + ((header[2] >> 1) & 1)
+        frame.data_offset = offset + 4 + (0 if header[1] & 1 else 2) + side_size
+
+        side_bits = side_size * 8
+        side = int.from_bytes(data[frame.data_offset - side_size:frame.data_offset], "big")
+
+        def field(position, width):
+            return (side >> (side_bits - position - width)) & ((1 << width) - 1)
+
+        frame.main_data_begin = field(0, 9)
+        position = 18 if channels == 1 else 20
+        bits = 0
+        block_types = []
+        for _ in range(2):  # granules
+            granule = []
+            for _ in range(channels):
+                bits += field(position, 12)
+                # window_switching_flag po part2_3_length, big_values, global_gain ir scalefac_compress
+                granule.append(field(position + 34, 2) if field(position + 33, 1) else 0)
+                position += 59
+            block_types.append(tuple(granule))
+        frame.main_data_size = (bits + 7) // 8
+        frame.first_block_types, frame.last_block_types = block_types
+        frames.append(frame)
+        offset += frame.size
+    return frames
+
+def reservoir_positions(frames):
+    """Start of every frame's data area in the reservoir stream, plus the end"""
+    positions = [0]
+    for frame in frames:
+        positions.append(positions[-1] + frame.data_size)
+    return positions
+
+def block_types_follow(previous, following):
+    """True if MDCT block types may follow each other (short blocks need start/stop windows)"""
+    for before, after in zip(previous, following):
+        if (before in (1, 2)) != (after in (2, 3)):
+            return False
+    return True
+
+def find_mp3_splice(frames_a, first_a, frames_b, first_b, lowest, highest, target):
+    """
+    Finds the frame (global index in [lowest, highest], nearest to target)
+    at which stream B can take over from stream A. B's first frame there
+    refers to reservoir bytes inside B's earlier frames; the join works if
+    A's last frame leaves at least that many bytes unused and the block
+    types stay a valid window sequence. Returns (frame, reservoir_bytes)
+    or None.
+    """
+    positions_a = reservoir_positions(frames_a)
+    positions_b = reservoir_positions(frames_b)
+    for frame_number in sorted(range(lowest, highest + 1), key=lambda g: (abs(g - target), g)):
+        a = frame_number - first_a
+        b = frame_number - first_b
+        if a < 1 or a > len(frames_a) or b < 0 or b >= len(frames_b):
+            continue
+        previous = frames_a[a - 1]
+        if not block_types_follow(previous.last_block_types, frames_b[b].first_block_types):
+            continue
+        used_until = positions_a[a - 1] - previous.main_data_begin + previous.main_data_size
+        free = positions_a[a] - used_until
+
+        # Vėlesni B kadrai taip pat gali remtis baitais prieš sandūrą
+        needed_from = positions_b[b]
+        k = b
+        while k < len(frames_b) and positions_b[k] - 511 < positions_b[b]:
+            needed_from = min(needed_from, positions_b[k] - frames_b[k].main_data_begin)
+            k += 1
+        needed = positions_b[b] - needed_from
+        if needed <= free and needed <= positions_a[a]:
+            return frame_number, needed
+    return None
+
+def copy_reservoir_bytes(source, source_frames, source_start, target, target_frames, target_start, size):
+    """Copies size bytes between reservoir stream positions of two frame lists"""
+    def spans(frames, start, length):
+        position = 0
+        for frame in frames:
+            if length <= 0:
+                break
+            if start < position + frame.data_size:
+                skip = max(0, start - position)
+                take = min(frame.data_size - skip, length)
+                yield frame.data_offset + skip, take
+                start += take
+                length -= take
+            position += frame.data_size
+
+    payload = b"".join(bytes(source[offset:offset + length])
+                       for offset, length in spans(source_frames, source_start, size))
+    copied = 0
+    for offset, length in spans(target_frames, target_start, size):
+        target[offset:offset + length] = payload[copied:copied + length]
+        copied += length
+
+def parse_bitrate(bitrate):
+    """ "320k" or "320000" -> bits per second"""
+    bitrate = str(bitrate).lower()
+    if bitrate.endswith("k"):
+        return int(float(bitrate[:-1]) * 1000)
+    return int(bitrate)
+
+def encode_mp3_chunk(pcm_file, bitrate):
+    """Encodes a raw mix PCM file to bare MP3 frames (no Xing or ID3 tags)"""
+    command = [AudioSegment.converter, "-v", "error",
+               "-f", "s16le", "-ar", str(MIX_FRAME_RATE), "-ac", str(MIX_CHANNELS), "-i", pcm_file]
+    command += OUTPUT_FORMATS["mp3"]["args"] + ["-write_xing", "0", "-id3v2_version", "0"]
+    if bitrate:
+        command += ["-b:a", bitrate]
+    command += ["-ar", str(OUTPUT_FORMATS["mp3"]["frame_rate"]), "-"]
+    with METRICS.timer("combiner_stage_seconds", stage="encode_mp3_chunk"):
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"Encoding a chunk failed: {result.stderr.decode(errors='ignore').strip()}")
+    return result.stdout
+
+def build_xing_frame(first_header, frame_offsets, total_samples, music_crc, file_size, frame_size):
+    """
+    CBR "Info" frame with a LAME tag: frame count, byte count, seek TOC,
+    encoder delay and padding for gapless playback and both CRCs.
+    """
+    frame = bytearray(frame_size)
+    # Ta pati antraštė be CRC, be užpildymo baito ir be stereo išplėtimo bitų
+    frame[0:4] = bytes([0xFF, first_header[1] | 0x01, first_header[2] & 0xFD, first_header[3] & 0xCF])
+    x = 4 + mp3_side_info_size(first_header)
+    frame_count = len(frame_offsets)
+    frame[x:x + 4] = b"Info"
+    frame[x + 4:x + 8] = struct.pack(">I", 0x0F)
+    frame[x + 8:x + 16] = struct.pack(">II", frame_count, file_size)
+    for i in range(100):
+        offset = frame_size + frame_offsets[i * frame_count // 100] if frame_count else 0
+        frame[x + 16 + i] = min(255, offset * 256 // file_size)
+    lame = x + 120
+    frame[lame:lame + len(LAME_VERSION)] = LAME_VERSION
+    padding = frame_count * MP3_FRAME_SAMPLES - total_samples - LAME_ENCODER_DELAY
+    padding = max(0, min(padding, 0xFFF))
+    frame[lame + 21:lame + 24] = bytes([LAME_ENCODER_DELAY >> 4,
+                                        (LAME_ENCODER_DELAY & 0x0F) << 4 | padding >> 8,
+                                        padding & 0xFF])
+    frame[lame + 28:lame + 34] = struct.pack(">IH", file_size, music_crc)
+    frame[lame + 34:lame + 36] = struct.pack(">H", crc16_arc(frame[:lame + 34]))
+    return bytes(frame)
+
+class ParallelMp3Encoder:
+    """
+    MP3 encoder sink (same interface as AudioEncoder) that encodes the
+    stream in overlapping chunks on all cores. Chunk i covers frames
+    [i * chunk_frames, (i + 1) * chunk_frames) plus an overlap on both
+    sides. Neighbouring chunks are joined at a frame near the boundary
+    where the later chunk's reservoir bytes fit into the earlier chunk's
+    unused tail; those bytes are copied over, so every frame decodes
+    exactly as it did in its own chunk. If there is no such frame (rare,
+    low bitrates only) the two chunks are encoded again as one. The file
+    starts with a Xing/LAME frame carrying the gapless delay and padding
+    of the joined stream.
+    """
+    def __init__(self, output_file, bitrate="320k", max_workers=None, chunk_frames=MP3_CHUNK_FRAMES):
+        self.output_file = output_file
+        self.bitrate = bitrate
+        self.chunk_frames = chunk_frames
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool = ThreadPoolExecutor(self.max_workers)
+        self.temp_dir = tempfile.mkdtemp(prefix=".mp3chunks_", dir=os.path.dirname(output_file) or ".")
+        self.chunks = []
+        self.next_chunk = 0
+        self.current = None  # sujungimo dar laukiantis gabalas
+        self.samples = 0
+        self.frame_offsets = array.array("Q")
+        self.bytes_written = 0
+        self.music_crc = 0
+        self.first_header = None
+        self.splices = []  # global frame numbers where chunks were joined
+        self.xing_size = 144 * parse_bitrate(bitrate or "128k") // OUTPUT_FORMATS["mp3"]["frame_rate"]
+        self.output = open(output_file, "wb")
+        self.output.write(bytes(self.xing_size))
+
+    def chunk_range(self, i):
+        """Input sample range of chunk i"""
+        start = max(0, i * self.chunk_frames - MP3_CHUNK_OVERLAP_FRAMES) * MP3_FRAME_SAMPLES
+        end = ((i + 1) * self.chunk_frames + MP3_CHUNK_OVERLAP_FRAMES) * MP3_FRAME_SAMPLES
+        return start, end
+
+    def open_chunk(self):
+        i = len(self.chunks)
+        start, end = self.chunk_range(i)
+        path = os.path.join(self.temp_dir, f"chunk_{i}.pcm")
+        self.chunks.append({"index": i, "start": start, "end": end, "path": path,
+                            "file": open(path, "wb"), "future": None, "final": False})
+
+    def submit(self, chunk):
+        chunk["file"].close()
+        chunk["file"] = None
+        chunk["future"] = self.pool.submit(encode_mp3_chunk, chunk["path"], self.bitrate)
+        METRICS.inc("combiner_mp3_chunks_pending")
+
+    def write(self, data):
+        position = self.samples
+        count = len(data) // MIX_FRAME_WIDTH
+        while not self.chunks or self.chunk_range(len(self.chunks))[0] < position + count:
+            self.open_chunk()
+        view = memoryview(data)
+        for chunk in self.chunks[self.next_chunk:]:
+            if chunk["file"] is None:
+                continue
+            start = max(chunk["start"], position)
+            end = min(chunk["end"], position + count)
+            if start < end:
+                chunk["file"].write(view[(start - position) * MIX_FRAME_WIDTH:(end - position) * MIX_FRAME_WIDTH])
+            if chunk["end"] <= position + count:
+                self.submit(chunk)
+        self.samples += count
+        self.drain(wait=False)
+
+    def drain(self, wait):
+        """Joins finished chunks in order; waits while too many are queued (or for all with wait)"""
+        while self.next_chunk < len(self.chunks):
+            chunk = self.chunks[self.next_chunk]
+            future = chunk["future"]
+            if future is None:
+                return
+            queued = sum(1 for c in self.chunks[self.next_chunk:] if c["future"] is not None)
+            if not future.done() and not wait and queued <= 2 * self.max_workers:
+                return
+            self.join_chunk(chunk, future.result())
+            chunk["future"] = None
+            METRICS.inc("combiner_mp3_chunks_pending", -1)
+            self.next_chunk += 1
+            if chunk["final"]:
+                return
+
+    def join_chunk(self, chunk, data):
+        data = bytearray(data)
+        frames = parse_mp3_frames(data)
+        first = chunk["start"] // MP3_FRAME_SAMPLES
+        if self.first_header is None and frames:
+            self.first_header = bytes(data[:4])
+        if self.current is None:
+            self.current = {"data": data, "frames": frames, "first": first, "from": first,
+                            "input_end": chunk["end"] // MP3_FRAME_SAMPLES, "path": chunk["path"]}
+        else:
+            previous = self.current
+            boundary = chunk["index"] * self.chunk_frames
+            found = find_mp3_splice(previous["frames"], previous["first"], frames, first,
+                                    boundary - MP3_CHUNK_OVERLAP_FRAMES + MP3_SPLICE_WARMUP_FRAMES,
+                                    min(boundary + MP3_CHUNK_OVERLAP_FRAMES, previous["input_end"]) - MP3_SPLICE_TAIL_FRAMES,
+                                    boundary)
+            if found is None:
+                self.merge_chunk(chunk)
+                return
+            frame_number, needed = found
+            if needed:
+                # B rezervuaro baitai perkeliami į laisvą A pabaigą
+                positions_a = reservoir_positions(previous["frames"])
+                positions_b = reservoir_positions(frames)
+                join_a = positions_a[frame_number - previous["first"]]
+                join_b = positions_b[frame_number - first]
+                copy_reservoir_bytes(data, frames, join_b - needed,
+                                     previous["data"], previous["frames"], join_a - needed, needed)
+            self.emit(previous, frame_number)
+            self.splices.append(frame_number)
+            os.remove(previous["path"])
+            self.current = {"data": data, "frames": frames, "first": first, "from": frame_number,
+                            "input_end": chunk["end"] // MP3_FRAME_SAMPLES, "path": chunk["path"]}
+        if chunk["final"]:
+            self.finish_current()
+
+    def merge_chunk(self, chunk):
+        """Encodes the waiting chunk again together with chunk, when they cannot be spliced"""
+        previous = self.current
+        path = os.path.join(self.temp_dir, f"merged_{chunk['index']}.pcm")
+        with open(path, "wb") as merged:
+            with open(previous["path"], "rb") as f:
+                shutil.copyfileobj(f, merged)
+            with open(chunk["path"], "rb") as f:
+                # Gabalo pradžia jau yra ankstesniajame
+                f.seek((previous["input_end"] * MP3_FRAME_SAMPLES - chunk["start"]) * MIX_FRAME_WIDTH)
+                shutil.copyfileobj(f, merged)
+        os.remove(previous["path"])
+        os.remove(chunk["path"])
+        # Koduotuvas deterministinis, todėl jau perkelti rezervuaro baitai lieka tie patys
+        data = bytearray(encode_mp3_chunk(path, self.bitrate))
+        self.current = dict(previous, data=data, frames=parse_mp3_frames(data), path=path,
+                            input_end=chunk["end"] // MP3_FRAME_SAMPLES)
+        if chunk["final"]:
+            self.finish_current()
+
+    def finish_current(self):
+        self.emit(self.current, self.current["first"] + len(self.current["frames"]))
+        os.remove(self.current["path"])
+        self.current = None
+
+    def emit(self, part, until):
+        """Writes part's frames from part["from"] up to global frame until"""
+        frames = part["frames"][part["from"] - part["first"]:until - part["first"]]
+        if not frames:
+            return
+        base = frames[0].offset
+        piece = bytes(part["data"][base:frames[-1].offset + frames[-1].size])
+        self.frame_offsets.extend(self.bytes_written + frame.offset - base for frame in frames)
+        self.music_crc = crc16_arc(piece, self.music_crc)
+        self.output.write(piece)
+        self.bytes_written += len(piece)
+
+    def close(self):
+        """
+        Encodes the last chunk, joins everything and writes the Xing/LAME
+        frame. An empty stream gives an empty file.
+        """
+        try:
+            if not self.samples:
+                for chunk in self.chunks:
+                    if chunk["file"] is not None:
+                        chunk["file"].close()
+                self.output.truncate(0)
+                self.output.close()
+                return
+            if not self.chunks:
+                self.open_chunk()
+            # Paskutinis tas gabalas, kurio įvestis jau siekia srauto pabaigą
+            final = next(chunk for chunk in self.chunks[self.next_chunk:] if chunk["end"] >= self.samples)
+            if final["file"] is not None:
+                self.submit(final)
+            final["final"] = True
+            for chunk in self.chunks[final["index"] + 1:]:
+                # Tik persidengimui atidaryti gabalai nebereikalingi
+                chunk["file"].close()
+                os.remove(chunk["path"])
+            del self.chunks[final["index"] + 1:]
+            self.drain(wait=True)
+            if self.first_header is None:
+                raise RuntimeError("The encoder produced no MP3 frames")
+            self.output.seek(0)
+            self.output.write(build_xing_frame(self.first_header, self.frame_offsets, self.samples,
+                                               self.music_crc, self.xing_size + self.bytes_written,
+                                               self.xing_size))
+            self.output.close()
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self.pool.shutdown(wait=True)
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def abort(self):
+        """Drops queued chunks, leaving whatever was written so far"""
+        for chunk in self.chunks:
+            if chunk["future"] is not None:
+                chunk["future"].cancel()
+                chunk["future"] = None
+                METRICS.inc("combiner_mp3_chunks_pending", -1)
+            if chunk["file"] is not None:
+                chunk["file"].close()
+                chunk["file"] = None
+        self.pool.shutdown(wait=True)
+        self.output.close()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+def use_parallel_mp3(parallel_encode):
+    """Chunked MP3 encoding only pays off with more than one core"""
+    return bool(parallel_encode) and (os.cpu_count() or 1) > 1
+
+def create_encoder(target, parallel_encode=False):
+    """Encoder writing an output target to its .part file"""
+    if target["format"] == "mp3" and use_parallel_mp3(parallel_encode):
+        return ParallelMp3Encoder(target["file"] + ".part", target["bitrate"])
+    return AudioEncoder(target["file"] + ".part", target["format"], target["bitrate"])
+
+# Finished renders are cached by a hash of everything that decides the
+# result, so an identical request reuses the stored files instead of
+# rendering again
+RENDER_CACHE_DIR = "renders"
+RENDER_CACHE_MAX_BYTES = 20 * 1024 ** 3
+RENDER_CACHE_VERSION = 2  # raise when the rendering or the cache entries change
+
+def render_cache_key(input_folder, files, crossfade_ms, beat_align, outputs, parallel_encode=False,
+                     limiter=None):
+    """
+    Cache key of a mix: input file identities (name, size, mtime) in mix
+    order, trim and crossfade settings, master bus and encoder settings.
+    Returns None if a file is missing.
+    """
+    tracks = []
+    for file in files:
+        signature = file_signature(os.path.join(input_folder, file))
+        if signature is None:
+            return None
+        tracks.append([file, signature])
+    description = {
+        "version": RENDER_CACHE_VERSION,
+        "tracks": tracks,
+        "trim": {"silence_threshold": -40, "min_silence_len": 100},  # find_trim_points() defaults
+        "crossfade_ms": crossfade_ms,
+        "beat_align": bool(beat_align),
+        "mix_format": [MIX_FRAME_RATE, MIX_CHANNELS, MIX_SAMPLE_WIDTH],
+        "limiter": dict(limiter, lookahead_ms=LIMITER_LOOKAHEAD_MS,
+                        release_db_per_second=LIMITER_RELEASE_DB_PER_SECOND) if limiter else None,
+        "encoders": [{"format": target["format"], "bitrate": target["bitrate"],
+                      "settings": OUTPUT_FORMATS[target["format"]]} for target in outputs],
+        "mp3_chunks": MP3_CHUNK_FRAMES if use_parallel_mp3(parallel_encode) else None,
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+def clone_or_copy(source, destination):
+    """
+    Replaces destination with a reflink clone of source, or a full copy
+    where the filesystem has no reflinks. Never a hard link: the cached
+    files and the exports must not change when one of them is edited.
+    """
+    temp_file = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        clone_file(source, temp_file, allow_hardlink=False)
+        os.replace(temp_file, destination)
+    except BaseException:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+
+class RenderCache:
+    """
+    Content-addressed store of finished renders in the library's .mix_cache.
+    Files are cloned in and out (reflinks, so no extra disk space until one
+    side changes) or copied, so editing an export never changes the cache.
+    The least recently used renders are evicted once the cache is over
+    max_bytes.
+    """
+    def __init__(self, input_folder, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(input_folder, CACHE_DIR_NAME, RENDER_CACHE_DIR)
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def restore(self, key, outputs, tracklist_file=None, peaks_file=None):
+        """
+        Puts a cached render in place of the output targets (and tracklist
+        and waveform peaks). Returns (tracklist, track marks in frames or
+        None for older entries), or None if it is not cached.
+        """
+        if key is None:
+            return None
+        entry = self.entry_dir(key)
+        try:
+            with open(os.path.join(entry, "render.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            for i, target in enumerate(outputs):
+                os.makedirs(os.path.dirname(target["file"]) or ".", exist_ok=True)
+                clone_or_copy(os.path.join(entry, f"output_{i}{os.path.splitext(target['file'])[1]}"),
+                              target["file"])
+            if peaks_file and os.path.exists(os.path.join(entry, "peaks.npz")):
+                clone_or_copy(os.path.join(entry, "peaks.npz"), peaks_file)
+            # Pažymėti kaip neseniai naudotą
+            os.utime(os.path.join(entry, "render.json"))
+        except (OSError, ValueError):
+            METRICS.inc("combiner_cache_requests_total", cache="render", result="miss")
+            return None
+        METRICS.inc("combiner_cache_requests_total", cache="render", result="hit")
+
+        tracklist = meta["tracklist"]
+        if tracklist_file:
+            with open(tracklist_file, "w", encoding="utf-8") as f:
+                f.write("\n".join(tracklist))
+        return tracklist, meta.get("track_marks")
+
+    def store(self, key, outputs, tracklist, peaks_file=None, track_marks=None):
+        """Adds a finished render to the cache and evicts old renders if needed"""
+        if key is None:
+            return
+        entry = self.entry_dir(key)
+        if os.path.exists(entry):
+            return
+        # Surinkti laikiname aplanke, kad kiti procesai nematytų pusiau įrašyto įrašo
+        temp_dir = os.path.join(self.cache_dir, f".{key}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            os.makedirs(temp_dir)
+            for i, target in enumerate(outputs):
+                clone_or_copy(target["file"], os.path.join(temp_dir, f"output_{i}{os.path.splitext(target['file'])[1]}"))
+            if peaks_file and os.path.exists(peaks_file):
+                clone_or_copy(peaks_file, os.path.join(temp_dir, "peaks.npz"))
+            with open(os.path.join(temp_dir, "render.json"), "w", encoding="utf-8") as f:
+                json.dump({"tracklist": tracklist, "track_marks": track_marks, "outputs": outputs,
+                           "created": time.time()}, f)
+            os.rename(temp_dir, entry)
+        except OSError as e:
+            print(f"Could not cache render: {e}")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Removes the least recently used renders until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            entry = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(entry):
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(entry, "render.json"))
+                size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+            except OSError:
+                continue
+            entries.append((used, size, name))
+            total += size
+
+        for used, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
+
+class MixRender:
+    """
+    Checkpointed render of one mix job. After every track the finished PCM
+    (spool), the assembler state and the tracklist are saved in the work
+    folder, so a crashed or cancelled render continues from the last track
+    instead of starting over. The outputs are encoded progressively into
+    .part files while rendering; since the encoders always get the same PCM
+    stream, a resumed render produces the same files as an uninterrupted one.
+    """
+    def __init__(self, work_dir, job, state=None):
+        self.work_dir = work_dir
+        self.job = job
+        self.state = state or {"next_track": 0, "assembler": None, "tail_file": None, "tracklist": []}
+        self.state_file = os.path.join(work_dir, "state.json")
+        self.spool_file = os.path.join(work_dir, "mix.pcm")
+
+    @classmethod
+    def create(cls, work_dir, input_folder, files, output_file, tracklist_file=None,
+               crossfade_ms=DEFAULT_CROSSFADE_MS, extra_formats=None, beat_align=False, use_cache=True,
+               parallel_encode=True, limiter=None):
+        """
+        Starts a new render, replacing any unfinished one in work_dir.
+        extra_formats are output specs ("mp3:128k", "opus", "flac") encoded
+        from the same PCM stream alongside the 320 kbps MP3. With beat_align
+        every join gets its own beat-aligned crossfade length. With use_cache
+        an identical earlier render is reused from the render cache. With
+        parallel_encode MP3 outputs are encoded in chunks on all cores.
+        limiter (from limiter_settings()) puts the master bus limiter in
+        front of the encoders.
+        """
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+        job = {
+            "input_folder": input_folder,
+            "files": list(files),
+            "output_file": output_file,
+            "outputs": parse_output_targets(extra_formats, output_file),
+            "tracklist_file": tracklist_file,
+            "crossfade_ms": crossfade_ms,
+            "beat_align": beat_align,
+            "use_cache": use_cache,
+            "parallel_encode": parallel_encode,
+            "limiter": limiter,
+        }
+        render = cls(work_dir, job)
+        os.makedirs(work_dir)
+        render.save_checkpoint()
+        return render
+
+    @classmethod
+    def load(cls, work_dir):
+        """Returns the unfinished render in work_dir, or None if there is none"""
+        try:
+            with open(os.path.join(work_dir, "state.json"), "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cls(work_dir, saved["job"], saved["state"])
+
+    def discard(self):
+        """Deletes the checkpoint"""
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def save_checkpoint(self, assembler=None, spool=None):
+        """Atomically saves the render state (after the spool is on disk)"""
+        if spool is not None:
+            spool.flush()
+            os.fsync(spool.fileno())
+        old_tail = self.state.get("tail_file")
+        if assembler is not None:
+            assembler_state, tail_data = assembler.get_state()
+            self.state["assembler"] = assembler_state
+            self.state["tail_file"] = None
+            if tail_data is not None:
+                # Kiekvienas patikros taškas turi savo uodegos failą, kad būsena visada sutaptų
+                self.state["tail_file"] = f"tail_{self.state['next_track']}.pcm"
+                with open(os.path.join(self.work_dir, self.state["tail_file"]), "wb") as f:
+                    f.write(tail_data)
+                    f.flush()
+                    os.fsync(f.fileno())
+
+        with open(self.state_file + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"job": self.job, "state": self.state}, f)
+        os.replace(self.state_file + ".tmp", self.state_file)
+
+        if old_tail and old_tail != self.state.get("tail_file"):
+            try:
+                os.remove(os.path.join(self.work_dir, old_tail))
+            except OSError:
+                pass
+
+    def write_tracklist(self):
+        if self.job["tracklist_file"]:
+            with open(self.job["tracklist_file"], "w", encoding="utf-8") as f:
+                f.write("\n".join(self.state["tracklist"]))
+
+    def run(self, progress_callback=None):
+        """
+        Renders (or continues rendering) the mix. progress_callback(done,
+        total, text) is called before each track and may raise
+        RenderCancelled. Returns the tracklist.
+        """
+        job = self.job
+        files = job["files"]
+        outputs = job["outputs"]
+        index = LibraryIndex.shared(job["input_folder"])
+
+        cache = None
+        cache_key = None
+        if job.get("use_cache", True):
+            cache = RenderCache(job["input_folder"])
+            cache_key = render_cache_key(job["input_folder"], files, job["crossfade_ms"],
+                                         job.get("beat_align"), outputs, job.get("parallel_encode"),
+                                         job.get("limiter"))
+        if cache and self.state["next_track"] == 0:
+            restored = cache.restore(cache_key, outputs, job["tracklist_file"],
+                                     mix_peaks_path(job["output_file"]))
+            if restored is not None:
+                tracklist, track_marks = restored
+                if progress_callback:
+                    progress_callback(len(files), len(files), "Reused an identical earlier render")
+                self.state["tracklist"] = tracklist
+                self.state["track_marks"] = track_marks
+                self.discard()
+                METRICS.inc("combiner_renders_total", result="cached")
+                return tracklist
+
+        aligner = None
+        max_crossfade_ms = None
+        if job.get("beat_align"):
+            aligner = BeatAligner(job["input_folder"], index, job["crossfade_ms"])
+            max_crossfade_ms = aligner.max_crossfade_ms
+        assembler = MixAssembler([], job["crossfade_ms"], max_crossfade_ms)
+        spool_bytes = 0
+        if self.state["assembler"]:
+            tail_data = None
+            if self.state.get("tail_file"):
+                with open(os.path.join(self.work_dir, self.state["tail_file"]), "rb") as f:
+                    tail_data = f.read()
+            assembler.restore_state(self.state["assembler"], tail_data)
+            spool_bytes = assembler.frames_written * MIX_FRAME_WIDTH
+
+        for target in outputs:
+            os.makedirs(os.path.dirname(target["file"]) or ".", exist_ok=True)
+        spool = open(self.spool_file, "r+b" if os.path.exists(self.spool_file) else "w+b")
+        encoder = EncoderTee([create_encoder(target, job.get("parallel_encode")) for target in outputs])
+        if job.get("limiter"):
+            # Ruošinys lieka neapdorotas, todėl tęsiant ribotuvas vėl gauna visą srautą
+            encoder = MasterLimiter(encoder, **job["limiter"])
+        METRICS.inc("combiner_renders_active")
+        try:
+            # Atmesti viską, kas buvo įrašyta po paskutinio patikros taško
+            spool.truncate(spool_bytes)
+
+            # Progresyvūs failai visada koduojami nuo pradžios iš jau paruošto PCM
+            spool.seek(0)
+            while True:
+                data = spool.read(1024 * 1024)
+                if not data:
+                    break
+                encoder.write(data)
+            spool.seek(spool_bytes)
+
+            assembler.sinks = [spool, encoder]
+            for i in range(self.state["next_track"], len(files)):
+                file = files[i]
+                if progress_callback:
+                    progress_callback(i, len(files), f"Processing: {file}")
+
+                audio_segment = decode_audio(os.path.join(job["input_folder"], file))
+                cache_track_peaks(job["input_folder"], file, audio_segment)
+
+                # Pašalinti tylą iš pradžios ir pabaigos (apkarpymo taškai saugomi talpykloje)
+                trim = index.lookup(file, "trim")
+                if trim is None:
+                    with METRICS.timer("combiner_stage_seconds", stage="trim"):
+                        trim = list(find_trim_points(audio_segment))
+                    index.set(file, "trim", trim)
+                audio_segment = audio_segment[trim[0]:trim[1]]
+
+                crossfade_ms = None
+                if aligner:
+                    with METRICS.timer("combiner_stage_seconds", stage="beat_align"):
+                        crossfade_ms = aligner.crossfade_for(file, trim, audio_segment,
+                                                             previous_file=files[i - 1] if i else None)
+
+                # Įskaitant laukimą, kol koduotuvai priims duomenis
+                with METRICS.timer("combiner_stage_seconds", stage="assemble"):
+                    mark_ms = assembler.add_track(audio_segment, crossfade_ms)
+                self.state["tracklist"].append(format_tracklist_entry(mark_ms, file))
+                self.state["next_track"] = i + 1
+                with METRICS.timer("combiner_stage_seconds", stage="checkpoint"):
+                    self.save_checkpoint(assembler, spool)
+                self.write_tracklist()
+                METRICS.inc("combiner_tracks_rendered_total")
+
+            if progress_callback:
+                progress_callback(len(files), len(files), "Finishing export...")
+            assembler.finish()
+            with METRICS.timer("combiner_stage_seconds", stage="encoder_flush"):
+                encoder.close()
+        except BaseException as e:
+            encoder.abort()
+            METRICS.inc("combiner_renders_total", result=render_result(e))
+            raise
+        finally:
+            spool.close()
+            index.save()
+            METRICS.inc("combiner_renders_active", -1)
+
+        for target in outputs:
+            os.replace(target["file"] + ".part", target["file"])
+        self.write_tracklist()
+
+        # Visos mikso bangos forma iš dainų bangų formų
+        save_mix_peaks(job["input_folder"], files, assembler.track_starts, assembler.frames_written,
+                       job["output_file"], index)
+        self.state["track_marks"] = list(assembler.track_marks)
+        if cache:
+            cache.store(cache_key, outputs, self.state["tracklist"], mix_peaks_path(job["output_file"]),
+                        self.state["track_marks"])
+        self.discard()
+        METRICS.inc("combiner_renders_total", result="done")
+        return self.state["tracklist"]
+
+# Distributed rendering: a coordinator splits the playlist into segments of
+# consecutive tracks, render workers return each segment as raw mix PCM and
+# the coordinator crossfades the segments together like single tracks.
+
+DEFAULT_WORKER_PORT = 5055
+WORKER_TIMEOUT_SECONDS = 600
+SEGMENT_MAX_ATTEMPTS = 3
+NODE_MAX_FAILURES = 3
+WORKER_TOKEN_ENV = "MIX_WORKER_TOKEN"  # shared secret of the coordinator and its workers
+
+def send_message(sock, header, payload_file=None, payload_size=0):
+    """Sends a length-prefixed JSON header, optionally followed by a payload from a file"""
+    data = json.dumps(dict(header, payload_size=payload_size)).encode("utf-8")
+    sock.sendall(struct.pack(">I", len(data)) + data)
+    remaining = payload_size
+    while remaining > 0:
+        block = payload_file.read(min(remaining, MixAssembler.BLOCK_SIZE))
+        if not block:
+            raise ConnectionError("payload ended early")
+        sock.sendall(block)
+        remaining -= len(block)
+
+def receive_exactly(sock, size):
+    """Reads exactly size bytes from a socket"""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, MixAssembler.BLOCK_SIZE))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def receive_message(sock, payload_file=None):
+    """Receives a message from send_message(); the payload is written to payload_file"""
+    (header_size,) = struct.unpack(">I", receive_exactly(sock, 4))
+    header = json.loads(receive_exactly(sock, header_size).decode("utf-8"))
+    remaining = header.get("payload_size", 0)
+    while remaining > 0:
+        block = receive_exactly(sock, min(remaining, MixAssembler.BLOCK_SIZE))
+        if payload_file is not None:
+            payload_file.write(block)
+        remaining -= len(block)
+    return header
+
+def library_file_path(input_folder, filename):
+    """
+    Path of a song named by a coordinator. Only plain names inside the
+    library folder are accepted: absolute paths, ".." and anything that
+    resolves outside the folder (e.g. through a symlink) raise ValueError.
+    """
+    if not isinstance(filename, str) or not filename or os.path.isabs(filename) \
+            or ".." in re.split(r"[\\/]", filename):
+        raise ValueError(f"Invalid song name: {filename!r}")
+    root = os.path.realpath(input_folder)
+    path = os.path.realpath(os.path.join(root, filename))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f"Song outside the library: {filename!r}")
+    return path
+
+def render_segment(input_folder, files, crossfade_ms, trims, output, beat_align=False):
+    """
+    Renders consecutive tracks into raw mix PCM written to output. Returns
+    (frame count, track marks in frames, track starts in frames, trim points
+    used, beat grids of the first and last track if beat_align is set,
+    trimmed length of the first track in ms).
+    """
+    aligner = None
+    max_crossfade_ms = None
+    if beat_align:
+        aligner = BeatAligner(input_folder, LibraryIndex.shared(input_folder), crossfade_ms)
+        max_crossfade_ms = aligner.max_crossfade_ms
+    assembler = MixAssembler([output], crossfade_ms, max_crossfade_ms)
+    used_trims = {}
+    beats = {}
+    first_ms = None
+    for i, file in enumerate(files):
+        audio_segment = decode_audio(library_file_path(input_folder, file))
+        cache_track_peaks(input_folder, file, audio_segment)
+        trim = trims.get(file) or list(find_trim_points(audio_segment))
+        used_trims[file] = trim
+        audio_segment = audio_segment[trim[0]:trim[1]]
+        if first_ms is None:
+            first_ms = len(audio_segment)
+        crossfade = aligner.crossfade_for(file, trim, audio_segment) if aligner else None
+        if aligner and i in (0, len(files) - 1):
+            beats[file] = aligner.previous
+        assembler.add_track(audio_segment, crossfade)
+        METRICS.inc("combiner_tracks_rendered_total")
+    assembler.finish()
+    return assembler.frames_written, assembler.track_marks, assembler.track_starts, used_trims, beats, first_ms
+
+class RenderWorkerHandler(socketserver.BaseRequestHandler):
+    """
+    Serves render requests from a coordinator over one connection. Every
+    request must carry the worker's token, and songs are only read from the
+    worker's own library folder (the coordinator's folder is ignored).
+    """
+    def handle(self):
+        self.request.settimeout(WORKER_TIMEOUT_SECONDS)
+        while True:
+            try:
+                request = receive_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+
+            token = request.get("token")
+            if not isinstance(token, str) or not hmac.compare_digest(token.encode("utf-8"),
+                                                                     self.server.token.encode("utf-8")):
+                # Be rakto nieko nedaryti ir nutraukti ryšį
+                send_message(self.request, {"status": "error", "error": "invalid worker token"})
+                return
+
+            if request.get("type") == "ping":
+                send_message(self.request, {"status": "ok"})
+                continue
+
+            try:
+                with tempfile.TemporaryFile() as pcm:
+                    frames, marks, starts, trims, beats, first_ms = render_segment(
+                        self.server.input_folder, request["files"], request["crossfade_ms"],
+                        request.get("trims", {}), pcm, request.get("beat_align", False))
+                    pcm.seek(0)
+                    send_message(self.request,
+                                 {"status": "ok", "frames": frames, "marks": marks, "starts": starts,
+                                  "trims": trims, "beats": beats, "first_ms": first_ms},
+                                 payload_file=pcm, payload_size=frames * MIX_FRAME_WIDTH)
+            except (ConnectionError, OSError) as e:
+                print(f"Worker connection error: {e}")
+                return
+            except Exception as e:
+                send_message(self.request, {"status": "error", "error": str(e)})
+
+class RenderWorkerServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+def run_worker(input_folder, token, host="127.0.0.1", port=DEFAULT_WORKER_PORT, ready=None):
+    """
+    Runs a render worker until it is stopped. Songs are read from
+    input_folder (this node's copy or mount of the library) only, and
+    requests without the shared token are refused. ready, if given, is a
+    pipe that receives the port actually used.
+    """
+    if not token:
+        raise ValueError("A render worker needs a token")
+    server = RenderWorkerServer((host, port), RenderWorkerHandler)
+    server.input_folder = input_folder
+    server.token = token
+    if ready is not None:
+        ready.send(server.server_address[1])
+        ready.close()
+    else:
+        print(f"Render worker listening on {host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def start_local_workers(count, input_folder, token):
+    """Starts render workers as local processes; returns (nodes, processes)"""
+    nodes = []
+    processes = []
+    for _ in range(count):
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_worker, args=(input_folder, token, "127.0.0.1", 0, sender),
+                                          daemon=True)
+        process.start()
+        nodes.append(("127.0.0.1", receiver.recv()))
+        receiver.close()
+        processes.append(process)
+    return nodes, processes
+
+def parse_node(address):
+    """Parses "host:port" (or just "host") into a (host, port) pair"""
+    host, _, port = address.rpartition(":")
+    if not host:
+        return address, DEFAULT_WORKER_PORT
+    return host, int(port)
+
+def split_segments(files, segment_count, track_length=None, min_first_ms=0):
+    """
+    Splits the playlist into at most segment_count runs of consecutive
+    tracks. With track_length(filename) (ms or None if unknown) a segment
+    only starts with a track of at least min_first_ms, so the boundary is
+    moved forward past shorter tracks.
+    """
+    size = max(1, math.ceil(len(files) / max(1, segment_count)))
+    starts = [0]
+    for ideal in range(size, len(files), size):
+        start = max(ideal, starts[-1] + 1)
+        if track_length is not None:
+            while start < len(files) and (track_length(files[start]) or 0) < min_first_ms:
+                start += 1
+        if start < len(files) and start > starts[-1]:
+            starts.append(start)
+    return [files[start:end] for start, end in zip(starts, starts[1:] + [len(files)])]
+
+class RenderCoordinator:
+    """
+    Sends playlist segments to render workers and collects the results in
+    a work folder. Each node is served by its own thread; a failed segment
+    goes back to the queue and is retried, and a node is dropped after
+    repeated failures.
+    """
+    def __init__(self, nodes, input_folder, crossfade_ms, work_dir, trims=None, beat_align=False, token=None):
+        self.nodes = list(nodes)
+        self.token = token
+        self.input_folder = input_folder
+        self.crossfade_ms = crossfade_ms
+        self.beat_align = beat_align
+        self.beats = {}
+        self.work_dir = work_dir
+        self.trims = dict(trims or {})
+        self.condition = threading.Condition()
+        self.pending = []
+        self.attempts = []
+        self.results = {}
+        self.error = None
+        self.live_nodes = 0
+
+    def start(self, segments):
+        self.segments = segments
+        self.pending = list(range(len(segments)))
+        self.attempts = [0] * len(segments)
+        self.live_nodes = len(self.nodes)
+        os.makedirs(self.work_dir, exist_ok=True)
+        for node in self.nodes:
+            threading.Thread(target=self.serve_node, args=(node,), daemon=True).start()
+
+    def pending_count(self):
+        """Segments waiting for a worker"""
+        return len(self.pending)
+
+    def next_segment(self):
+        """Waits for a segment to render; returns None when there is nothing left"""
+        with self.condition:
+            while not self.pending:
+                if self.error or len(self.results) == len(self.segments):
+                    return None
+                self.condition.wait(1.0)
+            return self.pending.pop(0)
+
+    def serve_node(self, node):
+        """Node thread: renders segments on one worker until the queue is done"""
+        sock = None
+        failures = 0
+        while failures < NODE_MAX_FAILURES:
+            index = self.next_segment()
+            if index is None:
+                break
+            try:
+                if sock is None:
+                    sock = socket.create_connection(node, timeout=WORKER_TIMEOUT_SECONDS)
+                self.render_on_node(sock, index)
+                failures = 0
+            except Exception as e:
+                print(f"Worker {node[0]}:{node[1]} failed on segment {index + 1}: {e}")
+                failures += 1
+                if sock is not None:
+                    sock.close()
+                    sock = None
+                with self.condition:
+                    self.attempts[index] += 1
+                    if self.attempts[index] >= SEGMENT_MAX_ATTEMPTS:
+                        self.error = RuntimeError(f"Segment {index + 1} failed {self.attempts[index]} times: {e}")
+                    else:
+                        self.pending.insert(0, index)
+                    self.condition.notify_all()
+                time.sleep(0.5 * failures)
+        if sock is not None:
+            sock.close()
+
+        with self.condition:
+            self.live_nodes -= 1
+            if self.live_nodes == 0 and not self.error and len(self.results) < len(self.segments):
+                self.error = RuntimeError("All render workers failed")
+            self.condition.notify_all()
+
+    def render_on_node(self, sock, index):
+        files = self.segments[index]
+        request = {
+            "type": "render",
+            "token": self.token,
+            "files": files,
+            "crossfade_ms": self.crossfade_ms,
+            "trims": {file: self.trims[file] for file in files if file in self.trims},
+            "beat_align": self.beat_align,
+        }
+        send_message(sock, request)
+        pcm_path = os.path.join(self.work_dir, f"segment_{index:04d}.pcm")
+        with open(pcm_path, "wb") as pcm:
+            reply = receive_message(sock, pcm)
+        if reply.get("status") != "ok":
+            raise RuntimeError(reply.get("error", "unknown worker error"))
+        if os.path.getsize(pcm_path) != reply["frames"] * MIX_FRAME_WIDTH:
+            raise RuntimeError("incomplete segment")
+
+        with self.condition:
+            self.trims.update(reply["trims"])
+            self.beats.update(reply.get("beats", {}))
+            self.results[index] = (pcm_path, reply["frames"], reply["marks"], reply["starts"], reply.get("first_ms"))
+            self.condition.notify_all()
+
+    def wait_result(self, index):
+        """Waits until a segment is rendered; returns (pcm path, frames, marks, starts, first track ms)"""
+        with self.condition:
+            while index not in self.results:
+                if self.error:
+                    raise self.error
+                self.condition.wait(1.0)
+            return self.results[index]
+
+def render_distributed(nodes, input_folder, files, output_file, tracklist_file=None,
+                       crossfade_ms=DEFAULT_CROSSFADE_MS, extra_formats=None, progress_callback=None,
+                       segments_per_node=2, beat_align=False, use_cache=True, parallel_encode=True,
+                       limiter=None, token=None):
+    """
+    Renders a mix on render workers. Segments are joined in order as soon
+    as they arrive, with the same crossfade as between single tracks, so
+    the result is sample-identical to a local render; tracklist timestamps
+    are recomputed from the segment positions. token is the workers' shared
+    secret. Returns the tracklist.
+    """
+    outputs = parse_output_targets(extra_formats, output_file)
+    cache = RenderCache(input_folder) if use_cache else None
+    cache_key = (render_cache_key(input_folder, files, crossfade_ms, beat_align, outputs, parallel_encode,
+                                  limiter) if cache else None)
+    if cache:
+        # Segmentai sujungiami taip pat kaip vietoje, todėl tinka ir vietinių eksportų įrašai
+        restored = cache.restore(cache_key, outputs, tracklist_file, mix_peaks_path(output_file))
+        if restored is not None:
+            if progress_callback:
+                progress_callback(len(files), len(files), "Reused an identical earlier render")
+            METRICS.inc("combiner_renders_total", result="cached")
+            return restored[0]
+
+    work_dir = os.path.join(os.path.dirname(output_file) or ".", ".mix_segments")
+    index = LibraryIndex.shared(input_folder)
+    trims = {}
+    for file in files:
+        trim = index.lookup(file, "trim")
+        if trim:
+            trims[file] = trim
+    max_crossfade_ms = crossfade_ms * BEAT_MAX_CROSSFADE_FACTOR if beat_align else crossfade_ms
+
+    def track_length(file):
+        """Trimmed length of a track; only boundary candidates without cached trim points are decoded"""
+        if file not in trims:
+            try:
+                trims[file] = compute_trim_points(os.path.join(input_folder, file))
+            except RuntimeError:
+                return None
+            index.set(file, "trim", trims[file])
+        return trims[file][1] - trims[file][0]
+
+    # Segmentas prasideda tik daina, kurios nepaliečia abu perėjimai, todėl
+    # jo pradžia visada tokia pati kaip vietiniame miksavime
+    segments = split_segments(files, len(nodes) * segments_per_node, track_length, 2 * max_crossfade_ms)
+    coordinator = RenderCoordinator(nodes, input_folder, crossfade_ms, work_dir, trims, beat_align, token)
+    coordinator.start(segments)
+
+    encoder = EncoderTee([create_encoder(target, parallel_encode) for target in outputs])
+    if limiter:
+        encoder = MasterLimiter(encoder, **limiter)
+    assembler = MixAssembler([encoder], crossfade_ms, max_crossfade_ms)
+    tracklist = []
+    track_marks = []
+    track_starts = []
+    queue_labels = {"queue": "segments", "output": os.path.basename(output_file)}
+    METRICS.set("combiner_queue_depth", coordinator.pending_count, **queue_labels)
+    METRICS.inc("combiner_renders_active")
+    try:
+        for i, segment_files in enumerate(segments):
+            if progress_callback:
+                progress_callback(i, len(segments), f"Waiting for segment {i + 1} of {len(segments)}")
+            with METRICS.timer("combiner_stage_seconds", stage="segment_wait"):
+                pcm_path, frames, marks, starts, first_ms = coordinator.wait_result(i)
+            crossfade = None
+            if beat_align and i:
+                # Segmentų sandūra derinama pagal kraštinių dainų ritmą, kaip ir tarp dainų
+                crossfade = beat_aligned_crossfade(coordinator.beats[segments[i - 1][-1]]["outro"],
+                                                   coordinator.beats[segment_files[0]]["intro"],
+                                                   crossfade_ms, max_crossfade_ms)
+            with open(pcm_path, "rb") as pcm, METRICS.timer("combiner_stage_seconds", stage="assemble_segment"):
+                start = assembler.add_pcm_file(pcm, frames, crossfade, first_ms)
+            os.remove(pcm_path)
+            METRICS.inc("combiner_tracks_rendered_total", len(segment_files))
+            track_starts += [start + local_start for local_start in starts]
+
+            # Pirmas segmento takelis perima ten, kur baigiasi perėjimas
+            track_marks.append(assembler.track_marks[-1])
+            tracklist.append(format_tracklist_entry(frames_to_ms(assembler.track_marks[-1]), segment_files[0]))
+            for file, mark in zip(segment_files[1:], marks[1:]):
+                track_marks.append(start + mark)
+                tracklist.append(format_tracklist_entry(frames_to_ms(start + mark), file))
+
+        if progress_callback:
+            progress_callback(len(segments), len(segments), "Finishing export...")
+        assembler.finish()
+        with METRICS.timer("combiner_stage_seconds", stage="encoder_flush"):
+            encoder.close()
+    except BaseException as e:
+        encoder.abort()
+        METRICS.inc("combiner_renders_total", result=render_result(e))
+        raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        METRICS.inc("combiner_renders_active", -1)
+        METRICS.remove("combiner_queue_depth", **queue_labels)
+
+    for target in outputs:
+        os.replace(target["file"] + ".part", target["file"])
+    if tracklist_file:
+        with open(tracklist_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(tracklist))
+
+    for file, trim in coordinator.trims.items():
+        if index.get(file, "trim") is None:
+            index.set(file, "trim", trim)
+    for file, grid in coordinator.beats.items():
+        if index.get(file, "beats") is None:
+            index.set(file, "beats", grid)
+    index.save()
+
+    save_mix_peaks(input_folder, files, track_starts, assembler.frames_written, output_file, index)
+    if cache:
+        cache.store(cache_key, outputs, tracklist, mix_peaks_path(output_file), track_marks)
+    METRICS.inc("combiner_renders_total", result="done")
+    return tracklist
+
+# Local render service: an asyncio HTTP API with a priority job queue.
+# Jobs run on a shared pool of render threads and share the library
+# indexes and the analysis process pool, so a library is decoded and
+# analysed once for everybody using the service.
+
+DEFAULT_SERVICE_PORT = 8765
+SERVICE_JOB_HISTORY = 200  # finished jobs kept for GET /jobs
+
+class ServiceJob:
+    """A mix job in the render service"""
+    def __init__(self, job_id, spec, priority=0):
+        self.id = job_id
+        self.spec = spec
+        self.priority = priority
+        self.status = "queued"
+        self.progress = {"done": 0, "total": 0, "text": "Queued"}
+        self.outputs = []
+        self.tracklist = []
+        self.error = None
+        self.cancel_requested = False
+        self.created = time.time()
+        self.subscribers = []
+
+    def finished(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "priority": self.priority,
+            "progress": self.progress,
+            "outputs": self.outputs,
+            "tracklist": self.tracklist,
+            "error": self.error,
+            "created": self.created,
+        }
+
+def validate_job_spec(spec, output_root):
+    """
+    Checks a job spec sent to the service; returns an error message or None.
+    Songs must be plain names inside the input folder, and the optional
+    output_folder a relative folder inside the service's output_root.
+    """
+    if not isinstance(spec, dict):
+        return "job must be a JSON object"
+    if not isinstance(spec.get("input_folder"), str) or not spec["input_folder"]:
+        return "'input_folder' is required"
+    if not os.path.isdir(spec["input_folder"]):
+        return "input folder does not exist"
+    if spec.get("output_folder") is not None:
+        try:
+            library_file_path(output_root, spec["output_folder"])
+        except ValueError:
+            return "'output_folder' must be a relative folder inside the service's output folder"
+    if "songs" in spec:
+        if not isinstance(spec["songs"], list):
+            return "'songs' must be a list of file names"
+        for song in spec["songs"]:
+            try:
+                path = library_file_path(spec["input_folder"], song)
+            except ValueError as e:
+                return str(e)
+            if not os.path.isfile(path):
+                return f"No such song: {song!r}"
+    for key in ("num_files", "priority", "crossfade_ms"):
+        if key in spec:
+            try:
+                int(spec[key])
+            except (TypeError, ValueError):
+                return f"'{key}' must be an integer"
+    if not spec.get("songs") and int(spec.get("num_files", 0)) <= 0:
+        return "either 'songs' or a positive 'num_files' is required"
+    try:
+        parse_output_targets(spec.get("formats"), "mix.mp3")
+    except ValueError as e:
+        return str(e)
+    limiter = spec.get("limiter")
+    if isinstance(limiter, dict):
+        try:
+            limiter_settings(**limiter)
+        except (TypeError, ValueError):
+            return "'limiter' takes numeric 'ceiling_db' and 'gain_db'"
+    return None
+
+class RenderService:
+    """
+    HTTP API:
+        POST   /jobs              submit {"input_folder", "output_folder", "songs" or "num_files",
+                                  "auto_order", "crossfade_ms", "beat_align", "formats", "priority",
+                                  "use_cache", "parallel_encode",
+                                  "limiter" (true or {"ceiling_db", "gain_db"})}
+        GET    /jobs              list jobs
+        GET    /jobs/<id>         job status
+        GET    /jobs/<id>/events  progress as newline-delimited JSON until the job ends
+        DELETE /jobs/<id>         cancel a job
+        GET    /metrics           runtime metrics in the Prometheus text format
+    Higher priority jobs start first; equal priorities run in submit order.
+    Every request needs "Authorization: Bearer <token>". Mixes are written
+    to output_root (or the job's "output_folder" inside it).
+    """
+    def __init__(self, token, output_root, concurrency=2, counter_file="export_counter.txt"):
+        if not token:
+            raise ValueError("The render service needs a shared token")
+        self.token = token
+        self.output_root = output_root
+        self.concurrency = concurrency
+        self.counter_file = counter_file
+        self.counter_lock = threading.Lock()
+        self.jobs = {}
+        self.sequence = 0
+        self.loop = None
+        self.queue = None
+        self.render_pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.analysis_pool = ProcessPoolExecutor()
+        METRICS.set("combiner_queue_depth", self.queued_count, queue="service_jobs")
+
+    async def serve(self, host="127.0.0.1", port=DEFAULT_SERVICE_PORT):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.PriorityQueue()
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.concurrency)]
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"Render service listening on http://{host}:{server.sockets[0].getsockname()[1]}", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self.render_pool.shutdown(wait=False, cancel_futures=True)
+            self.analysis_pool.shutdown(wait=False, cancel_futures=True)
+
+    def queued_count(self):
+        """Jobs waiting for a render thread"""
+        return sum(1 for job in list(self.jobs.values()) if job.status == "queued")
+
+    def submit(self, spec):
+        self.sequence += 1
+        job = ServiceJob(f"{self.sequence:05d}", spec, int(spec.get("priority", 0)))
+        self.jobs[job.id] = job
+        self.queue.put_nowait((-job.priority, self.sequence, job.id))
+        self.prune_jobs()
+        return job
+
+    def prune_jobs(self):
+        """Forgets the oldest finished jobs beyond SERVICE_JOB_HISTORY"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished()]
+        for job_id in finished[:max(0, len(finished) - SERVICE_JOB_HISTORY)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job):
+        job.cancel_requested = True
+        if job.status == "queued":
+            job.status = "cancelled"
+            self.notify(job)
+
+    async def worker(self):
+        """Takes jobs from the queue and runs them on the render thread pool"""
+        while True:
+            _, _, job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.finished():
+                continue
+            job.status = "running"
+            self.notify(job)
+            try:
+                await self.loop.run_in_executor(self.render_pool, self.run_job, job)
+                job.status = "done"
+            except RenderCancelled:
+                job.status = "cancelled"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+            self.notify(job)
+
+    def run_job(self, job):
+        """Render thread: selects the songs and renders the mix"""
+        spec = job.spec
+        input_folder = spec["input_folder"]
+        output_folder = library_file_path(self.output_root, spec["output_folder"]) \
+            if spec.get("output_folder") is not None else self.output_root
+        index = LibraryIndex.shared(input_folder)
+
+        def report(done, total, text):
+            if job.cancel_requested:
+                raise RenderCancelled()
+            job.progress = {"done": done, "total": total, "text": text}
+            self.loop.call_soon_threadsafe(self.notify, job)
+
+        if spec.get("songs"):
+            files = list(spec["songs"])
+        else:
+            mp3_files = [f for f in os.listdir(input_folder) if f.lower().endswith('.mp3')]
+            files = random.sample(mp3_files, min(int(spec["num_files"]), len(mp3_files)))
+            if spec.get("auto_order"):
+                report(0, len(files), "Analysing songs...")
+                files = auto_order_songs(input_folder, files, index=index, executor=self.analysis_pool)
+
+        # Rezervuoti eksporto numerį iš karto, nes keli darbai gali vykti vienu metu
+        with self.counter_lock:
+            export_counter = read_export_counter(self.counter_file)
+            write_export_counter(self.counter_file, export_counter + 1)
+
+        # "limiter": true naudoja numatytus nustatymus, objektas juos pakeičia
+        limiter = spec.get("limiter")
+        if limiter:
+            limiter = limiter_settings(**limiter) if isinstance(limiter, dict) else limiter_settings()
+
+        os.makedirs(output_folder, exist_ok=True)
+        render = MixRender.create(os.path.join(output_folder, f"{RENDER_STATE_DIR}_{job.id}"),
+                                  input_folder, files,
+                                  os.path.join(output_folder, f"Exported_Mix_{export_counter}.mp3"),
+                                  tracklist_file=os.path.join(output_folder,
+                                                              f"TimeStamps_Exported_Mix_{export_counter}.txt"),
+                                  crossfade_ms=int(spec.get("crossfade_ms", DEFAULT_CROSSFADE_MS)),
+                                  extra_formats=spec.get("formats"),
+                                  beat_align=bool(spec.get("beat_align")),
+                                  use_cache=bool(spec.get("use_cache", True)),
+                                  parallel_encode=bool(spec.get("parallel_encode", True)),
+                                  limiter=limiter)
+        try:
+            job.tracklist = render.run(progress_callback=report)
+        except RenderCancelled:
+            render.discard()
+            raise
+        job.outputs = [target["file"] for target in render.job["outputs"]]
+        job.progress = {"done": len(files), "total": len(files), "text": "Processing complete!"}
+
+    def notify(self, job):
+        """Sends the job state to everybody following its events (event loop only)"""
+        event = job.to_dict()
+        for subscriber in list(job.subscribers):
+            subscriber.put_nowait(event)
+
+    async def handle_client(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            if not request_line:
+                return
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = b""
+            if int(headers.get("content-length", 0)):
+                body = await reader.readexactly(int(headers["content-length"]))
+            if not self.authorized(headers):
+                return await self.respond(writer, 401, {"error": "missing or wrong token"})
+            await self.route(method, path.split("?")[0].rstrip("/"), body, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            print(f"Service request error: {e}")
+        finally:
+            writer.close()
+
+    def authorized(self, headers):
+        """True if the request carries the shared token"""
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode("utf-8"),
+                                                                   self.token.encode("utf-8"))
+
+    async def route(self, method, path, body, writer):
+        parts = [part for part in path.split("/") if part]
+        if parts == ["metrics"] and method == "GET":
+            return await self.respond(writer, 200, METRICS.prometheus_text(),
+                                      content_type="text/plain; version=0.0.4")
+        if parts[:1] != ["jobs"]:
+            return await self.respond(writer, 404, {"error": "not found"})
+
+        if len(parts) == 1:
+            if method == "GET":
+                return await self.respond(writer, 200, [job.to_dict() for job in self.jobs.values()])
+            if method == "POST":
+                try:
+                    spec = json.loads(body.decode("utf-8") or "{}")
+                    error = validate_job_spec(spec, self.output_root)
+                except ValueError as e:
+                    error = str(e)
+                if error:
+                    return await self.respond(writer, 400, {"error": error})
+                return await self.respond(writer, 201, self.submit(spec).to_dict())
+            return await self.respond(writer, 405, {"error": "method not allowed"})
+
+        job = self.jobs.get(parts[1])
+        if job is None:
+            return await self.respond(writer, 404, {"error": "no such job"})
+        if len(parts) == 2 and method == "GET":
+            return await self.respond(writer, 200, job.to_dict())
+        if len(parts) == 2 and method == "DELETE":
+            self.cancel(job)
+            return await self.respond(writer, 200, job.to_dict())
+        if len(parts) == 3 and parts[2] == "events" and method == "GET":
+            return await self.stream_events(writer, job)
+        return await self.respond(writer, 405, {"error": "method not allowed"})
+
+    async def respond(self, writer, status, data, content_type="application/json"):
+        """Sends data as JSON (or as is, if it is text)"""
+        body = data.encode("utf-8") if isinstance(data, str) else json.dumps(data).encode("utf-8")
+        reason = {200: "OK", 201: "Created", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                  405: "Method Not Allowed"}.get(status, "OK")
+        writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+
+    async def stream_events(self, writer, job):
+        """Streams the job state as JSON lines whenever it changes, until the job ends"""
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        events = asyncio.Queue()
+        job.subscribers.append(events)
+        try:
+            event = job.to_dict()
+            while True:
+                writer.write(json.dumps(event).encode("utf-8") + b"\n")
+                await writer.drain()
+                if event["status"] in ("done", "failed", "cancelled"):
+                    break
+                event = await events.get()
+        finally:
+            job.subscribers.remove(events)
+
+def service_request(service_url, method, path, data=None, token=None, timeout=10):
+    """Sends a request to the render service and returns the decoded JSON reply"""
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    token = token or os.environ.get(WORKER_TOKEN_ENV, "")
+    request = urllib.request.Request(service_url.rstrip("/") + path, data=body, method=method,
+                                     headers={"Content-Type": "application/json",
+                                              "Authorization": f"Bearer {token}"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read().decode("utf-8")).get("error", str(e))
+        except ValueError:
+            message = str(e)
+        raise RuntimeError(f"Render service: {message}")
+
+# Endless radio: tracks are picked, trimmed and crossfaded on the fly and the
+# encoded stream goes to stdout, FIFOs and/or HTTP listeners. Nothing grows
+# with the running time; only the playing and the next track are in memory.
+
+DEFAULT_RADIO_PORT = 8000
+RADIO_LEAD_SECONDS = 3  # how far the stream may run ahead of real time
+RADIO_HISTORY_SIZE = 50  # tracks kept in the now-playing tracklist
+RADIO_RESCAN_SECONDS = 300
+RADIO_MAX_FAILURES = 10
+
+class RadioPicker:
+    """
+    Picks the next track at random, skipping recently played ones. The
+    folder is rescanned every few minutes, so added or removed songs are
+    picked up without a restart.
+    """
+    def __init__(self, input_folder, avoid_recent=None):
+        self.input_folder = input_folder
+        self.avoid_recent = avoid_recent
+        self.library = []
+        self.recent = collections.deque()
+        self.scanned_at = None
+
+    def scan(self):
+        self.library = sorted(f for f in os.listdir(self.input_folder) if f.lower().endswith('.mp3'))
+        self.scanned_at = time.monotonic()
+
+    def next_track(self):
+        if self.scanned_at is None or time.monotonic() - self.scanned_at > RADIO_RESCAN_SECONDS:
+            self.scan()
+        if not self.library:
+            raise RuntimeError("No MP3 files found in the input folder!")
+
+        # Bent viena daina visada lieka pasirinkimui
+        if self.avoid_recent is None:
+            limit = len(self.library) // 2
+        else:
+            limit = max(0, min(self.avoid_recent, len(self.library) - 1))
+        while len(self.recent) > limit:
+            self.recent.popleft()
+
+        recent = set(self.recent)
+        choice = random.choice([f for f in self.library if f not in recent])
+        if limit:
+            self.recent.append(choice)
+        return choice
+
+class RealtimePacer:
+    """Sink that passes PCM on no faster than real time, plus a small lead"""
+
+    def __init__(self, sink, lead_seconds=RADIO_LEAD_SECONDS):
+        self.sink = sink
+        self.lead_seconds = lead_seconds
+        self.started = time.monotonic()
+        self.frames = 0
+
+    def write(self, data):
+        """Waits until data is due (write small blocks for smooth pacing)"""
+        ahead = self.frames / MIX_FRAME_RATE - (time.monotonic() - self.started)
+        if ahead > self.lead_seconds:
+            time.sleep(ahead - self.lead_seconds)
+        self.sink.write(data)
+        self.frames += len(data) // MIX_FRAME_WIDTH
+
+class StreamBroadcaster:
+    """
+    Hands the encoded stream to any number of listeners, each with its own
+    bounded queue. A blocking listener (stdout) holds the stream back when
+    it falls behind; other listeners are dropped instead, so one stalled
+    HTTP client does not stop everybody else. Listeners get b"" when they
+    are dropped and None when the stream ends.
+    """
+    def __init__(self, max_pending_blocks=64):
+        self.max_pending_blocks = max_pending_blocks
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, blocking=False):
+        pending = queue.Queue(maxsize=self.max_pending_blocks)
+        with self.lock:
+            self.listeners.append((pending, blocking))
+        return pending
+
+    def remove_listener(self, pending):
+        with self.lock:
+            self.listeners = [listener for listener in self.listeners if listener[0] is not pending]
+
+    def drop(self, pending, marker):
+        """Removes a listener and wakes it up with the marker"""
+        self.remove_listener(pending)
+        try:
+            pending.get_nowait()
+        except queue.Empty:
+            pass
+        pending.put_nowait(marker)
+
+    def write(self, data):
+        with self.lock:
+            listeners = list(self.listeners)
+        for pending, blocking in listeners:
+            if blocking:
+                pending.put(data)
+                continue
+            try:
+                pending.put_nowait(data)
+            except queue.Full:
+                self.drop(pending, b"")
+
+    def close(self):
+        with self.lock:
+            listeners = list(self.listeners)
+        for pending, blocking in listeners:
+            if blocking:
+                pending.put(None)
+            else:
+                try:
+                    pending.put_nowait(None)
+                except queue.Full:
+                    self.drop(pending, None)
+
+def feed_stream_output(broadcaster, path, stop_event):
+    """
+    Output thread: writes the stream to stdout ("-") or to a FIFO. A FIFO
+    is reopened whenever its reader goes away, so players can come and go.
+    Losing stdout stops the radio.
+    """
+    while not stop_event.is_set():
+        # FIFO atidarymas laukia, kol prisijungs skaitytojas
+        output = sys.stdout.buffer if path == "-" else open(path, "wb")
+        pending = broadcaster.add_listener(blocking=path == "-")
+        try:
+            while True:
+                data = pending.get()
+                if data is None:
+                    return
+                if not data:
+                    break
+                output.write(data)
+                output.flush()
+        except OSError:
+            if path == "-":
+                stop_event.set()
+                return
+        finally:
+            broadcaster.remove_listener(pending)
+            if path != "-":
+                try:
+                    output.close()
+                except OSError:
+                    pass
+
+class RadioRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    GET /stream (or /) plays the radio, GET /now-playing returns the rolling
+    tracklist and GET /metrics the runtime metrics (Prometheus text format)
+    """
+    def do_GET(self):
+        radio = self.server.radio
+        path = self.path.split("?")[0].rstrip("/")
+        if path in ("", "/stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            pending = radio.broadcaster.add_listener()
+            try:
+                while True:
+                    data = pending.get()
+                    if not data:
+                        break
+                    self.wfile.write(data)
+            except OSError:
+                pass
+            finally:
+                radio.broadcaster.remove_listener(pending)
+        elif path == "/now-playing":
+            self.send_body(json.dumps(radio.now_playing()).encode("utf-8"), "application/json")
+        elif path == "/metrics":
+            self.send_body(METRICS.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class RadioStream:
+    """
+    Endless mix: keeps picking tracks, trims and crossfades them with the
+    streaming assembler and encodes one continuous MP3 stream. The next
+    track is decoded in the background while the current one plays.
+    """
+    def __init__(self, input_folder, crossfade_ms=DEFAULT_CROSSFADE_MS, bitrate="320k",
+                 avoid_recent=None, tracklist_file=None, realtime=True, history_size=RADIO_HISTORY_SIZE,
+                 beat_align=False, limiter=None):
+        self.input_folder = input_folder
+        self.crossfade_ms = crossfade_ms
+        self.bitrate = bitrate
+        self.tracklist_file = tracklist_file
+        self.realtime = realtime
+        self.picker = RadioPicker(input_folder, avoid_recent)
+        self.index = LibraryIndex.shared(input_folder)
+        self.aligner = BeatAligner(input_folder, self.index, crossfade_ms) if beat_align else None
+        self.limiter = limiter
+        self.broadcaster = StreamBroadcaster()
+        self.history = collections.deque(maxlen=history_size)
+        self.stop_event = threading.Event()
+        self.started_wall = None
+        self.sink = None
+
+    def now_playing(self):
+        """The track heard right now and the rolling tracklist (oldest first)"""
+        entries = list(self.history)
+        now = time.time()
+        current = None
+        for entry in entries:
+            if entry["starts_at"] <= now:
+                current = entry
+        return {"now_playing": current, "tracklist": entries}
+
+    def load_track(self, file):
+        """Decodes and trims a track (prefetch thread); returns (audio, trim points)"""
+        audio_segment = decode_audio(os.path.join(self.input_folder, file))
+        trim = self.index.lookup(file, "trim")
+        if trim is None:
+            trim = list(find_trim_points(audio_segment))
+            self.index.set(file, "trim", trim)
+        audio_segment = audio_segment[trim[0]:trim[1]]
+        if self.aligner:
+            # Ritmo tinklelis paruošiamas iš anksto, kad perėjimas nelauktų analizės
+            track_beat_grid(self.input_folder, file, trim, self.index, audio_segment)
+        self.index.save()
+        return audio_segment, trim
+
+    def write_tracklist(self):
+        """Rewrites the rolling tracklist file with wall clock start times"""
+        if not self.tracklist_file:
+            return
+        lines = [f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['starts_at']))} {entry['title']}"
+                 for entry in self.history]
+        temp_file = self.tracklist_file + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        os.replace(temp_file, self.tracklist_file)
+
+    def pump(self, encoder):
+        """Reader thread: passes the encoded stream to the broadcaster"""
+        while True:
+            data = encoder.process.stdout.read1(64 * 1024)
+            if not data:
+                break
+            self.broadcaster.write(data)
+        self.broadcaster.close()
+
+    def run(self):
+        """Streams until stop() is called or the stream can not continue"""
+        encoder = AudioEncoder("pipe:1", "mp3", self.bitrate, stdout=subprocess.PIPE)
+        pump_thread = threading.Thread(target=self.pump, args=(encoder,), daemon=True)
+        pump_thread.start()
+        output = MasterLimiter(encoder, **self.limiter) if self.limiter else encoder
+        self.sink = RealtimePacer(output) if self.realtime else output
+        assembler = MixAssembler([self], self.crossfade_ms,
+                                 self.aligner.max_crossfade_ms if self.aligner else None)
+        prefetch = ThreadPoolExecutor(max_workers=1)
+        self.started_wall = time.time()
+        failures = 0
+        try:
+            next_file = self.picker.next_track()
+            next_track = prefetch.submit(self.load_track, next_file)
+            while not self.stop_event.is_set():
+                file, loading = next_file, next_track
+                next_file = self.picker.next_track()
+                try:
+                    audio_segment, trim = loading.result()
+                    failures = 0
+                except RuntimeError as e:
+                    print(f"Skipping {file}: {e}", file=sys.stderr)
+                    failures += 1
+                    if failures >= RADIO_MAX_FAILURES:
+                        raise
+                    audio_segment = None
+                next_track = prefetch.submit(self.load_track, next_file)
+                if audio_segment is None:
+                    continue
+
+                # Laikas, kada daina perima eterį
+                mark = assembler.position_frames()
+                self.history.append({"file": file,
+                                     "title": format_song_title(file),
+                                     "starts_at": self.started_wall + mark / MIX_FRAME_RATE})
+                self.write_tracklist()
+                print(f"Now queued: {file}", file=sys.stderr, flush=True)
+
+                crossfade_ms = self.aligner.crossfade_for(file, trim, audio_segment) if self.aligner else None
+                assembler.add_track(audio_segment, crossfade_ms)
+                METRICS.inc("combiner_tracks_rendered_total")
+                # Žymių sąrašai augtų be galo, o radijui jų nereikia
+                del assembler.track_marks[:]
+                del assembler.track_starts[:]
+
+            assembler.finish()
+            output.close()
+        except RenderCancelled:
+            output.abort()
+        except BaseException:
+            output.abort()
+            raise
+        finally:
+            prefetch.shutdown(wait=False, cancel_futures=True)
+            self.index.save()
+        pump_thread.join()
+
+    def write(self, data):
+        """Assembler sink: stops mid-track once stop() was called"""
+        view = memoryview(data)
+        block_size = MIX_FRAME_RATE // 10 * MIX_FRAME_WIDTH
+        for start in range(0, len(view), block_size):
+            if self.stop_event.is_set():
+                raise RenderCancelled()
+            self.sink.write(bytes(view[start:start + block_size]))
+
+    def stop(self):
+        self.stop_event.set()
+
+def print_progress(done, total, text):
+    """Progress callback for the command line"""
+    print(f"[{done}/{total}] {text}", flush=True)
+
+def select_cli_songs(args):
+    """Songs for a command line mix: --songs as given, otherwise a random (optionally auto-ordered) sample"""
+    if args.songs:
+        return args.songs
+    mp3_files = [f for f in os.listdir(args.input_folder) if f.lower().endswith('.mp3')]
+    selected_files = random.sample(mp3_files, min(args.num_files, len(mp3_files)))
+    if args.auto_order:
+        selected_files = auto_order_songs(args.input_folder, selected_files)
+    return selected_files
+
+def cli_limiter_settings(args):
+    """Master bus settings from --limiter, --ceiling-db and --gain-db (None when off)"""
+    if not (args.limiter or args.gain_db or args.ceiling_db is not None):
+        return None
+    return limiter_settings(LIMITER_CEILING_DB if args.ceiling_db is None else args.ceiling_db, args.gain_db)
+
+def add_limiter_arguments(parser):
+    parser.add_argument("--limiter", action="store_true",
+                        help="run the mix through a lookahead peak limiter so it never clips")
+    parser.add_argument("--ceiling-db", type=float,
+                        help=f"limiter ceiling in dBFS (default {LIMITER_CEILING_DB}; implies --limiter)")
+    parser.add_argument("--gain-db", type=float, default=0.0,
+                        help="gain applied in front of the limiter (implies --limiter)")
+
+def add_metrics_arguments(parser):
+    parser.add_argument("--metrics-file", metavar="PATH",
+                        help="keep the runtime metrics in this file (Prometheus text format)")
+    parser.add_argument("--metrics-log", metavar="PATH",
+                        help="append a JSON line with the runtime metrics to this file ('-' for stderr)")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL_SECONDS,
+                        help=f"seconds between metrics updates (default {METRICS_INTERVAL_SECONDS})")
+
+@contextlib.contextmanager
+def cli_metrics_reporter(args):
+    """Exports the metrics while a command runs, if --metrics-file or --metrics-log was given"""
+    if not (getattr(args, "metrics_file", None) or getattr(args, "metrics_log", None)):
+        yield None
+        return
+    reporter = MetricsReporter(args.metrics_file, args.metrics_log, args.metrics_interval).start()
+    try:
+        yield reporter
+    finally:
+        reporter.stop()
+
+def run_mix_command(args):
+    """Renders a mix from the command line (or resumes an unfinished one)"""
+    work_dir = os.path.join(args.output_folder, RENDER_STATE_DIR)
+    distributed = bool(args.workers or args.local_workers)
+
+    if args.resume:
+        if distributed:
+            print("--resume is not supported for distributed renders")
+            return 1
+        render = MixRender.load(work_dir)
+        if render is None:
+            print(f"No unfinished mix found in {args.output_folder}")
+            return 1
+        print(f"Resuming from song {render.state['next_track'] + 1} of {len(render.job['files'])}")
+    else:
+        if not args.input_folder or not os.path.isdir(args.input_folder):
+            print("Input folder does not exist!")
+            return 1
+
+        selected_files = select_cli_songs(args)
+        if not selected_files:
+            print("No MP3 files found in the input folder!")
+            return 1
+
+        export_counter = read_export_counter(args.counter_file)
+        output_file = os.path.join(args.output_folder, f"Exported_Mix_{export_counter}.mp3")
+        tracklist_file = os.path.join(args.output_folder, f"TimeStamps_Exported_Mix_{export_counter}.txt")
+
+        if distributed:
+            nodes = [parse_node(address) for address in args.workers or []]
+            token = args.worker_token or os.environ.get(WORKER_TOKEN_ENV)
+            if args.workers and not token:
+                print(f"Remote workers need their token (--worker-token or {WORKER_TOKEN_ENV})")
+                return 1
+            # Vietiniai darbininkai gauna atsitiktinį raktą, jei jis nenurodytas
+            token = token or secrets.token_hex(16)
+            processes = []
+            if args.local_workers:
+                local_nodes, processes = start_local_workers(args.local_workers, args.input_folder, token)
+                nodes += local_nodes
+            os.makedirs(args.output_folder, exist_ok=True)
+            try:
+                render_distributed(nodes, args.input_folder, selected_files, output_file, tracklist_file,
+                                   crossfade_ms=args.crossfade_ms, extra_formats=args.formats,
+                                   progress_callback=print_progress, beat_align=args.beat_align,
+                                   use_cache=not args.no_cache, parallel_encode=not args.single_encoder,
+                                   limiter=cli_limiter_settings(args), token=token)
+            finally:
+                for process in processes:
+                    process.terminate()
+            write_export_counter(args.counter_file, export_counter + 1)
+            for target in parse_output_targets(args.formats, output_file):
+                print(f"Saved: {target['file']}")
+            return 0
+
+        render = MixRender.create(work_dir, args.input_folder, selected_files, output_file,
+                                  tracklist_file=tracklist_file,
+                                  crossfade_ms=args.crossfade_ms,
+                                  extra_formats=args.formats,
+                                  beat_align=args.beat_align,
+                                  use_cache=not args.no_cache,
+                                  parallel_encode=not args.single_encoder,
+                                  limiter=cli_limiter_settings(args))
+
+    try:
+        render.run(progress_callback=print_progress)
+    except KeyboardInterrupt:
+        print("Cancelled - run again with --resume to continue")
+        return 1
+
+    write_export_counter(args.counter_file, read_export_counter(args.counter_file) + 1)
+    for target in render.job["outputs"]:
+        print(f"Saved: {target['file']}")
+    return 0
+
+def run_worker_command(args):
+    """Runs a render worker node"""
+    token = args.token or os.environ.get(WORKER_TOKEN_ENV)
+    if not token:
+        print(f"Set the shared worker token with --token or {WORKER_TOKEN_ENV}")
+        return 1
+    if not os.path.isdir(args.input_folder):
+        print("Input folder does not exist!")
+        return 1
+    try:
+        run_worker(args.input_folder, token, args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_serve_command(args):
+    """Runs the local render service"""
+    token = args.token or os.environ.get(WORKER_TOKEN_ENV)
+    if not token:
+        print(f"Set the shared service token with --token or {WORKER_TOKEN_ENV}")
+        return 1
+    os.makedirs(args.output_folder, exist_ok=True)
+    service = RenderService(token, os.path.abspath(args.output_folder), concurrency=args.workers,
+                            counter_file=args.counter_file)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def run_radio_command(args):
+    """Runs the endless radio stream until interrupted"""
+    if not os.path.isdir(args.input_folder):
+        print("Input folder does not exist!", file=sys.stderr)
+        return 1
+    outputs = args.output or ([] if args.http_port else ["-"])
+    radio = RadioStream(args.input_folder, crossfade_ms=args.crossfade_ms, bitrate=args.bitrate,
+                        avoid_recent=args.avoid_recent, tracklist_file=args.tracklist,
+                        realtime=not args.no_realtime, beat_align=args.beat_align,
+                        limiter=cli_limiter_settings(args))
+
+    for path in outputs:
+        threading.Thread(target=feed_stream_output, args=(radio.broadcaster, path, radio.stop_event),
+                         daemon=True).start()
+    server = None
+    if args.http_port:
+        server = http.server.ThreadingHTTPServer((args.host, args.http_port), RadioRequestHandler)
+        server.radio = radio
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Radio listening on http://{args.host}:{server.server_address[1]}/stream", file=sys.stderr, flush=True)
+
+    try:
+        radio.run()
+    except KeyboardInterrupt:
+        radio.stop()
+    finally:
+        if server is not None:
+            server.shutdown()
+    return 0
+
+def run_import_command(args):
+    """Imports songs into the library folder and analyses them"""
+    if not os.path.isdir(args.input_folder):
+        print("Input folder does not exist!")
+        return 1
+    result = import_songs(args.input_folder, args.sources, allow_hardlink=not args.copy,
+                          max_workers=args.jobs, progress_callback=print_progress)
+    for source in result["unmatched"]:
+        print(f"No MP3 files found: {source}")
+    for path in result["invalid"]:
+        print(f"Not a valid MP3: {path}")
+    for path, error in result["failed"].items():
+        print(f"Could not import {path}: {error}")
+    print(f"Imported {len(result['imported'])} songs, skipped {len(result['duplicates'])} duplicates, "
+          f"rejected {len(result['invalid'])} invalid files")
+
+    if not args.no_analysis and result["imported"]:
+        errors = analyze_library_files(args.input_folder, list(result["imported"].values()),
+                                       progress_callback=print_progress)
+        for filename, error in errors.items():
+            print(f"Could not analyse {filename}: {error}")
+    return 1 if result["failed"] else 0
+
+def parse_args(argv=None):
+    """Command line options. Without a command the GUI is started."""
+    parser = argparse.ArgumentParser(description="Audio Combiner")
+    subparsers = parser.add_subparsers(dest="command")
+
+    mix_parser = subparsers.add_parser("mix", help="render a mix without the GUI")
+    mix_parser.add_argument("--input-folder", help="folder with MP3 files")
+    mix_parser.add_argument("--output-folder", required=True, help="folder for the mix and tracklist")
+    mix_parser.add_argument("--songs", nargs="+", help="songs (file names in the input folder) in mix order")
+    mix_parser.add_argument("--num-files", type=int, default=20, help="number of random songs")
+    mix_parser.add_argument("--auto-order", action="store_true", help="order random songs by tempo, key and energy")
+    mix_parser.add_argument("--crossfade-ms", type=int, default=DEFAULT_CROSSFADE_MS)
+    mix_parser.add_argument("--beat-align", action="store_true",
+                            help="line crossfades up with the beats (length varies per join)")
+    mix_parser.add_argument("--formats", nargs="+", metavar="FORMAT",
+                            help="extra outputs from the same render, e.g. mp3:128k opus:96k flac")
+    add_limiter_arguments(mix_parser)
+    mix_parser.add_argument("--counter-file", default="export_counter.txt")
+    mix_parser.add_argument("--no-cache", action="store_true",
+                            help="always render, even if an identical mix is in the render cache")
+    mix_parser.add_argument("--single-encoder", action="store_true",
+                            help="encode MP3 outputs with one encoder instead of parallel chunks")
+    mix_parser.add_argument("--resume", action="store_true", help="continue the unfinished mix in the output folder")
+    mix_parser.add_argument("--workers", nargs="+", metavar="HOST:PORT",
+                            help="render segments on these worker nodes (started with the 'worker' command)")
+    mix_parser.add_argument("--local-workers", type=int, default=0,
+                            help="number of local worker processes to render segments on")
+    mix_parser.add_argument("--worker-token", help=f"shared secret of the --workers nodes (default: ${WORKER_TOKEN_ENV})")
+    add_metrics_arguments(mix_parser)
+    mix_parser.set_defaults(func=run_mix_command)
+
+    worker_parser = subparsers.add_parser("worker", help="run a render worker node for distributed mixes")
+    worker_parser.add_argument("--host", default="127.0.0.1",
+                               help="address to listen on (use 0.0.0.0 to accept other machines)")
+    worker_parser.add_argument("--port", type=int, default=DEFAULT_WORKER_PORT)
+    worker_parser.add_argument("--input-folder", required=True,
+                               help="library folder on this node; songs outside it are refused")
+    worker_parser.add_argument("--token", help=f"shared secret of the coordinator and workers "
+                                               f"(default: ${WORKER_TOKEN_ENV})")
+    add_metrics_arguments(worker_parser)
+    worker_parser.set_defaults(func=run_worker_command)
+
+    serve_parser = subparsers.add_parser("serve", help="run the local render service (HTTP job queue)")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_SERVICE_PORT)
+    serve_parser.add_argument("--workers", type=int, default=2, help="number of mixes rendered at the same time")
+    serve_parser.add_argument("--counter-file", default="export_counter.txt")
+    serve_parser.add_argument("--output-folder", default="service_exports",
+                              help="folder the service writes every mix to (jobs may name a subfolder)")
+    serve_parser.add_argument("--token", help=f"shared token clients must send (default: ${WORKER_TOKEN_ENV})")
+    add_metrics_arguments(serve_parser)
+    serve_parser.set_defaults(func=run_serve_command)
+
+    import_parser = subparsers.add_parser("import", help="import songs into the library folder")
+    import_parser.add_argument("sources", nargs="+", help="MP3 files, folders or glob patterns (e.g. 'music/**/*.mp3')")
+    import_parser.add_argument("--input-folder", required=True, help="library folder to import into")
+    import_parser.add_argument("--copy", action="store_true",
+                               help="always make full copies instead of hard links (reflinks are still used)")
+    import_parser.add_argument("--jobs", type=int, help="number of parallel copy threads")
+    import_parser.add_argument("--no-analysis", action="store_true",
+                               help="skip trim point and loudness analysis of the imported songs")
+    import_parser.set_defaults(func=run_import_command)
+
+    radio_parser = subparsers.add_parser("radio", help="stream an endless mix")
+    radio_parser.add_argument("--input-folder", required=True, help="folder with MP3 files")
+    radio_parser.add_argument("--output", nargs="+", metavar="PATH",
+                              help="'-' for stdout or FIFO paths (default: stdout unless --http-port is given)")
+    radio_parser.add_argument("--http-port", type=int, help="also serve the stream on http://HOST:PORT/stream")
+    radio_parser.add_argument("--host", default="127.0.0.1")
+    radio_parser.add_argument("--bitrate", default="320k")
+    radio_parser.add_argument("--crossfade-ms", type=int, default=DEFAULT_CROSSFADE_MS)
+    radio_parser.add_argument("--beat-align", action="store_true", help="line crossfades up with the beats")
+    add_limiter_arguments(radio_parser)
+    radio_parser.add_argument("--avoid-recent", type=int,
+                              help="number of recent songs not to repeat (default: half the library)")
+    radio_parser.add_argument("--tracklist", help="file with the rolling now-playing tracklist")
+    radio_parser.add_argument("--no-realtime", action="store_true",
+                              help="do not pace the stream (the reader sets the speed)")
+    add_metrics_arguments(radio_parser)
+    radio_parser.set_defaults(func=run_radio_command)
+
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.command:
+        with cli_metrics_reporter(args):
+            status = args.func(args)
+        sys.exit(status)
     root = tk.Tk()
     app = AudioCombinerGUI(root)
     root.mainloop() 
\ No newline at end of file
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+
+# combine_audio.py is a single module in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import combine_audio as ca
+
+# (seconds, tone Hz, beats per minute): short tracks make the render shift its segment joins
+LIBRARY_TRACKS = [(4, 220, 120), (3, 330, 124), (0.6, 440, 120), (5, 275, 128),
+                  (1.5, 392, 120), (4, 247, 126), (3, 349, 120), (0.6, 523, 122)]
+
+def track_pcm(seconds, frequency, bpm, silence=0.3):
+    """A tone with a kick on every beat between two short silences, as mix PCM"""
+    t = np.arange(int(seconds * ca.MIX_FRAME_RATE)) / ca.MIX_FRAME_RATE
+    signal = 0.25 * np.sin(2 * np.pi * frequency * t)
+    kick = np.sin(2 * np.pi * 60 * t[:2000]) * np.exp(-np.arange(2000) / 300) * 0.6
+    beat = int(ca.MIX_FRAME_RATE * 60 / bpm)
+    for start in range(0, len(t) - len(kick), beat):
+        signal[start:start + len(kick)] += kick
+    gap = np.zeros(int(silence * ca.MIX_FRAME_RATE))
+    signal = np.concatenate([gap, signal, gap])
+    stereo = np.stack([signal, signal * 0.9], axis=1)
+    return (np.clip(stereo, -1, 1) * 32000).astype("<i2").tobytes()
+
+@pytest.fixture(scope="session")
+def library(tmp_path_factory):
+    """A small library of generated MP3s; returns (folder, song names in order)"""
+    folder = tmp_path_factory.mktemp("library")
+    names = []
+    for number, (seconds, frequency, bpm) in enumerate(LIBRARY_TRACKS, 1):
+        name = f"{number:02d}. Track_{number}.mp3"
+        AudioSegment(track_pcm(seconds, frequency, bpm), frame_rate=ca.MIX_FRAME_RATE,
+                     sample_width=ca.MIX_SAMPLE_WIDTH, channels=ca.MIX_CHANNELS).export(
+            str(folder / name), format="mp3", bitrate="192k")
+        names.append(name)
+    return str(folder), names
@@ -0,0 +1,36 @@
+"""
+A mix rendered on several local workers must match a MixRender of the same
+songs byte for byte, including short and repeated tracks around segment
+joins and beat-aligned joins.
+"""
+import pytest
+
+import combine_audio as ca
+
+TOKEN = "test-token"
+
+@pytest.fixture(scope="module")
+def workers(library):
+    """Three render worker processes on the test library"""
+    nodes, processes = ca.start_local_workers(3, library[0], TOKEN)
+    yield nodes
+    for process in processes:
+        process.terminate()
+        process.join()
+
+@pytest.mark.parametrize("beat_align", [False, True])
+def test_matches_local_render(library, workers, tmp_path, beat_align):
+    folder, names = library
+    # Trumpi ir pasikartojantys takeliai patenka ir prie segmentų sandūrų
+    files = names + names[:3] + names[2:5]
+    tracklist = ca.render_distributed(workers, folder, files, str(tmp_path / "distributed.mp3"),
+                                      tracklist_file=str(tmp_path / "distributed.txt"), segments_per_node=2,
+                                      beat_align=beat_align, use_cache=False, parallel_encode=False,
+                                      token=TOKEN)
+    local = ca.MixRender.create(str(tmp_path / ".render"), folder, files, str(tmp_path / "local.mp3"),
+                                tracklist_file=str(tmp_path / "local.txt"), beat_align=beat_align,
+                                use_cache=False, parallel_encode=False)
+    assert tracklist == local.run()
+    assert len(tracklist) == len(files)
+    assert (tmp_path / "distributed.txt").read_bytes() == (tmp_path / "local.txt").read_bytes()
+    assert (tmp_path / "distributed.mp3").read_bytes() == (tmp_path / "local.mp3").read_bytes()
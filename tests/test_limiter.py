@@ -0,0 +1,67 @@
+"""
+MasterLimiter must keep every sample at or below the ceiling, keep the
+length of the mix, and pass a signal that never reaches the ceiling
+through unchanged.
+"""
+import numpy as np
+import pytest
+
+import combine_audio as ca
+
+class CollectingSink:
+    """Keeps everything written to it"""
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+
+    def close(self):
+        self.closed = True
+
+    def abort(self):
+        pass
+
+def tone_pcm(seconds, amplitude, seed=1):
+    """Chords with kicks and noise bursts at the given peak level, as mix PCM"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * ca.MIX_FRAME_RATE)) / ca.MIX_FRAME_RATE
+    signal = np.sin(2 * np.pi * 110 * t) * 0.4 + np.sin(2 * np.pi * 440 * t) * 0.2
+    for start in range(0, len(t) - 2000, ca.MIX_FRAME_RATE // 2):
+        signal[start:start + 2000] += np.exp(-np.arange(2000) / 300) * rng.choice([-0.4, 0.4])
+    signal += rng.standard_normal(len(t)) * 0.02
+    signal = signal / np.abs(signal).max() * amplitude
+    return (np.stack([signal, -signal * 0.8], axis=1) * 32767).astype("<i2").tobytes()
+
+def limit(pcm, **settings):
+    """Runs pcm through a limiter in odd sized writes; returns (limiter, output samples)"""
+    sink = CollectingSink()
+    limiter = ca.MasterLimiter(sink, **settings)
+    # Nelygūs gabalai, kad blokų ir vėlinimo ribos nesutaptų
+    step = 7919 * ca.MIX_FRAME_WIDTH
+    for start in range(0, len(pcm), step):
+        limiter.write(pcm[start:start + step])
+    limiter.close()
+    assert sink.closed
+    return limiter, np.frombuffer(bytes(sink.data), dtype="<i2")
+
+@pytest.mark.parametrize("ceiling_db, gain_db", [(-1.0, 12.0), (-3.0, 6.0), (-0.1, 20.0)])
+def test_hot_signal_stays_under_ceiling(ceiling_db, gain_db):
+    pcm = tone_pcm(3, 0.9)
+    limiter, output = limit(pcm, ceiling_db=ceiling_db, gain_db=gain_db)
+    assert len(output) * 2 == len(pcm)
+    assert np.abs(output.astype(np.int32)).max() <= limiter.limit
+    assert limiter.max_reduction_db < -gain_db / 2
+    # Ribotuvas mažina garsumą iš anksto, o ne nukerpa viršūnes
+    assert np.count_nonzero(np.abs(output.astype(np.int32)) >= limiter.limit) < len(output) // 1000
+
+def test_quiet_signal_passes_unchanged():
+    pcm = tone_pcm(2, 0.5)
+    limiter, output = limit(pcm, ceiling_db=-1.0)
+    assert output.tobytes() == pcm
+    assert limiter.max_reduction_db == 0.0
+
+def test_empty_stream():
+    limiter, output = limit(b"")
+    assert len(output) == 0
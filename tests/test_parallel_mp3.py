@@ -0,0 +1,124 @@
+"""
+Checks ParallelMp3Encoder against a single encoder on a short generated
+signal. Small chunks give many splices: the joined file must decode
+without errors to exactly the input length (gapless header), the
+Xing/LAME fields and CRCs must be right, every frame's reservoir
+reference must be valid, and the error around each splice must be no
+worse than the single encoder's there.
+"""
+import math
+import struct
+import subprocess
+
+import numpy as np
+import pytest
+
+import combine_audio as ca
+
+SECONDS = 20
+CHUNK_FRAMES = 100
+
+def signal_pcm(seconds, seed=1):
+    """Chords, kicks and noise bursts as raw mix PCM; exercises long and short MP3 blocks"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * ca.MIX_FRAME_RATE)) / ca.MIX_FRAME_RATE
+    signal = np.zeros((len(t), ca.MIX_CHANNELS))
+    for frequency in (110, 220, 277.2, 329.6, 440, 660):
+        signal[:, 0] += 0.05 * np.sin(2 * np.pi * frequency * t + rng.random())
+        signal[:, 1] += 0.05 * np.sin(2 * np.pi * frequency * 1.003 * t)
+    hit = np.exp(-np.arange(4000) / 400)
+    kick = np.sin(2 * np.pi * 60 * np.arange(4000) / ca.MIX_FRAME_RATE) * hit * 0.6
+    beat = int(ca.MIX_FRAME_RATE * 60 / 124)
+    for start in range(0, len(t) - 4000 - beat, beat):
+        signal[start:start + 4000] += kick[:, None]
+        signal[start + beat // 2:start + beat // 2 + 4000] += rng.standard_normal((4000, 2)) * 0.2 * hit[:, None]
+    signal += rng.standard_normal(signal.shape) * 0.01
+    return (np.clip(signal, -1, 1) * 32000).astype("<i2").tobytes()
+
+def encode(encoder, pcm):
+    for start in range(0, len(pcm), ca.EncoderTee.BLOCK_SIZE):
+        encoder.write(pcm[start:start + ca.EncoderTee.BLOCK_SIZE])
+    encoder.close()
+    return encoder
+
+def decode(path):
+    result = subprocess.run([ca.AudioSegment.converter, "-v", "error", "-i", str(path), "-f", "s16le", "-"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    assert not result.stderr.strip(), result.stderr.decode(errors="ignore")
+    return np.frombuffer(result.stdout, dtype="<i2").reshape(-1, ca.MIX_CHANNELS).astype(np.float64)
+
+@pytest.fixture(scope="module", params=["320k", "128k"])
+def encoded(request, tmp_path_factory):
+    """The test signal encoded in chunks and with a single encoder"""
+    work_dir = tmp_path_factory.mktemp("mp3")
+    pcm = signal_pcm(SECONDS)
+    parallel = encode(ca.ParallelMp3Encoder(str(work_dir / "parallel.mp3"), request.param, 2, CHUNK_FRAMES), pcm)
+    encode(ca.AudioEncoder(str(work_dir / "single.mp3"), "mp3", request.param), pcm)
+    return {"pcm": pcm, "encoder": parallel,
+            "data": (work_dir / "parallel.mp3").read_bytes(),
+            "parallel": decode(work_dir / "parallel.mp3"),
+            "single": decode(work_dir / "single.mp3")}
+
+def test_chunks_are_spliced(encoded):
+    assert len(encoded["encoder"].splices) >= 3
+
+def test_xing_header(encoded):
+    data = encoded["data"]
+    xing_size = encoded["encoder"].xing_size
+    frames = ca.parse_mp3_frames(data[xing_size:])
+    x = 4 + ca.mp3_side_info_size(data[:4])
+    assert data[x:x + 4] == b"Info"
+    frame_count, byte_count = struct.unpack(">II", data[x + 8:x + 16])
+    assert (frame_count, byte_count) == (len(frames), len(data))
+    lame = x + 120
+    music_crc, tag_crc = struct.unpack(">HH", data[lame + 32:lame + 36])
+    assert tag_crc == ca.crc16_arc(data[:lame + 34])
+    assert music_crc == ca.crc16_arc(data[xing_size:])
+
+def test_reservoir_references(encoded):
+    frames = ca.parse_mp3_frames(encoded["data"][encoded["encoder"].xing_size:])
+    positions = ca.reservoir_positions(frames)
+    used_until = 0
+    for number, frame in enumerate(frames):
+        # Kadro pagrindiniai duomenys turi prasidėti ten, kur baigėsi ankstesnio
+        assert positions[number] - frame.main_data_begin >= used_until, f"frame {number}"
+        used_until = positions[number] - frame.main_data_begin + frame.main_data_size
+
+def test_gapless_length(encoded):
+    assert len(encoded["parallel"]) * ca.MIX_FRAME_WIDTH == len(encoded["pcm"])
+
+def test_splices_no_worse_than_single_encoder(encoded):
+    source = np.frombuffer(encoded["pcm"], dtype="<i2").reshape(-1, ca.MIX_CHANNELS).astype(np.float64)
+    length = min(len(source), len(encoded["parallel"]), len(encoded["single"]))
+    power = (source[:length] ** 2).sum(axis=1)
+    errors = {name: ((encoded[name][:length] - source[:length]) ** 2).sum(axis=1)
+              for name in ("parallel", "single")}
+
+    def snr(name, start, end):
+        return 10 * math.log10((power[start:end].sum() + 1) / (errors[name][start:end].sum() + 1))
+
+    assert snr("parallel", 0, length) > snr("single", 0, length) - 0.5
+    # Kadro pradžia išvestyje: koduotuvo (576) ir dekoderio (529) vėlinimas
+    for frame_number in encoded["encoder"].splices:
+        center = frame_number * ca.MP3_FRAME_SAMPLES - ca.LAME_ENCODER_DELAY - 529
+        start, end = max(0, center - ca.MP3_FRAME_SAMPLES), min(length, center + ca.MP3_FRAME_SAMPLES)
+        if start < end:
+            assert snr("parallel", start, end) > snr("single", start, end) - 3, f"splice at frame {frame_number}"
+
+def test_empty_stream(tmp_path):
+    path = tmp_path / "empty.mp3"
+    encoder = ca.ParallelMp3Encoder(str(path), "320k", 2, CHUNK_FRAMES)
+    encoder.write(b"")
+    encoder.close()
+    assert path.read_bytes() == b""
+    assert list(tmp_path.iterdir()) == [path]
+
+def test_short_stream(tmp_path):
+    pcm = signal_pcm(0.01)
+    encoder = encode(ca.ParallelMp3Encoder(str(tmp_path / "short.mp3"), "320k", 2, CHUNK_FRAMES), pcm)
+    assert not encoder.splices
+    assert len(decode(tmp_path / "short.mp3")) * ca.MIX_FRAME_WIDTH == len(pcm)
+
+def test_side_info_size():
+    assert ca.mp3_side_info_size(bytes([0xFF, 0xFB, 0x90, 0x44])) == 32  # joint stereo
+    assert ca.mp3_side_info_size(bytes([0xFF, 0xFB, 0x90, 0xC4])) == 17  # mono
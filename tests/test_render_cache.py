@@ -0,0 +1,91 @@
+"""
+RenderCache: an identical render is reused, a change to any setting that
+affects the output misses the cache, and eviction keeps the cache under
+its size cap by dropping the least recently used renders first.
+"""
+import os
+import shutil
+
+import pytest
+
+import combine_audio as ca
+
+REUSED = "Reused an identical earlier render"
+
+BASE = {"crossfade_ms": 1000, "extra_formats": None, "limiter": None}
+
+CHANGES = {
+    "crossfade": {"crossfade_ms": 500},
+    "limiter": {"limiter": ca.limiter_settings(gain_db=3)},
+    "limiter_ceiling": {"limiter": ca.limiter_settings(ceiling_db=-2)},
+    "format": {"extra_formats": ["flac"]},
+    "bitrate": {"extra_formats": ["mp3:128k"]},
+}
+
+@pytest.fixture
+def cached_library(library):
+    """The test library with an empty render cache"""
+    shutil.rmtree(os.path.join(library[0], ca.CACHE_DIR_NAME, ca.RENDER_CACHE_DIR), ignore_errors=True)
+    return library
+
+def render(folder, files, out_dir, name, **settings):
+    """Renders with the cache on; returns (reused from the cache, mp3 bytes)"""
+    messages = []
+    mix = ca.MixRender.create(str(out_dir / f".render_{name}"), folder, files, str(out_dir / f"{name}.mp3"),
+                              parallel_encode=False, use_cache=True, **dict(BASE, **settings))
+    mix.run(lambda done, total, text: messages.append(text))
+    return REUSED in messages, (out_dir / f"{name}.mp3").read_bytes()
+
+def test_identical_render_hits(cached_library, tmp_path):
+    folder, names = cached_library
+    files = names[:3]
+    first = render(folder, files, tmp_path, "first")
+    again = render(folder, files, tmp_path, "again")
+    assert (first[0], again[0]) == (False, True)
+    assert again[1] == first[1]
+
+@pytest.mark.parametrize("change", list(CHANGES))
+def test_output_setting_change_misses(cached_library, tmp_path, change):
+    folder, names = cached_library
+    files = names[:3]
+    render(folder, files, tmp_path, "base")
+    assert render(folder, files, tmp_path, "changed", **CHANGES[change])[0] is False
+    # Pakeistas variantas saugomas atskirai ir toliau randamas
+    assert render(folder, files, tmp_path, "changed_again", **CHANGES[change])[0] is True
+    assert render(folder, files, tmp_path, "base_again")[0] is True
+
+def test_song_order_misses(cached_library, tmp_path):
+    folder, names = cached_library
+    render(folder, names[:3], tmp_path, "base")
+    assert render(folder, names[2::-1], tmp_path, "reversed")[0] is False
+
+def store_fake(cache, tmp_path, key, size, used):
+    """Stores a render of one output of size bytes, last used at the given time"""
+    output = tmp_path / f"{key}.mp3"
+    output.write_bytes(b"\0" * size)
+    cache.store(key, [{"file": str(output)}], [key])
+    os.utime(os.path.join(cache.entry_dir(key), "render.json"), (used, used))
+
+def cache_size(cache):
+    return sum(os.path.getsize(os.path.join(root, file))
+               for root, _, files in os.walk(cache.cache_dir) for file in files)
+
+def test_eviction_respects_size_cap(tmp_path):
+    folder = tmp_path / "library"
+    folder.mkdir()
+    cache = ca.RenderCache(str(folder), max_bytes=10 ** 9)
+    for number in range(6):
+        store_fake(cache, tmp_path, f"render{number}", 10000, 1000000 + number)
+    entry_size = cache_size(cache) // 6
+
+    # render1 neseniai paimtas iš talpyklos, todėl išlieka
+    assert cache.restore("render1", [{"file": str(tmp_path / "restored.mp3")}]) == (["render1"], None)
+    cache.max_bytes = 4 * entry_size + entry_size // 2
+    store_fake(cache, tmp_path, "render6", 10000, 1000006)
+    assert cache_size(cache) <= cache.max_bytes
+    assert sorted(os.listdir(cache.cache_dir)) == ["render1", "render4", "render5", "render6"]
+
+    # Naujausias įrašas lieka net tada, kai vienas netelpa į ribą
+    cache.max_bytes = entry_size // 2
+    store_fake(cache, tmp_path, "render7", 10000, 1000007)
+    assert os.listdir(cache.cache_dir) == ["render7"]
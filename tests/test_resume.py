@@ -0,0 +1,58 @@
+"""
+A render interrupted after a few tracks and resumed from its checkpoint
+must produce exactly the bytes of an uninterrupted render.
+"""
+import os
+
+import pytest
+
+import combine_audio as ca
+
+INTERRUPT_AFTER = 4
+
+CASES = {
+    "plain": {},
+    "parallel_encode": {"parallel_encode": True},
+    "limiter_beats_formats": {"limiter": ca.limiter_settings(gain_db=6), "beat_align": True,
+                              "extra_formats": ["flac", "mp3:128k"]},
+}
+
+class SmallChunkMp3Encoder(ca.ParallelMp3Encoder):
+    """Chunks of 40 frames, so a few seconds of mix are spliced several times"""
+    def __init__(self, output_file, bitrate="320k"):
+        super().__init__(output_file, bitrate, max_workers=2, chunk_frames=40)
+
+def render(folder, files, out_dir, name, interrupt_after=None, **options):
+    """Renders files to out_dir/name.mp3; returns {file name: bytes} of every output and the tracklist"""
+    work_dir = str(out_dir / f".render_{name}")
+    options = dict({"parallel_encode": False}, **options)
+    mix = ca.MixRender.create(work_dir, folder, files, str(out_dir / f"{name}.mp3"),
+                              tracklist_file=str(out_dir / f"{name}.txt"), use_cache=False, **options)
+    if interrupt_after is not None:
+        def stop(done, total, text):
+            if done == interrupt_after:
+                raise ca.RenderCancelled()
+
+        with pytest.raises(ca.RenderCancelled):
+            mix.run(stop)
+        # Kaip po programos paleidimo iš naujo: indeksas ir būsena skaitomi iš disko
+        ca.LibraryIndex.shared_instances.clear()
+        mix = ca.MixRender.load(work_dir)
+        assert mix.state["next_track"] == interrupt_after
+    mix.run()
+    outputs = [target["file"] for target in mix.job["outputs"]] + [mix.job["tracklist_file"]]
+    return {os.path.basename(path).replace(name, "mix"): open(path, "rb").read() for path in outputs}
+
+@pytest.mark.parametrize("case", list(CASES))
+def test_resumed_render_is_identical(library, tmp_path, monkeypatch, case):
+    if CASES[case].get("parallel_encode"):
+        monkeypatch.setattr(ca.os, "cpu_count", lambda: 4)
+        monkeypatch.setattr(ca, "ParallelMp3Encoder", SmallChunkMp3Encoder)
+    folder, names = library
+    files = names + names[:2]
+    clean = render(folder, files, tmp_path, "clean", **CASES[case])
+    resumed = render(folder, files, tmp_path, "resumed", INTERRUPT_AFTER, **CASES[case])
+    assert len(clean) == len(ca.parse_output_targets(CASES[case].get("extra_formats"), "mix.mp3")) + 1
+    assert clean.keys() == resumed.keys()
+    for path in clean:
+        assert clean[path] == resumed[path], path
@@ -0,0 +1,34 @@
+"""
+Smoke test of the selector stress benchmark on small libraries, so the
+headless harness keeps working when the selector changes.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import stress_selector
+
+OPERATIONS = {"load", "load_longest_tick", "restore", "filter", "filter_clear", "add", "move_up", "move_down",
+              "move_to_top", "move_to_bottom", "shuffle", "remove"}
+
+def test_every_operation_is_timed(tmp_path):
+    results = stress_selector.stress_selector([1000], repeats=1, folder=str(tmp_path))
+    assert list(results) == [1000]
+    assert set(results[1000]) == OPERATIONS
+    assert all(seconds >= 0 for seconds in results[1000].values())
+    assert len(os.listdir(tmp_path / "library_1000")) == 1000 + 1000 // 200 + 1000 // 500
+
+def test_report(tmp_path, capsys):
+    assert stress_selector.main(["--sizes", "1000", "500", "--repeats", "1", "--folder", str(tmp_path),
+                                 "--max-exponent", "100"]) == 0
+    report = capsys.readouterr().out
+    assert all(operation in report for operation in OPERATIONS)
+    assert "n^" in report
+
+def test_scaling_exponent():
+    assert stress_selector.scaling_exponent([100, 1000, 10000], [1, 10, 100]) == pytest.approx(1)
+    assert stress_selector.scaling_exponent([100, 1000], [1, 100]) == pytest.approx(2)
+    assert stress_selector.scaling_exponent([1000], [1]) is None
@@ -0,0 +1,41 @@
+"""
+A song that cannot be decoded must not throw away the trim points already
+computed for the others.
+"""
+import json
+import os
+import shutil
+
+import pytest
+
+import combine_audio as ca
+
+@pytest.fixture
+def broken_library(library, tmp_path):
+    """Three songs of the test library and one MP3 that is not audio"""
+    folder, names = library
+    for name in names[:3]:
+        shutil.copy(os.path.join(folder, name), tmp_path / name)
+    (tmp_path / "99. Broken.mp3").write_bytes(b"not an mp3" * 100)
+    yield str(tmp_path), names[:3] + ["99. Broken.mp3"]
+    ca.LibraryIndex.shared_instances.pop(os.path.abspath(tmp_path), None)
+
+@pytest.mark.parametrize("count", [2, 4])
+def test_failing_song_is_skipped(broken_library, count):
+    folder, files = broken_library
+    files = files[-count:]
+    # Vienas jau žinomas, tad su count=2 skaičiuojama be procesų telkinio
+    ca.ensure_trim_points(folder, files[:1], ca.LibraryIndex.shared(folder))
+    trims = ca.ensure_trim_points(folder, files, ca.LibraryIndex.shared(folder), max_workers=2)
+    assert sorted(trims) == sorted(files[:-1])
+    with open(os.path.join(folder, ca.CACHE_DIR_NAME, "library.json"), encoding="utf-8") as f:
+        saved = json.load(f)
+    for file in files[:-1]:
+        assert saved[file]["trim"] == trims[file]
+
+def test_previews_skip_failing_song(broken_library):
+    folder, files = broken_library
+    previews = ca.preview_all_transitions(folder, files, max_workers=2)
+    assert [preview is not None for preview in previews] == [True, True, False]
+    with pytest.raises(ValueError):
+        ca.preview_transition(folder, files[2], files[3])